@@ -0,0 +1,165 @@
+#!/usr/bin/env python
+from __future__ import annotations
+from typing import Callable, Iterable
+import os
+import sys
+import json
+import time
+import platform
+import argparse
+import tracemalloc
+from datetime import datetime
+import numpy as np
+import h5py
+
+from subscript.defaults import ParamKeys
+from subscript.cache import column_cache
+from subscript.fingerprint import fingerprint
+from subscript.synthetic import write_synthetic_galacticus
+from subscript.tabulatehdf5 import tabulate_trees
+from subscript.wrappers import freeze
+from subscript.scripts.spatial import project3d
+from subscript.scripts.nodes import nodecount
+from subscript.scripts.nfilters import nfilter_subhalos, nfilter_subhalos_valid
+from subscript.scripts.histograms import massfunction, spatial3d_dndv
+from subscript.macros import macro_run
+
+_massbins = np.logspace(6, 13, 15)
+_rbins    = np.linspace(0, 0.5, 10)
+
+benchmark_macros = {
+    "massfunction": freeze(massfunction, bins=_massbins, nfilter=nfilter_subhalos),
+    "spatial"     : freeze(spatial3d_dndv, bins=_rbins, nfilter=nfilter_subhalos),
+    "nsubhalos"   : freeze(nodecount, nfilter=nfilter_subhalos),
+}
+"""Macros evaluated by the macro_run benchmark"""
+
+benchmark_entries:dict[str, Callable] = {
+    "tabulate_trees": lambda gout: [tree[ParamKeys.mass_basic] for tree in tabulate_trees(gout)],
+    "gscript"       : lambda gout: project3d(gout),
+    "nfilter"       : lambda gout: nfilter_subhalos_valid(gout, mass_min=1e8, mass_max=1e11),
+    "histogram"     : lambda gout: massfunction(gout, bins=_massbins, nfilter=nfilter_subhalos, summarize=True),
+    "macro_run"     : lambda gout: macro_run(benchmark_macros, [gout, ], statfuncs=[np.mean, np.std]),
+}
+"""Entry points benchmarked by run_benchmarks, each is called with an open galacticus file"""
+
+def _bytes_read()->int:
+    # Bytes read by this process (read syscalls, including those served by the page cache), None if unavailable
+    try:
+        with open("/proc/self/io") as f:
+            return int(next(line for line in f if line.startswith("rchar")).split()[1])
+    except (OSError, StopIteration):
+        return None
+
+def measure(func:Callable, path:str, repeat:int=1)->dict:
+    """
+    Wall time (best of repeat runs), peak memory allocated (bytes, from an additional traced run)
+    and bytes read of func(gout). Each run opens the file anew and starts with an empty column cache.
+    """
+    def run():
+        column_cache.clear()
+        with h5py.File(path, "r") as gout:
+            func(gout)
+
+    walls, reads = [], []
+    for _ in range(repeat):
+        n0, t0 = _bytes_read(), time.perf_counter()
+        run()
+        walls.append(time.perf_counter() - t0)
+        n1 = _bytes_read()
+        reads.append(None if n0 is None or n1 is None else n1 - n0)
+
+    # Tracing slows allocations down, so memory is measured separately
+    tracemalloc.start()
+    try:
+        run()
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    column_cache.clear()
+    return dict(wall=min(walls), peak_memory=peak, bytes_read=reads[int(np.argmin(walls))])
+
+def run_benchmarks(directory:str, ntrees:Iterable[int]=(10, 100, 1000), nodes_per_tree:Iterable[int]=(100, 1000),
+                    entries:dict[str, Callable]=None, repeat:int=3, seed:int=0, **kwargs)->dict:
+    """
+    Benchmarks each entry point (by default benchmark_entries) on synthetic files (see subscript.synthetic)
+    for every combination of tree count and nodes per tree. Files are written to directory
+    (keyword arguments are passed to write_synthetic_galacticus), existing files are reused.
+    Returns the results along with the environment they were obtained in, see write_benchmarks / compare_benchmarks.
+    """
+    _entries = benchmark_entries if entries is None else entries
+    os.makedirs(directory, exist_ok=True)
+    results = []
+    for nt in ntrees:
+        for npt in nodes_per_tree:
+            tag  = "" if not kwargs else f"-{fingerprint(kwargs)[:8]}"
+            path = os.path.join(directory, f"synthetic-{nt}x{npt}{tag}.hdf5")
+            if not os.path.exists(path):
+                write_synthetic_galacticus(path, ntrees=nt, nodes_per_tree=npt, seed=seed, **kwargs)
+            for name, func in _entries.items():
+                results.append(dict(entry=name, ntrees=nt, nodes_per_tree=npt, **measure(func, path, repeat)))
+
+    meta = dict(
+                date     = datetime.now().isoformat(timespec="seconds"),
+                python   = sys.version.split()[0],
+                numpy    = np.__version__,
+                h5py     = h5py.__version__,
+                platform = platform.platform(),
+               )
+    return dict(meta=meta, results=results)
+
+def write_benchmarks(benchmarks:dict, path:str):
+    with open(path, "w") as f:
+        json.dump(benchmarks, f, indent=1)
+
+def read_benchmarks(path:str)->dict:
+    with open(path) as f:
+        return json.load(f)
+
+def compare_benchmarks(baseline:dict, current:dict, tolerance:float=0.2,
+                        metrics:Iterable[str]=("wall", "peak_memory", "bytes_read"))->list[dict]:
+    """
+    Regressions of current with respect to baseline: results (matched by entry and size)
+    for which a metric grew by more than a fraction tolerance.
+    """
+    _key = lambda r: (r["entry"], r["ntrees"], r["nodes_per_tree"])
+    base = {_key(r): r for r in baseline["results"]}
+    out  = []
+    for r in current["results"]:
+        b = base.get(_key(r))
+        if b is None:
+            continue
+        for metric in metrics:
+            if r.get(metric) is None or b.get(metric) is None:
+                continue
+            if r[metric] > b[metric] * (1 + tolerance):
+                out.append(dict(entry=r["entry"], ntrees=r["ntrees"], nodes_per_tree=r["nodes_per_tree"],
+                                metric=metric, baseline=b[metric], current=r[metric]))
+    return out
+
+def main(argv:list[str]=None):
+    parser = argparse.ArgumentParser(description="Scaling benchmarks of subscript on synthetic galacticus files")
+    parser.add_argument("directory", help="directory of the synthetic files")
+    parser.add_argument("--out", help="write results to this file (json)")
+    parser.add_argument("--baseline", help="compare with results from this file")
+    parser.add_argument("--ntrees", type=int, nargs="+", default=[10, 100, 1000])
+    parser.add_argument("--nodes", type=int, nargs="+", default=[100, 1000])
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--tolerance", type=float, default=0.2)
+    args = parser.parse_args(argv)
+
+    benchmarks = run_benchmarks(args.directory, args.ntrees, args.nodes, repeat=args.repeat)
+    for r in benchmarks["results"]:
+        print(f"{r['entry']:>16} {r['ntrees']:>8} trees x {r['nodes_per_tree']:>6} nodes: {r['wall']:10.4f} s "
+              f"{r['peak_memory'] / 2**20:10.1f} MiB peak {(r['bytes_read'] or 0) / 2**20:10.1f} MiB read")
+    if args.out is not None:
+        write_benchmarks(benchmarks, args.out)
+    if args.baseline is not None:
+        regressions = compare_benchmarks(read_benchmarks(args.baseline), benchmarks, args.tolerance)
+        for r in regressions:
+            print(f"Regression: {r['entry']} ({r['ntrees']} x {r['nodes_per_tree']}) {r['metric']} {r['baseline']} -> {r['current']}")
+        return 1 if regressions else 0
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,88 @@
+#!/usr/bin/env python
+from typing import Callable, Hashable
+from collections import OrderedDict
+import threading
+import numpy as np
+
+from subscript.defaults import Meta
+from subscript.profiling import record_cache
+
+class ColumnCache():
+    """
+    Least recently used cache for columns read from galacticus outputs.
+    Entries are evicted once the cached arrays exceed the budget (in bytes),
+    if no budget is given Meta.cache_budget is used.
+    Columns are keyed by file name, size and modification time, so columns of a rewritten file are read anew.
+    """
+    def __init__(self, budget:int=None):
+        self._budget  = budget
+        self._entries = OrderedDict()
+        self._lock    = threading.Lock()
+        self.nbytes    = 0
+        self.hits      = 0
+        self.misses    = 0
+        self.evictions = 0
+
+    @property
+    def budget(self)->int:
+        return Meta.cache_budget if self._budget is None else self._budget
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, key:Hashable):
+        return key in self._entries
+
+    def get(self, key:Hashable, read:Callable[[], np.ndarray])->np.ndarray:
+        """Returns the cached value for key, on a miss the value is read and cached"""
+        with self._lock:
+            record_cache("columns", key in self._entries)
+            if key in self._entries:
+                self.hits += 1
+                self._entries.move_to_end(key)
+                return self._entries[key][0]
+            self.misses += 1
+
+        val = read()
+        self.put(key, val)
+        return val
+
+    def put(self, key:Hashable, val:np.ndarray):
+        nbytes = np.asarray(val).nbytes
+        # Never cache values that are larger than the budget
+        if nbytes > self.budget:
+            return
+        with self._lock:
+            if key in self._entries:
+                self.nbytes -= self._entries.pop(key)[1]
+            self._entries[key] = (val, nbytes)
+            self.nbytes += nbytes
+            while self.nbytes > self.budget:
+                _, (_, evicted_nbytes) = self._entries.popitem(last=False)
+                self.nbytes -= evicted_nbytes
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.nbytes = 0
+
+    def stats(self)->dict:
+        return dict(hits=self.hits, misses=self.misses, evictions=self.evictions,
+                    entries=len(self._entries), nbytes=self.nbytes, budget=self.budget)
+
+column_cache = ColumnCache()
+"""Cache used by default when Meta.cache is true"""
+
+def get_cache(cache:(ColumnCache | bool)=None)->ColumnCache:
+    """
+    Resolves a cache setting, None uses the global column_cache if Meta.cache is true,
+    False disables caching, a ColumnCache is used as is.
+    """
+    if cache is None:
+        return column_cache if Meta.cache else None
+    if cache is True:
+        return column_cache
+    if cache is False:
+        return None
+    return cache
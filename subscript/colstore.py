@@ -0,0 +1,93 @@
+#!/usr/bin/env python
+from __future__ import annotations
+import os
+import json
+import shutil
+import hashlib
+import numpy as np
+import h5py
+
+from subscript.defaults import Meta
+
+_manifest_name = "manifest.json"
+
+def sidecar_path(filename:str, suffix:str)->str:
+    """
+    Location of a file derived from a galacticus output file (eg. the columnar store),
+    next to the file unless Meta.colstore_dir is set.
+    """
+    _filename = os.path.abspath(os.fspath(filename))
+    if Meta.colstore_dir is None:
+        return _filename + suffix
+    # Disambiguate files with the same name in different directories
+    tag = hashlib.blake2b(_filename.encode(), digest_size=4).hexdigest()
+    return os.path.join(Meta.colstore_dir, f"{os.path.basename(_filename)}-{tag}{suffix}")
+
+def colstore_path(filename:str)->str:
+    """Location of the columnar store of a galacticus output file"""
+    return sidecar_path(filename, ".columns")
+
+def source_stat(filename:str)->dict:
+    """Size and modification time of a file, derived files are out of date once either changes"""
+    stat = os.stat(filename)
+    return dict(size=stat.st_size, mtime_ns=stat.st_mtime_ns)
+
+def write_colstore(gout:h5py.File, path:str=None, rows:int=2**24)->str:
+    """
+    Converts a galacticus output file into a columnar store: one uncompressed .npy file per node property
+    and output, along with the tree offset index (mergerTreeCount / mergerTreeIndex).
+    Columns are copied rows at a time so memory use does not grow with the size of the file.
+    The store is only used while the size and modification time of the source file are unchanged.
+    Returns the path of the store.
+    """
+    _path = colstore_path(gout.filename) if path is None else os.fspath(path)
+    tmp   = _path + ".tmp"
+    shutil.rmtree(tmp, ignore_errors=True)
+
+    outputs = {}
+    for name, outn in gout["Outputs"].items():
+        os.makedirs(os.path.join(tmp, name))
+        counts    = outn["mergerTreeCount"][:]
+        nodecount = np.sum(counts)
+        np.save(os.path.join(tmp, name, "mergerTreeCount.npy"), counts)
+        np.save(os.path.join(tmp, name, "mergerTreeIndex.npy"), outn["mergerTreeIndex"][:])
+
+        columns = []
+        for key, dset in outn["nodeData"].items():
+            # Same selection of datasets as tabulate_output
+            if not isinstance(dset, h5py.Dataset) or dset.shape[0] != nodecount or dset.dtype.hasobject:
+                continue
+            out = np.lib.format.open_memmap(os.path.join(tmp, name, f"{key}.npy"), mode="w+",
+                                            dtype=dset.dtype, shape=dset.shape)
+            for n0 in range(0, dset.shape[0], rows):
+                out[n0:n0 + rows] = dset[n0:n0 + rows]
+            out.flush()
+            del out
+            columns.append(key)
+        outputs[name] = columns
+
+    with open(os.path.join(tmp, _manifest_name), "w") as f:
+        json.dump(dict(source=os.path.abspath(gout.filename), stat=source_stat(gout.filename), outputs=outputs), f)
+
+    shutil.rmtree(_path, ignore_errors=True)
+    os.replace(tmp, _path)
+    return _path
+
+def read_colstore(gout:h5py.File, output:str, path:str=None)->tuple[dict, np.ndarray, np.ndarray]:
+    """
+    Node properties (memory mapped), tree counts and tree indexes of an output (eg. "Output1") from
+    the columnar store of a file. Returns None if there is no store, or if it is out of date.
+    """
+    _path = colstore_path(gout.filename) if path is None else os.fspath(path)
+    try:
+        with open(os.path.join(_path, _manifest_name)) as f:
+            manifest = json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return None
+
+    if manifest["stat"] != source_stat(gout.filename) or output not in manifest["outputs"]:
+        return None
+
+    load  = lambda key: np.load(os.path.join(_path, output, f"{key}.npy"), mmap_mode="r")
+    props = {key:load(key) for key in manifest["outputs"][output]}
+    return props, np.load(os.path.join(_path, output, "mergerTreeCount.npy")), np.load(os.path.join(_path, output, "mergerTreeIndex.npy"))
@@ -1,6 +1,20 @@
 class Meta():
     cache = True
-    """If true, use custom code when reading hdf5 to cache read data."""
+    """If true, cache columns read from hdf5 files in subscript.cache.column_cache."""
+    cache_budget = 2**30
+    """Memory budget (in bytes) of the column cache, least recently used columns are evicted first."""
+    bulk = False
+    """If true, read each column of an output once and share it between trees."""
+    memmap = False
+    """If true, map contiguous uncompressed columns into memory instead of reading them, see subscript.tabulatehdf5.memmap_dataset."""
+    colstore = True
+    """If true, read columns from the columnar store of a file if it exists and is up to date, see subscript.colstore."""
+    colstore_dir = None
+    """Directory of columnar stores and zone maps, if None they are placed next to the galacticus output file."""
+    sparse_selection = 0.1
+    """Node filters selecting less than this fraction of nodes are stored as indices rather than boolean masks."""
+    spatial_indexes = 8
+    """Number of spatial indexes kept per tree (one per node filter and projection), least recently used are evicted first."""
 
 class ParamKeys():
     """Library of default parameters."""
@@ -27,3 +41,9 @@ class ParamKeys():
     custom_id = 'custom_id'
     custom_tree_index = 'custom_node_tree'
     custom_tree_outputorder = 'custom_node_outputorder'
+    derived_r3d = 'derived_r3d'
+    derived_r3d_rel = 'derived_satellite_r3d'
+    derived_bound_fraction = 'derived_bound_mass_fraction'
+    derived_host_x = 'derived_host_relative_x'
+    derived_host_y = 'derived_host_relative_y'
+    derived_host_z = 'derived_host_relative_z'
@@ -0,0 +1,53 @@
+#!/usr/bin/env python
+from typing import Callable, Iterable
+import numpy as np
+
+from subscript.defaults import ParamKeys
+
+class DerivedColumn():
+    """
+    Column computed from other columns. func receives the node properties of an entire
+    (unfiltered) output, tree offsets are available via gout.segments, and returns the column.
+    """
+    def __init__(self, func:Callable, requires:Iterable[str]=()):
+        self.func     = func
+        self.requires = tuple(requires)
+
+derived_columns:dict[str, DerivedColumn] = {}
+"""Registry of derived columns, served by NodeProperties like any other column"""
+
+def register_derived(key:str, func:Callable, requires:Iterable[str]=()):
+    """
+    Registers a derived column. The column is computed once over the entire output
+    on first access and is cached alongside the columns read from file.
+    Outputs that lack any of the required columns do not provide the derived column.
+    """
+    derived_columns[key] = DerivedColumn(func, requires)
+
+def unregister_derived(key:str):
+    derived_columns.pop(key)
+
+def _norm(keys):
+    return lambda gout: np.linalg.norm(np.asarray(gout[keys]), axis=0)
+
+def _host_relative(key, key_mass_basic=ParamKeys.mass_basic):
+    # Position relative to the most massive node of each tree
+    def func(gout):
+        ihost = gout.segments.argmax(gout[key_mass_basic])
+        val   = gout[key]
+        return val - np.repeat(val[ihost], gout.segments.counts)
+    return func
+
+register_derived(ParamKeys.derived_r3d, _norm((ParamKeys.x, ParamKeys.y, ParamKeys.z)),
+                    requires=(ParamKeys.x, ParamKeys.y, ParamKeys.z))
+
+register_derived(ParamKeys.derived_r3d_rel, _norm((ParamKeys.relx, ParamKeys.rely, ParamKeys.relz)),
+                    requires=(ParamKeys.relx, ParamKeys.rely, ParamKeys.relz))
+
+register_derived(ParamKeys.derived_bound_fraction, lambda gout: gout[ParamKeys.mass_bound] / gout[ParamKeys.mass_basic],
+                    requires=(ParamKeys.mass_bound, ParamKeys.mass_basic))
+
+for _key_derived, _key in ((ParamKeys.derived_host_x, ParamKeys.x),
+                           (ParamKeys.derived_host_y, ParamKeys.y),
+                           (ParamKeys.derived_host_z, ParamKeys.z)):
+    register_derived(_key_derived, _host_relative(_key), requires=(_key, ParamKeys.mass_basic))
@@ -0,0 +1,88 @@
+#!/usr/bin/env python
+import hashlib
+import types
+import functools
+import numpy as np
+
+def fingerprint(obj)->str:
+    """
+    Hash of a (nested) python object that is stable between processes.
+    Functions are hashed by their name, code, defaults and closure,
+    so filters and macros built with freeze / nfand etc. hash by their definition.
+    Other objects are hashed by their attributes, or by what their __fingerprint__ method returns if they define one.
+    """
+    h = hashlib.blake2b(digest_size=16)
+    _update(h, obj, set())
+    return h.hexdigest()
+
+def _update(h, obj, seen:set):
+    _tag = lambda s: h.update(f"<{s}>".encode())
+
+    if obj is None or isinstance(obj, (bool, int, float, complex, str, np.generic)):
+        _tag(type(obj).__name__)
+        h.update(repr(obj).encode())
+    elif isinstance(obj, bytes):
+        _tag("bytes")
+        h.update(obj)
+    elif isinstance(obj, np.ndarray):
+        _tag(f"ndarray {obj.dtype} {obj.shape}")
+        if obj.dtype.hasobject:
+            _update(h, obj.tolist(), seen)
+        else:
+            h.update(np.ascontiguousarray(obj).tobytes())
+    elif isinstance(obj, (list, tuple)):
+        _tag(f"{type(obj).__name__} {len(obj)}")
+        for i in obj:
+            _update(h, i, seen)
+    elif isinstance(obj, dict):
+        _tag(f"dict {len(obj)}")
+        for key in sorted(obj, key=repr):
+            _update(h, key, seen)
+            _update(h, obj[key], seen)
+    elif isinstance(obj, (set, frozenset)):
+        _tag(f"set {len(obj)}")
+        for key in sorted(obj, key=repr):
+            _update(h, key, seen)
+    elif isinstance(obj, types.CodeType):
+        _tag("code")
+        h.update(obj.co_code)
+        _update(h, obj.co_names, seen)
+        _update(h, tuple(c for c in obj.co_consts), seen)
+    elif isinstance(obj, types.FunctionType):
+        _tag(f"function {obj.__module__}.{obj.__qualname__}")
+        # Avoid infinite recursion for (mutually) recursive closures
+        if id(obj) in seen:
+            return
+        seen.add(id(obj))
+        _update(h, obj.__code__, seen)
+        _update(h, obj.__defaults__, seen)
+        _update(h, obj.__kwdefaults__, seen)
+        closure = () if obj.__closure__ is None else obj.__closure__
+        _update(h, [_cell_contents(c) for c in closure], seen)
+        # Attributes such as those set by gscript
+        _update(h, {key:val for key, val in vars(obj).items() if not key.startswith("__")}, seen)
+    elif isinstance(obj, functools.partial):
+        _tag("partial")
+        _update(h, (obj.func, obj.args, obj.keywords), seen)
+    elif isinstance(obj, types.MethodType):
+        _tag("method")
+        _update(h, (obj.__func__, obj.__self__), seen)
+    elif isinstance(obj, (type, types.BuiltinFunctionType, np.ufunc)):
+        _tag(f"{type(obj).__name__} {getattr(obj, '__module__', None)}.{getattr(obj, '__qualname__', obj.__name__)}")
+    elif hasattr(obj, "__dict__"):
+        _tag(f"object {type(obj).__module__}.{type(obj).__qualname__}")
+        if id(obj) in seen:
+            return
+        seen.add(id(obj))
+        # Objects holding state that does not define them (eg. caches) declare what to hash
+        _update(h, obj.__fingerprint__() if hasattr(obj, "__fingerprint__") else vars(obj), seen)
+    else:
+        _tag(type(obj).__name__)
+        h.update(repr(obj).encode())
+
+def _cell_contents(cell):
+    try:
+        return cell.cell_contents
+    except ValueError:
+        # Empty cell
+        return None
@@ -1,12 +1,22 @@
 #!/usr/bin/env python
-from typing import Iterable, Callable
+from typing import Iterable, Callable, Sized
 import numpy as np
 import h5py
 from copy import copy
-from subscript.tabulatehdf5 import NodeProperties, tabulate_trees
+from subscript.tabulatehdf5 import NodeProperties, TreeSet, tabulate_trees
+from subscript.cache import ColumnCache
 from subscript.wrappers import freeze
+from subscript.scripts.histograms import HistGroup, HistSpec
+from subscript.planner import macro_columns, plan_file
+from subscript.profiling import Profiler, active_profiler
 from datetime import datetime
 from numpy.dtypes import StringDType
+import multiprocessing
+import time
+from contextlib import nullcontext
+import threading
+import queue
+import os
 
 def macro_add(macros:dict[str, Callable], macro, label=None, **kwargs): 
     if macros.get(label) is not None:
@@ -15,66 +25,266 @@ def macro_add(macros:dict[str, Callable], macro, label=None, **kwargs):
     _m[label] = freeze(macro, **kwargs)
     return _m
 
+def macro_add_hists(macros:dict[str, Callable], specs:dict[str, HistSpec], nfilter=None, **kwargs):
+    """
+    Adds an entry for each histogram in specs, all histograms are computed together 
+    in a single pass over each output (see HistGroup).
+    """
+    group = HistGroup(specs, nfilter=nfilter, **kwargs)
+    _m = macros
+    for label, script in group.scripts().items():
+        _m = macro_add(_m, script, label=label)
+    return _m
+
+
+
+def macro_read_file(gout, macros, cache:(ColumnCache | bool)=None)->TreeSet:
+    # Tabulate once, all macros share the trees along with their columns and node filter results
+    trees = tabulate_trees(gout, bulk=True, cache=cache).cache_filters()
+    # Columns read by any macro are read once, up front
+    return trees.prefetch(macro_columns(macros))
 
+def macro_eval_trees(trees:TreeSet, macros, statfuncs):
+    profiler = active_profiler()
+    if profiler is None:
+        return {key:func(trees, summarize=True, statfuncs=statfuncs)  for key, func in macros.items()}
+    out = {}
+    for key, func in macros.items():
+        t0 = time.perf_counter()
+        out[key] = func(trees, summarize=True, statfuncs=statfuncs)
+        profiler.record_macro(key, time.perf_counter() - t0)
+    return out
 
 def macro_run_file(gout, macros, statfuncs):
-    return {key:func(gout, summarize=True, statfuncs=statfuncs)  for key, func in macros.items()}
+    return macro_eval_trees(macro_read_file(gout, macros), macros, statfuncs)
 
 def macro_runner_def(gouts, macros, statfuncs):
-    return [(gout.filename, macro_run_file(gout, macros, statfuncs)) for gout in gouts]
+    return ((gout.filename, macro_run_file(gout, macros, statfuncs)) for gout in gouts)
+
+class _MemoryBudget():
+    # Bytes of the files read ahead and not yet evaluated
+    def __init__(self, budget:int=None):
+        self.budget = budget
+        self.used   = 0
+        self.cond   = threading.Condition()
+
+    def acquire(self, nbytes:int, stop:threading.Event)->bool:
+        with self.cond:
+            # A file exceeding the budget on its own is read once nothing else is held
+            while self.budget is not None and self.used > 0 and self.used + nbytes > self.budget and not stop.is_set():
+                self.cond.wait(0.1)
+            self.used += nbytes
+        return not stop.is_set()
+
+    def release(self, nbytes:int):
+        with self.cond:
+            self.used -= nbytes
+            self.cond.notify_all()
+
+def macro_runner_prefetch(depth:int=1, memory_budget:int=None):
+    """
+    Runner for macro_run that reads the planned columns (see subscript.planner) of upcoming files 
+    on a background thread while the macros of the current file are evaluated.
+    At most depth files are read ahead, and only while the planned columns of the files read ahead
+    and the file being evaluated fit within memory_budget (bytes, unlimited if None).
+    Prefetched columns are held by the tree sets rather than the column cache, and are released once a file is evaluated.
+    """
+    def runner(gouts, macros, statfuncs):
+        columns = macro_columns(macros)
+        slots   = threading.Semaphore(depth)
+        budget  = _MemoryBudget(memory_budget)
+        stop    = threading.Event()
+        pending = queue.Queue()
+
+        def read_ahead():
+            try:
+                for gout in gouts:
+                    while not slots.acquire(timeout=0.1):
+                        if stop.is_set():
+                            return
+                    nbytes = plan_file(gout, columns)["bytes"]
+                    if not budget.acquire(nbytes, stop):
+                        return
+                    pending.put((gout, nbytes, macro_read_file(gout, macros, cache=False)))
+            except BaseException as e:
+                pending.put(e)
+            pending.put(None)
+
+        thread = threading.Thread(target=read_ahead, daemon=True)
+        thread.start()
+        try:
+            while (item := pending.get()) is not None:
+                if isinstance(item, BaseException):
+                    raise item
+                gout, nbytes, trees = item
+                slots.release()
+                out = (gout.filename, macro_eval_trees(trees, macros, statfuncs))
+                del item, trees
+                budget.release(nbytes)
+                yield out
+        finally:
+            stop.set()
+            thread.join()
+    return macro_gen_runner(runner)
+
+# Set in each worker process by macro_runner_pool
+_pool_macros    = None
+_pool_statfuncs = None
+
+def _pool_init(macros, statfuncs):
+    global _pool_macros, _pool_statfuncs
+    _pool_macros, _pool_statfuncs = macros, statfuncs
+
+def _pool_run_file(path):
+    with h5py.File(path, "r") as gout:
+        return gout.filename, macro_run_file(gout, _pool_macros, _pool_statfuncs)
+
+def macro_runner_pool(processes:int=None, chunksize:int=1, context:str="fork"):
+    """
+    Runner for macro_run that evaluates files in a pool of worker processes.
+    Files are passed to the workers by path and opened read only, results are returned in the original order.
+    Macros are passed to the workers on startup, with the default fork context they do not need to be picklable.
+    """
+    def runner(gouts, macros, statfuncs):
+        paths = [gout.filename if isinstance(gout, h5py.File) else os.fspath(gout) for gout in gouts]
+        ctx   = multiprocessing.get_context(context)
+        with ctx.Pool(processes, initializer=_pool_init, initargs=(macros, statfuncs)) as pool:
+            yield from pool.imap(_pool_run_file, paths, chunksize=chunksize)
+    return macro_gen_runner(runner)
 
 def macro_gen_runner(runner):
-    def macro_runner(macros:dict[str, Callable],  gouts:Iterable[(h5py.File)], statfuncs)->dict:
-        results = runner(gouts, macros, statfuncs)
-        macro_results = {key:val for key, val in results}
-        out = {}
-
-        for _id, vals in macro_results.items():
-            out[_id] = {}
-            for key, val in vals.items():
-                sfs = [np.mean, ] if statfuncs is None else statfuncs 
-                # For clarity, split into seperate entries for each stat function
-                for sf, v in zip(sfs, val):
-                    out[_id][f"{key} ({sf.__name__})"] = v
-        return out
+    """
+    Wraps a runner, a generator of (filename, results) for each file, in the order of the files.
+    The wrapped runner yields the results of each file as soon as they are available.
+    """
+    def macro_runner(macros:dict[str, Callable],  gouts:Iterable[(h5py.File)], statfuncs)->Iterable[tuple[str, dict]]:
+        sfs = [np.mean, ] if statfuncs is None else statfuncs 
+        for _id, vals in runner(gouts, macros, statfuncs):
+            # For clarity, split into seperate entries for each stat function
+            yield _id, {f"{key} ({sf.__name__})": v for key, val in vals.items() for sf, v in zip(sfs, val)}
     return macro_runner
 
-def macro_run(macros:dict[str, tuple[Callable, str]], 
-                gouts:Iterable[(h5py.File)], 
-                statfuncs=None,runner=None):
+class MacroAssembly():
+    """
+    Output of macro_run, one row per file. Arrays are allocated once, when the first result arrives,
+    and rows are filled in by position as the results of each file arrive.
+    """
+    def __init__(self, nfiles:int):
+        self.nfiles = nfiles
+        self.ids    = [None, ] * nfiles
+        self.out    = {}
 
-    _run = macro_gen_runner(macro_runner_def) if runner is None else runner
+    def _allocate(self, key:str, nval:int, v):
+        _shape = (self.nfiles, *v.shape) if isinstance(v, np.ndarray) else self.nfiles
+        return self.out.setdefault(key, {}).setdefault(f"out{nval}", np.zeros(_shape))
 
-    macro_results = _run(macros, gouts, statfuncs) 
+    def add(self, row:int, _id:str, results:dict):
+        self.ids[row] = _id
+        for key, val in results.items():
+            # Handles Single output
+            _val = val
+            if (not isinstance(val, Iterable)) or isinstance(val, np.ndarray):
+                _val = [val, ]
+            # Handle multiple outputs
+            for nval, v in enumerate(_val): 
+                arr = self.out.get(key, {}).get(f"out{nval}")
+                if arr is None:
+                    arr = self._allocate(key, nval, v)
+                arr[row] = v
 
-    # Create initial dictionary
-    entry_fname = next(macro_results.__iter__())
-    entry = macro_results[entry_fname]  
-    nouts = len(macro_results)
-    
-    out = {i : {} for i in entry}
+    def result(self)->dict:
+        if any(_id is None for _id in self.ids):
+            raise RuntimeError("Macro results are missing for some files")
+        return self.out | {"id": {"out0": np.asarray([_id.encode("ascii", "ignore") for _id in self.ids])}}
 
-    ids = np.asarray(list(macro_results.keys()))
-    out["id"] = {"out0": np.asarray([key.encode("ascii", "ignore") for key in macro_results.keys()])}
+class MacroWriter():
+    """
+    Writes the output of macro_run to an HDF5 file as the results of each file arrive, 
+    pass as macro_run(..., writer=MacroWriter(f)). The layout matches macro_write_out_hdf5.
+    Datasets are created along with the first result, resizable along the file axis, 
+    chunked (chunk_rows files per chunk) and compressed (compression / compression_opts as for h5py, None to disable).
+    The file is flushed after every row, so it is valid and can be read during the run. 
+    With swmr=True (requires a file opened with libver="latest") readers in other processes may open it 
+    in SWMR mode while it is written.
+    """
+    def __init__(self, f:h5py.File, notes=None, stamp_date:bool=True, chunk_rows:int=64, 
+                    compression:str="gzip", compression_opts=None, swmr:bool=False):
+        self.f                = f
+        self.chunk_rows       = chunk_rows
+        self.compression      = compression
+        self.compression_opts = compression_opts
+        self.swmr             = swmr
+        self.nrows            = 0
+        if stamp_date:
+            f.attrs["date"] = datetime.now().strftime("%m/%d/%Y, %H:%M:%S")
+        f.attrs["notes"] = str(notes)
 
-    for id, val in macro_results.items():
-        n = np.where(id.encode("ascii", "ignore") == out["id"]["out0"])[0][0]
+    def _create(self, name:str, shape:tuple, dtype):
+        return self.f.create_dataset(name, shape=(self.nrows, *shape), maxshape=(None, *shape), dtype=dtype,
+                                        chunks=(self.chunk_rows, *shape), compression=self.compression, 
+                                        compression_opts=self.compression_opts)
 
-        for key, val in val.items():
+    def _row(self, name:str, row:int, v, dtype=float):
+        dset = self.f.get(name)
+        if dset is None:
+            dset = self._create(name, np.shape(v), dtype)
+        if dset.shape[0] <= row:
+            dset.resize(row + 1, axis=0)
+        dset[row] = v
+
+    def add(self, row:int, _id:str, results:dict):
+        self.nrows = max(self.nrows, row + 1)
+        self._row("id/out0", row, _id.encode("ascii", "ignore"), dtype=h5py.string_dtype("ascii"))
+        for key, val in results.items():
             # Handles Single output
             _val = val
             if (not isinstance(val, Iterable)) or isinstance(val, np.ndarray):
                 _val = [val, ]
+            for nval, v in enumerate(_val):
+                self._row(f"{key}/out{nval}", row, v)
+        if self.swmr and not self.f.swmr_mode:
+            # Every dataset exists once the first row is written
+            self.f.swmr_mode = True
+        self.f.flush()
 
-            # Handle multiple outputs
-            for nval, v in enumerate(_val): 
-                key_out = f"out{nval}"
-                if out[key].get(key_out) is None:
-                    _shape = (nouts, *v.shape) if isinstance(v, np.ndarray) else nouts
-                    out[key][key_out] = np.zeros(_shape)
+    def result(self):
+        self.f.flush()
+        return None
 
-                out[key][key_out][n] = v
+def macro_plan(macros:dict[str, Callable], gouts:Iterable[(h5py.File)])->dict:
+    """
+    Columns macro_run reads from each file and their size (see subscript.planner.plan_file),
+    along with the totals over all files. Nothing but metadata is read.
+    """
+    columns = macro_columns(macros)
+    out     = {gout.filename: plan_file(gout, columns) for gout in gouts}
+    out["total"] = {name: sum(plan[name] for plan in out.values()) for name in ("bytes", "bytes_stored", "bytes_all")}
     return out
+
+def macro_run(macros:dict[str, tuple[Callable, str]], 
+                gouts:Iterable[(h5py.File)], 
+                statfuncs=None,runner=None, dry_run:bool=False, profiler:Profiler=None, writer:MacroWriter=None):
+    """
+    Evaluates macros for each file. If a writer is given (see MacroWriter), results are written 
+    as the results of each file arrive instead of being returned. If a profiler is given, the run is recorded with it (see subscript.profiling),
+    its report can be written next to the results with write_profile_hdf5. 
+    Runners evaluating files in other processes (macro_runner_pool) only report the time of the run as a whole.
+    """
+    if dry_run:
+        return macro_plan(macros, gouts)
+
+    _run   = macro_gen_runner(macro_runner_def) if runner is None else runner
+    _gouts = gouts if isinstance(gouts, Sized) else list(gouts)
+
+    # Rows are filled in as the results of each file arrive
+    assembly = MacroAssembly(len(_gouts)) if writer is None else writer
+    with (nullcontext() if profiler is None else profiler):
+        t0 = time.perf_counter()
+        for row, (_id, results) in enumerate(_run(macros, _gouts, statfuncs)):
+            assembly.add(row, _id, results)
+        if profiler is not None:
+            profiler.record_macro("macro_run", time.perf_counter() - t0)
+    return assembly.result()
             
             
 
@@ -89,4 +299,4 @@ def macro_write_out_hdf5(f:h5py.File, macro_out, notes=None, stamp_date = True):
     
     now = datetime.now()
     f.attrs["date"] = now.strftime("%m/%d/%Y, %H:%M:%S")
-    f.attrs["notes"] = str(notes)
\ No newline at end of file
+    f.attrs["notes"] = str(notes)
@@ -0,0 +1,176 @@
+#!/usr/bin/env python
+from __future__ import annotations
+from typing import Callable, Iterable
+import numpy as np
+
+from subscript.tabulatehdf5 import NodeProperties
+from subscript.fingerprint import fingerprint
+from subscript.planner import script_columns
+
+def rowwise(func:Callable)->Callable:
+    """
+    Marks a node filter script (or a getval function used by one) whose result for each node only depends on that node.
+    Such filters are only evaluated on the nodes that are still undecided within a conjunction / disjunction,
+    by passing those nodes as nfilter.
+    """
+    func.rowwise = True
+    return func
+
+class NFExpr():
+    """
+    Node of a lazy node filter expression, combine expressions with &, | and ~ (or nfand, nfor and nfnot).
+    Expressions are called like any other node filter. Identical sub-expressions (same filter and keyword arguments)
+    are evaluated once per call, and once per tree set if node filter results are cached (see TreeSet.cache_filters).
+    """
+    key:tuple = None
+
+    def __call__(self, gout, **kwargs)->np.ndarray[bool]:
+        _gout = gout if isinstance(gout, NodeProperties) else NodeProperties(gout)
+        # At least 1d, like the filters it combines (eg. for trees with a single node)
+        return np.atleast_1d(np.asarray(self.evaluate(_gout, kwargs, _memo(_gout, kwargs)), dtype=bool))
+
+    def evaluate(self, gout:NodeProperties, kwargs:dict, memo:dict)->np.ndarray[bool]:
+        if self.key is None:
+            return self._evaluate(gout, kwargs, memo)
+        if self.key not in memo:
+            memo[self.key] = self._evaluate(gout, kwargs, memo)
+        return memo[self.key]
+
+    def _evaluate(self, gout:NodeProperties, kwargs:dict, memo:dict)->np.ndarray[bool]:
+        raise NotImplementedError
+
+    def leaves(self)->list[NFLeaf]:
+        return []
+
+    @property
+    def segmented(self):
+        # Evaluated over entire outputs if every filter supports it, see gscript_segmented
+        leaves = self.leaves()
+        return len(leaves) > 0 and all(getattr(leaf.func, "segmented", False) for leaf in leaves)
+
+    def columns(self, **kwargs)->set[str]:
+        """Columns read by the filters of this expression, given the keyword arguments it is called with"""
+        return set().union(*[leaf.columns(kwargs) for leaf in self.leaves()])
+
+    def prefetch(self, gout, **kwargs):
+        """Reads the columns required by this expression up front"""
+        for key in self.columns(**kwargs):
+            if key in gout:
+                gout[key]
+
+    def __and__(self, other):
+        return NFAnd((self, as_nfexpr(other)))
+
+    def __rand__(self, other):
+        return NFAnd((as_nfexpr(other), self))
+
+    def __or__(self, other):
+        return NFOr((self, as_nfexpr(other)))
+
+    def __ror__(self, other):
+        return NFOr((as_nfexpr(other), self))
+
+    def __invert__(self):
+        return NFNot(self)
+
+class NFLeaf(NFExpr):
+    """Node filter with fixed keyword arguments"""
+    def __init__(self, func:Callable, **kwargs):
+        self.func    = func
+        self.kwargs  = kwargs
+        self.key     = (func, fingerprint(kwargs))
+        self.rowwise = getattr(func, "rowwise", False) and all(getattr(val, "rowwise", False)
+                                                                for val in kwargs.values() if isinstance(val, Callable))
+
+    def _evaluate(self, gout:NodeProperties, kwargs:dict, memo:dict)->np.ndarray[bool]:
+        return self.func(gout, **(kwargs | self.kwargs))
+
+    def evaluate_rows(self, gout:NodeProperties, kwargs:dict, rows:np.ndarray[bool])->np.ndarray[bool]:
+        """Evaluates the filter for the selected rows only, requires a rowwise filter"""
+        return self.func(gout, **(kwargs | self.kwargs | dict(nfilter=rows)))
+
+    def leaves(self)->list[NFLeaf]:
+        return [self, ]
+
+    def columns(self, kwargs:dict)->set[str]:
+        return script_columns(self.func, kwargs | self.kwargs)
+
+class NFArray(NFExpr):
+    """Fixed node filter result"""
+    def __init__(self, nodefilter:np.ndarray[bool]):
+        self.nodefilter = nodefilter
+
+    def _evaluate(self, gout:NodeProperties, kwargs:dict, memo:dict)->np.ndarray[bool]:
+        return self.nodefilter
+
+class NFNot(NFExpr):
+    def __init__(self, arg:NFExpr):
+        self.arg = arg
+        self.key = None if arg.key is None else ("not", arg.key)
+
+    def _evaluate(self, gout:NodeProperties, kwargs:dict, memo:dict)->np.ndarray[bool]:
+        return np.logical_not(self.arg.evaluate(gout, kwargs, memo))
+
+    def leaves(self)->list[NFLeaf]:
+        return self.arg.leaves()
+
+class _NFReduce(NFExpr):
+    # Conjunction (decided=False) or disjunction (decided=True) of sub-expressions.
+    # Rowwise filters are only evaluated on the rows that are not yet decided.
+    decided:bool = None
+    op:np.ufunc  = None
+
+    def __init__(self, args:Iterable[NFExpr]):
+        self.args = []
+        for arg in args:
+            # Flatten nested expressions of the same kind
+            self.args += arg.args if type(arg) is type(self) else [arg, ]
+        keys     = [arg.key for arg in self.args]
+        self.key = None if any(key is None for key in keys) else (type(self).__name__, tuple(keys))
+
+    def _evaluate(self, gout:NodeProperties, kwargs:dict, memo:dict)->np.ndarray[bool]:
+        # Evaluate cached results, full evaluations and finally rowwise filters
+        _rowwise = lambda arg: isinstance(arg, NFLeaf) and arg.rowwise and arg.key not in memo
+        args     = [arg for arg in self.args if not _rowwise(arg)] + [arg for arg in self.args if _rowwise(arg)]
+
+        out = None
+        for arg in args:
+            if out is not None and np.all(out == self.decided):
+                break
+            if out is None:
+                out = np.array(arg.evaluate(gout, kwargs, memo), dtype=bool)
+            elif _rowwise(arg):
+                rows = out != self.decided
+                out[rows] = arg.evaluate_rows(gout, kwargs, rows)
+            else:
+                out = self.op(out, arg.evaluate(gout, kwargs, memo))
+        return out
+
+    def leaves(self)->list[NFLeaf]:
+        return [leaf for arg in self.args for leaf in arg.leaves()]
+
+class NFAnd(_NFReduce):
+    decided = False
+    op      = np.logical_and
+
+class NFOr(_NFReduce):
+    decided = True
+    op      = np.logical_or
+
+def as_nfexpr(arg:(NFExpr | Callable | np.ndarray[bool]))->NFExpr:
+    if isinstance(arg, NFExpr):
+        return arg
+    if isinstance(arg, np.ndarray):
+        return NFArray(arg)
+    return NFLeaf(arg)
+
+def nfexpr(func:Callable, **kwargs)->NFExpr:
+    """Node filter expression for func with fixed keyword arguments, eg. nfexpr(nfilter_range, min=1, max=2, key=...)"""
+    return NFLeaf(func, **kwargs)
+
+def _memo(gout:NodeProperties, kwargs:dict)->dict:
+    # Results are kept for the lifetime of the tree set if it caches node filter results
+    cache = gout.unfilter().data._filtercache
+    if cache is None:
+        return {}
+    return cache.setdefault(("nfexpr", fingerprint(kwargs)), {})
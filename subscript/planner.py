@@ -0,0 +1,93 @@
+#!/usr/bin/env python
+from __future__ import annotations
+from typing import Callable, Iterable
+import inspect
+import numpy as np
+import h5py
+
+from subscript.derived import derived_columns
+
+def reads(*keys:(str | Callable), params:Iterable[str]=()):
+    """
+    Declares the columns a script or node filter reads, in addition to those given by its keyword
+    arguments named key or key_* (and those listed in params, eg. weights).
+    Entries may be keys or other scripts, which are resolved with the same keyword arguments.
+    """
+    def decorator(func):
+        func.reads        = tuple(keys)
+        func.reads_params = tuple(params)
+        return func
+    return decorator
+
+def script_columns(func:Callable, kwargs:dict=None, _seen:set=None)->set[str]:
+    """
+    Columns read by a script (or node filter, macro) when called with kwargs. Columns are given by
+    @reads declarations and keyword arguments named key or key_*, including those of functions passed as arguments.
+    """
+    _kwargs = {} if kwargs is None else kwargs
+    seen    = set() if _seen is None else _seen
+    if id(func) in seen:
+        return set()
+    seen.add(id(func))
+
+    # Scripts with fixed arguments (see freeze)
+    if hasattr(func, "func") and hasattr(func, "kwargs"):
+        return script_columns(func.func, _kwargs | func.kwargs, seen)
+    # Node filter expressions (see subscript.nfexpr)
+    if hasattr(func, "leaves"):
+        return set().union(*[script_columns(leaf.func, _kwargs | leaf.kwargs, set(seen)) for leaf in func.leaves()])
+
+    try:
+        params = inspect.signature(func).parameters
+    except (TypeError, ValueError):
+        return set()
+    key_params = getattr(func, "reads_params", ())
+    all_kwargs = {name:p.default for name, p in params.items() if p.default is not inspect.Parameter.empty} | _kwargs
+
+    out = set()
+    for entry in getattr(func, "reads", ()):
+        out |= {entry, } if isinstance(entry, str) else script_columns(entry, _kwargs, set(seen))
+    for name, val in all_kwargs.items():
+        if isinstance(val, Callable) and not isinstance(val, type):
+            # Functions passed as arguments are called with the remaining arguments
+            out |= script_columns(val, {k:v for k, v in _kwargs.items() if not isinstance(v, Callable)}, set(seen))
+        elif name == "key" or name.startswith("key_") or name in key_params:
+            out |= {val, } if isinstance(val, str) else {v for v in np.atleast_1d(np.asarray(val, dtype=object)) if isinstance(v, str)}
+    return out
+
+def expand_derived(keys:Iterable[str])->set[str]:
+    """Replaces derived columns (see subscript.derived) by the columns they are computed from"""
+    out = set()
+    for key in keys:
+        if key in derived_columns:
+            out |= expand_derived(derived_columns[key].requires)
+            continue
+        out.add(key)
+    return out
+
+def macro_columns(macros:dict[str, Callable])->set[str]:
+    """Union of the columns read by a set of macros"""
+    return set().union(*[script_columns(func) for func in macros.values()])
+
+def plan_file(gout:h5py.File, columns:Iterable[str], out_index:int=-1)->dict:
+    """
+    Planned reads for a galacticus file: the columns of the output that will be read,
+    their size in memory (bytes) and on disk (bytes_stored), and the size of all columns of the output (bytes_all).
+    """
+    # Avoid a circular import
+    from subscript.tabulatehdf5 import get_galacticus_outputs
+
+    _key_index = np.max(get_galacticus_outputs(gout)) if out_index == -1 else out_index
+    outn       = gout[f"Outputs/Output{_key_index}"]
+    nodecount  = np.sum(outn["mergerTreeCount"][:])
+    dsets      = {key:val for key, val in outn["nodeData"].items() if isinstance(val, h5py.Dataset) and val.shape[0] == nodecount}
+    _columns   = sorted(key for key in expand_derived(columns) if key in dsets)
+
+    nbytes = lambda keys: int(sum(dsets[key].size * dsets[key].dtype.itemsize for key in keys))
+    return dict(
+                columns      = _columns,
+                missing      = sorted(key for key in expand_derived(columns) if key not in dsets),
+                bytes        = nbytes(_columns),
+                bytes_stored = int(sum(dsets[key].id.get_storage_size() for key in _columns)),
+                bytes_all    = nbytes(dsets)
+               )
@@ -0,0 +1,112 @@
+#!/usr/bin/env python
+from __future__ import annotations
+from typing import Iterable
+import threading
+import numpy as np
+import h5py
+
+from subscript.stats import OnlineMoments, QuantileSketch
+
+class Profiler():
+    """
+    Opt-in instrumentation. While active (use as a context manager, or pass to macro_run) it records
+    calls and time of each gscript (along with the time spent per tree, or per output for segmented scripts),
+    calls and time of each macro, HDF5 reads and bytes (uncompressed) per column, and hits / misses of the
+    column and node filter caches. Script times include nested scripts (eg. node filters).
+    Times per tree are summarized as they are recorded (see subscript.stats), memory use does not grow with the number of trees.
+    Only activity of the current process is recorded, see report for the results.
+    """
+    def __init__(self):
+        self.scripts = {}
+        self.macros  = {}
+        self.reads   = {}
+        self.caches  = {}
+        self._lock   = threading.Lock()
+        self._prev   = None
+
+    def __enter__(self):
+        global _active
+        self._prev, _active = _active, self
+        return self
+
+    def __exit__(self, *exc):
+        global _active
+        _active, self._prev = self._prev, None
+        return False
+
+    def record_script(self, name:str, seconds:float, tree_seconds:Iterable[float]):
+        with self._lock:
+            entry = self.scripts.setdefault(name, dict(calls=0, time=0.0, trees=OnlineMoments(), quantiles=QuantileSketch()))
+            entry["calls"] += 1
+            entry["time"]  += seconds
+            t = np.asarray(list(tree_seconds), dtype=float)
+            entry["trees"].add(t)
+            entry["quantiles"].add(t)
+
+    def record_macro(self, name:str, seconds:float):
+        with self._lock:
+            entry = self.macros.setdefault(name, dict(calls=0, time=0.0))
+            entry["calls"] += 1
+            entry["time"]  += seconds
+
+    def record_read(self, column:str, nbytes:int):
+        with self._lock:
+            entry = self.reads.setdefault(column, dict(reads=0, bytes=0))
+            entry["reads"] += 1
+            entry["bytes"] += int(nbytes)
+
+    def record_cache(self, name:str, hit:bool):
+        with self._lock:
+            entry = self.caches.setdefault(name, dict(hits=0, misses=0))
+            entry["hits" if hit else "misses"] += 1
+
+    def report(self)->dict:
+        """
+        Recorded activity as nested dictionaries: scripts (calls, time, and the distribution of the time per tree:
+        ntrees, tree_mean, tree_median, tree_p90, tree_max), macros (calls, time), reads per column (reads, bytes)
+        and caches (hits, misses). Times are in seconds.
+        """
+        def script_entry(entry):
+            t, q = entry["trees"], entry["quantiles"]
+            dist = dict(tree_mean=0.0, tree_median=0.0, tree_p90=0.0, tree_max=0.0) if t.n == 0 else dict(
+                        tree_mean=float(t.mean), tree_median=float(q.quantile(0.5)),
+                        tree_p90=float(q.quantile(0.9)), tree_max=float(t.max))
+            return dict(calls=entry["calls"], time=entry["time"], ntrees=t.n, **dist)
+
+        with self._lock:
+            return dict(
+                        scripts = {name: script_entry(entry) for name, entry in self.scripts.items()},
+                        macros  = {name: dict(entry) for name, entry in self.macros.items()},
+                        reads   = {name: dict(entry) for name, entry in self.reads.items()},
+                        caches  = {name: dict(entry) for name, entry in self.caches.items()},
+                       )
+
+_active:Profiler = None
+
+def active_profiler()->Profiler:
+    """The active profiler, None unless profiling"""
+    return _active
+
+def record_read(dset:h5py.Dataset, out:np.ndarray)->np.ndarray:
+    """Records a read of dset (returning out) with the active profiler"""
+    if _active is not None:
+        _active.record_read(dset.name.rsplit("/", 1)[-1], np.asarray(out).nbytes)
+    return out
+
+def record_cache(name:str, hit:bool):
+    if _active is not None:
+        _active.record_cache(name, hit)
+
+def write_profile_hdf5(f:h5py.File, report:dict, group:str="profile"):
+    """
+    Writes a profiler report (see Profiler.report) to an HDF5 file, eg. next to the results written by macro_write_out_hdf5.
+    Each entry (script, macro, column or cache) becomes a group with one attribute per quantity.
+    """
+    grp = f.create_group(group)
+    for section, entries in report.items():
+        _section = grp.create_group(section)
+        for name, entry in entries.items():
+            # Names may hold "/"
+            _entry = _section.create_group(name.replace("/", "|"))
+            for key, val in entry.items():
+                _entry.attrs[key] = val
@@ -0,0 +1,105 @@
+#!/usr/bin/env python
+from __future__ import annotations
+from typing import Callable, Iterable
+import os
+import glob
+import pickle
+import hashlib
+import functools
+import h5py
+
+from subscript.defaults import Meta
+from subscript.colstore import source_stat
+from subscript.fingerprint import fingerprint
+
+def _source_path(gout)->str:
+    return os.path.abspath(gout.filename if isinstance(gout, h5py.File) else os.fspath(gout))
+
+def _content_hash(path:str, block:int=2**24)->str:
+    h = hashlib.blake2b(digest_size=16)
+    with open(path, "rb") as f:
+        while chunk := f.read(block):
+            h.update(chunk)
+    return h.hexdigest()
+
+@functools.cache
+def package_hash()->str:
+    """Hash of the source of subscript, entries written by other versions are not used"""
+    root = os.path.dirname(os.path.abspath(__file__))
+    h = hashlib.blake2b(digest_size=16)
+    for path in sorted(glob.glob(os.path.join(root, "**", "*.py"), recursive=True)):
+        h.update(os.path.relpath(path, root).encode())
+        with open(path, "rb") as f:
+            h.update(f.read())
+    return h.hexdigest()
+
+def _meta_settings()->dict:
+    return {key:val for key, val in vars(Meta).items() if not key.startswith("__")}
+
+class MacroResultCache():
+    """
+    Results of macro_run for each file, stored on disk in directory (one file per entry).
+    Entries are keyed by the path of the file, its size and modification time (or a hash of its contents
+    if content_hash is true), the fingerprint of the macros (including keyword arguments bound by freeze)
+    and statistics functions, the source of subscript (see package_hash), the settings in Meta and version.
+    Entries of changed files or macros are never used, and are replaced once recomputed.
+
+    Fingerprints of functions cover their code, defaults and closures, not the functions and constants they reach
+    through module globals. Code of subscript is covered by package_hash, for other code 
+    (eg. helpers called by a macro) change version whenever it changes.
+    """
+    def __init__(self, directory:str, content_hash:bool=False, version=None):
+        self.directory    = os.fspath(directory)
+        self.content_hash = content_hash
+        self.version      = version
+        os.makedirs(self.directory, exist_ok=True)
+
+    def key(self, gout, macros_fp:str)->str:
+        path   = _source_path(gout)
+        source = _content_hash(path) if self.content_hash else source_stat(path)
+        return fingerprint((path, source, macros_fp, package_hash(), _meta_settings(), self.version))
+
+    def _path(self, key:str)->str:
+        return os.path.join(self.directory, f"{key}.pkl")
+
+    def get(self, key:str)->tuple[str, dict]:
+        """The cached (filename, results) for key, None if there is no entry"""
+        try:
+            with open(self._path(key), "rb") as f:
+                return pickle.load(f)
+        except (FileNotFoundError, EOFError, pickle.UnpicklingError):
+            return None
+
+    def put(self, key:str, entry:tuple[str, dict]):
+        # Written atomically, so an interrupted run never leaves a partial entry behind
+        tmp = f"{self._path(key)}.{os.getpid()}.tmp"
+        with open(tmp, "wb") as f:
+            pickle.dump(entry, f)
+        os.replace(tmp, self._path(key))
+
+def macro_runner_cached(cache:(MacroResultCache | str), runner:Callable=None)->Callable:
+    """
+    Runner for macro_run that reuses results of previous runs (see MacroResultCache, or the path of its directory).
+    Only files without an up to date entry are passed to runner (by default the default runner of macro_run),
+    their results are stored as soon as each file is done, so an interrupted run resumes where it stopped.
+    Results are returned in the original order.
+    """
+    # Avoid a circular import
+    from subscript.macros import macro_gen_runner, macro_runner_def
+
+    _cache  = cache if isinstance(cache, MacroResultCache) else MacroResultCache(cache)
+    _runner = macro_gen_runner(macro_runner_def) if runner is None else runner
+
+    def macro_runner(macros:dict[str, Callable], gouts:Iterable[(h5py.File)], statfuncs)->Iterable[tuple[str, dict]]:
+        _gouts    = list(gouts)
+        macros_fp = fingerprint((macros, statfuncs))
+        keys      = [_cache.key(gout, macros_fp) for gout in _gouts]
+        cached    = [_cache.get(key) for key in keys]
+        computed  = _runner(macros, [gout for gout, entry in zip(_gouts, cached) if entry is None], statfuncs)
+
+        for key, entry in zip(keys, cached):
+            if entry is None:
+                entry = next(computed)
+                _cache.put(key, entry)
+            yield entry
+    return macro_runner
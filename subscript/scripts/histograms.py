@@ -1,48 +1,270 @@
 #!/usr/bin/env python
 import numpy as np
-from subscript.wrappers import gscript, gscript_proj
+from typing import Callable
+from subscript.wrappers import gscript, gscript_proj, gscript_segmented, freeze, _segmented_nodefilter
 from subscript.defaults import ParamKeys
-from subscript.scripts.spatial import project3d, project2d
+from subscript.scripts.spatial import project3d, project2d, _project2d
+from subscript.planner import reads
+from subscript.sortedindex import SortedIndex
 
 def bin_avg(bins):
-    return (bins[1:] + bins[:-1] ) / 2
+    return (bins[..., 1:] + bins[..., :-1] ) / 2
 
 def bin_size(bins):
-    return (bins[1:] - bins[:-1])
+    return (bins[..., 1:] - bins[..., :-1])
 
-@gscript
-def hist(gout, key_hist=None, getval=None, bins=None, range=None, density=False, weights=None, kwargs_hist = None, **kwargs):
-    """Wrapper for np.histogram, provide a key or a function"""
+def bin_volume(bins):
+    # Volume of spherical shells
+    return 4 / 3 * np.pi * (bins[..., 1:]**3 - bins[..., :-1]**3)
+
+def bin_area(bins):
+    # Area of annuli
+    return np.pi * (bins[..., 1:]**2 - bins[..., :-1]**2)
+
+def _hist_edges(a:np.ndarray, bins, range, log:bool)->np.ndarray:
+    if log and np.ndim(bins) == 0 and range is not None:
+        return np.geomspace(range[0], range[1], bins + 1)
+    return np.histogram_bin_edges(a, bins=bins, range=range)
+
+def _bin_index(a:np.ndarray, edges:np.ndarray):
+    # Same binning as np.histogram, the last bin includes its right edge
+    nbins = edges.shape[0] - 1
+    i = np.searchsorted(edges, a, side="right") - 1
+    i[a == edges[-1]] = nbins - 1
+    return i, (i >= 0) & (i < nbins)
+
+def _hist_group(vals, bins, range, density, weights, log):
+    # Histogram of a single group, bin edges depend on the data of the group
+    if len(vals) > 1:
+        hist, edges = np.histogramdd(vals, bins=bins, range=range, density=density, weights=weights)
+        return hist, *edges
+    _bins = bins[0]
+    if log[0] and vals[0].shape[0] > 0:
+        _bins = np.geomspace(np.min(vals[0]), np.max(vals[0]), _bins + 1)
+    return np.histogram(vals[0], bins=_bins, range=range[0], density=density, weights=weights)
+
+def hist_groups(vals:list[np.ndarray], counts:np.ndarray, bins:list, range:list, density=False, weights=None, log:list[bool]=None):
+    """
+    Histograms consecutive groups of nodes (counts gives the size of each group) in a single pass.
+    vals holds one array per dimension, bins, range and log (logarithmic bin spacing) one entry per dimension.
+    Returns the (ngroups, nbins...) counts followed by the (ngroups, nbins + 1) bin edges of each dimension.
+    The counts are identical to calling np.histogram / np.histogramdd on each group, weighted sums agree up to rounding.
+    """
+    vals   = [np.asarray(a) for a in vals]
+    counts = np.asarray(counts, dtype=int)
+    ngroup = counts.shape[0]
+    _w     = None if weights is None else np.asarray(weights)
+    log    = [False, ] * len(vals) if log is None else log
+
+    if any(np.ndim(b) == 0 and r is None for b, r in zip(bins, range)):
+        stop  = np.cumsum(counts)
+        outs  = [_hist_group([a[n1 - c:n1] for a in vals], bins, range, density, 
+                                None if _w is None else _w[n1 - c:n1], log) for n1, c in zip(stop, counts)]
+        return tuple(np.asarray([o[n] for o in outs]) for n in np.arange(len(vals) + 1))
+
+    edges = [_hist_edges(a, b, r, l) for a, b, r, l in zip(vals, bins, range, log)]
+    shape = tuple(e.shape[0] - 1 for e in edges)
+
+    # Flat index of the bin of each node, in C order over (group, bin...)
+    index = np.repeat(np.arange(ngroup), counts)
+    valid = np.ones(index.shape[0], dtype=bool)
+    for a, e, nbins in zip(vals, edges, shape):
+        i, _valid = _bin_index(a, e)
+        index     = index * nbins + i
+        valid    &= _valid
+
+    hist = np.bincount(index[valid], weights=None if _w is None else _w[valid],
+                            minlength=ngroup * np.prod(shape, dtype=int)).reshape(ngroup, *shape)
+    if _w is not None:
+        hist = hist.astype(_w.dtype)
+
+    if density:
+        with np.errstate(invalid="ignore", divide="ignore"):
+            hist = hist / hist.sum(axis=tuple(np.arange(1, hist.ndim)), keepdims=True)
+            for n, e in enumerate(edges):
+                db = np.diff(e).astype(float)
+                hist = hist / db.reshape(db.shape[0], *np.ones(len(shape) - n - 1, dtype=int))
+
+    return hist, *(np.broadcast_to(e, (ngroup, e.shape[0])) for e in edges)
+
+def hist_flat(a:np.ndarray, counts:np.ndarray, bins=None, range=None, density=False, weights=None, log=False):
+    """
+    Histograms consecutive groups of a (eg. the nodes of each tree, counts gives the size of each group)
+    in a single pass. Returns the (ngroups, nbins) counts and (ngroups, nbins + 1) bin edges.
+    The counts are identical to calling np.histogram on each group, weighted sums agree up to rounding.
+    If log is true and bins is an integer, bins are spaced logarithmically.
+    """
+    return hist_groups([a, ], counts, [bins, ], [range, ], density=density, weights=weights, log=[log, ])
+
+def _hist_rows(a:np.ndarray, bins=None, range=None):
+    # Histograms each row of a (K, N) array
+    return hist_flat(a.reshape(-1), np.full(a.shape[0], a.shape[1]), bins=bins, range=range)
+
+def _hist_weights(gout, weights, kwargs):
+    if weights is None or isinstance(weights, np.ndarray):
+        return weights
+    if isinstance(weights, str):
+        return gout[weights]
+    return weights(gout, **kwargs)
+
+@reads(params=("weights", ))
+@gscript_segmented
+def hist(gout, key_hist=None, getval=None, bins=None, range=None, density=False, weights=None, log=False, kwargs_hist = None, **kwargs):
+    """
+    Wrapper for np.histogram, provide a key or a function. Histograms of all trees are computed in one pass.
+    Weights may be given as a key, a function or an array spanning the (filtered) nodes of the output.
+    """
     kwargs_hist = {} if kwargs_hist is None else kwargs_hist
     if key_hist is not None:
         a = gout[key_hist]
     if getval is not None:
         a = getval(gout, **kwargs)
-    return np.histogram(a, bins=bins, range=range, density=density, weights=weights)
+    return hist_flat(a, gout.segments.counts, bins=bins, range=range, density=density, 
+                        weights=_hist_weights(gout, weights, kwargs), log=log)
 
-@gscript
+@reads(params=("weights", ))
+@gscript_segmented
+def hist2d(gout, key_x=None, key_y=None, getval_x=None, getval_y=None, bins=10, range=None, density=False, weights=None, **kwargs):
+    """
+    Wrapper for np.histogram2d, provide a key or a function for each axis. Histograms of all trees are computed in one pass.
+    bins and range follow np.histogram2d.
+    """
+    x = gout[key_x] if getval_x is None else getval_x(gout, **kwargs)
+    y = gout[key_y] if getval_y is None else getval_y(gout, **kwargs)
+    _bins  = [bins, bins] if np.isscalar(bins) or len(bins) != 2 else list(bins)
+    _range = [None, None] if range is None else list(range)
+    return hist_groups([x, y], gout.segments.counts, _bins, _range, density=density, 
+                        weights=_hist_weights(gout, weights, kwargs))
+
+@gscript_segmented
 def massfunction(gout, key_mass=ParamKeys.mass, bins=None, range=None, **kwargs): 
     _hist, _bins = hist(gout, key_hist=key_mass, bins=bins, range=range, **kwargs)
     return _hist / bin_size(_bins), _bins 
 
-@gscript
+@reads(project3d)
+@gscript_segmented
 def spatial3d_dn(gout, bins=None, range=None, kwargs_hist = None, **kwargs):
     r = project3d(gout, **kwargs) 
-    return np.histogram(r, bins=bins, range=range)
+    return hist_flat(r, gout.segments.counts, bins=bins, range=range)
 
-@gscript
+@reads(spatial3d_dn)
+@gscript_segmented
 def spatial3d_dndv(gout, bins=None, range=None, kwargs_hist = None, **kwargs): 
     dn, dn_r = spatial3d_dn(gout, bins=bins, range=range, kwargs_hist=kwargs_hist, **kwargs)
-    dv = 4 / 3 * np.pi * (dn_r[1:]**3 - dn_r[:-1]**3)
-    return dn / dv, dn_r
+    return dn / bin_volume(dn_r), dn_r
 
-@gscript_proj
+@reads(_project2d)
+@gscript_proj(batched=True)
 def spatial2d_dn(gout, normvector, bins=None, range=None, kwargs_hist = None, **kwargs):
-    r = project2d(gout,normvector=normvector, **kwargs) 
-    return np.histogram(r, bins=bins, range=range)
+    # Coordinates are read once for all normal vectors
+    r = _project2d(gout, normvector, **kwargs) 
+    return _hist_rows(r, bins=bins, range=range)
 
-@gscript_proj
+@reads(_project2d)
+@gscript_proj(batched=True)
 def spatial2d_dnda(gout, normvector, bins=None, range=None, kwargs_hist = None, **kwargs):
-    dn, dn_r = spatial2d_dn(gout, normvector, bins=bins, range=range, kwargs_hist = kwargs_hist, **kwargs)
-    da = np.pi * (dn_r[1:]**2 - dn_r[:-1]**2)
-    return dn / da, dn_r
\ No newline at end of file
+    dn, dn_r = _hist_rows(_project2d(gout, normvector, **kwargs), bins=bins, range=range)
+    return dn / bin_area(dn_r), dn_r
+
+@gscript
+def cumulative_count(gout, bins, key=None, getval=None, above=False, inclusive=False, **kwargs):
+    """
+    Number of nodes below (or if above is true, above) each bin edge, eg. N(<r) or N(>M). Provide a key or a function.
+    Uses the sorted index of the column if it has one (see TreeSet.sort_columns), so sweeping many binnings is cheap.
+    """
+    index = None if key is None else gout.sorted_index(key)
+    if index is None:
+        index = SortedIndex(gout[key] if getval is None else getval(gout, **kwargs))
+    return index.count_above(bins, inclusive) if above else index.count_below(bins, inclusive)
+
+class HistSpec():
+    """
+    Histogram evaluated as part of a HistGroup. Provide a key or a function for the values,
+    for 2d histograms also for the values along the second axis (key_y / getval_y).
+    bins, range, density, weights and log are as for hist, bins_y and range_y apply to the second axis.
+    If given, counts are divided by per_bin(bin edges), eg. bin_size for a mass function.
+    """
+    def __init__(self, key_hist:str=None, getval:Callable=None, bins=None, range=None, density=False, weights=None, log=False,
+                    key_y:str=None, getval_y:Callable=None, bins_y=None, range_y=None, per_bin:Callable=None):
+        self.key_hist = key_hist
+        self.getval   = getval
+        self.bins     = bins
+        self.range    = range
+        self.density  = density
+        self.weights  = weights
+        self.log      = log
+        self.key_y    = key_y
+        self.getval_y = getval_y
+        self.bins_y   = bins_y
+        self.range_y  = range_y
+        self.per_bin  = per_bin
+
+    @property
+    def ndim(self):
+        return 1 if self.key_y is None and self.getval_y is None else 2
+
+    def evaluate(self, gout, kwargs:dict):
+        vals = [gout[self.key_hist] if self.getval is None else self.getval(gout, **kwargs), ]
+        if self.ndim == 2:
+            vals.append(gout[self.key_y] if self.getval_y is None else self.getval_y(gout, **kwargs))
+        out = hist_groups(vals, gout.segments.counts, [self.bins, self.bins_y][:self.ndim], [self.range, self.range_y][:self.ndim], 
+                            density=self.density, weights=_hist_weights(gout, self.weights, kwargs), log=[self.log, False][:self.ndim])
+        if self.per_bin is None:
+            return out
+        return out[0] / self.per_bin(*out[1:]), *out[1:]
+
+def spec_massfunction(key_mass=ParamKeys.mass, bins=None, range=None, **kwargs)->HistSpec:
+    """Spec matching massfunction"""
+    return HistSpec(key_hist=key_mass, bins=bins, range=range, per_bin=bin_size, **kwargs)
+
+def spec_spatial3d_dn(bins=None, range=None, **kwargs)->HistSpec:
+    """Spec matching spatial3d_dn, keyword arguments are passed to project3d"""
+    return HistSpec(getval=lambda gout, **k: project3d(gout, **(k | kwargs)), bins=bins, range=range)
+
+def spec_spatial3d_dndv(bins=None, range=None, **kwargs)->HistSpec:
+    """Spec matching spatial3d_dndv, keyword arguments are passed to project3d"""
+    return HistSpec(getval=lambda gout, **k: project3d(gout, **(k | kwargs)), bins=bins, range=range, per_bin=bin_volume)
+
+class HistGroup():
+    """
+    Set of histograms sharing a node filter, computed together in a single pass over each output. 
+    The filter is evaluated once and every column is read once, no matter how many histograms use it.
+    Each histogram is available as a segmented script via script(label), 
+    returning the same outputs as the corresponding stand alone script (eg. massfunction).
+    Usable with macro_run via macro_add_hists.
+    """
+    def __init__(self, specs:dict[str, HistSpec], nfilter:(Callable | np.ndarray[bool])=None, **kwargs):
+        self.specs   = specs
+        self.nfilter = nfilter
+        self.kwargs  = kwargs
+
+    def evaluate(self, gout)->dict:
+        """
+        Evaluates all histograms for an entire output. If the output caches node filter results 
+        (see TreeSet.cache_filters) the result is kept along with them and reused by every member.
+        """
+        root  = gout.unfilter()
+        cache = root.data._filtercache
+        if cache is not None and ("histgroup", self) in cache:
+            return cache[("histgroup", self)]
+        _nodefilter = _segmented_nodefilter(self.nfilter, root, self.kwargs)
+        _gout   = root.filter(_nodefilter)
+        _kwargs = self.kwargs | dict(nfilter=_nodefilter)
+        out = {label: spec.evaluate(_gout, _kwargs) for label, spec in self.specs.items()}
+        if cache is not None:
+            cache[("histgroup", self)] = out
+        return out
+
+    def script(self, label:str)->Callable:
+        @gscript_segmented
+        def func(gout, **kwargs):
+            return self.evaluate(gout)[label]
+        # Columns of the whole group, they are read together
+        entries = [val for spec in self.specs.values() 
+                    for val in (spec.key_hist, spec.getval, spec.key_y, spec.getval_y, spec.weights)] + [self.nfilter, ]
+        func.reads = tuple(val if isinstance(val, str) else freeze(val, **self.kwargs) 
+                            for val in entries if isinstance(val, (str, Callable)))
+        return func
+
+    def scripts(self)->dict[str, Callable]:
+        return {label: self.script(label) for label in self.specs}
@@ -7,69 +7,64 @@ from typing import Callable
 from subscript.scripts.spatial import project3d, project2d
 from subscript.wrappers import gscript
 from subscript.defaults import ParamKeys
+from subscript.nfexpr import NFExpr, as_nfexpr, nfexpr, rowwise
+from subscript.tabulatehdf5 import in_range
+from subscript.planner import reads
+from subscript.spatialindex import spatial_index, index_mask
 
 # This design is chosen to allow for lsps 
 # basically impossible impossible to get 
 # type hints unless we design our function like this
-def nfor(arg1:(np.ndarray[bool] | Callable), arg2:(np.ndarray[bool] | Callable)):
-    _a1 = arg1
-    if isinstance(arg1, np.ndarray):
-        _a1 = lambda *a, **k: arg1
-    _a2 = arg2
-    if isinstance(arg2, np.ndarray):
-        _a2 = lambda *a, **k: arg2
-    return lambda *a, **k: _a1(*a, **k) | _a2(*a, **k)
-
-def nfand(arg1:(np.ndarray[bool] | Callable), arg2:(np.ndarray[bool] | Callable)):
-    _a1 = arg1
-    if isinstance(arg1, np.ndarray):
-        _a1 = lambda *a, **k: arg1
-    _a2 = arg2
-    if isinstance(arg2, np.ndarray):
-        _a2 = lambda *a, **k: arg2
-    return lambda *a, **k: _a1(*a, **k) & _a2(*a, **k)
-
-def nfnot(arg:(np.ndarray[bool] | Callable)):
-    _a1 = arg
-    if isinstance(arg, np.ndarray):
-        _a1 = lambda *a, **k: arg
-    return lambda *a, **k: np.logical_not(_a1(*a, **k)) 
+# Filters are combined lazily, see subscript.nfexpr
+def nfor(arg1:(np.ndarray[bool] | Callable), arg2:(np.ndarray[bool] | Callable))->NFExpr:
+    return as_nfexpr(arg1) | as_nfexpr(arg2)
+
+def nfand(arg1:(np.ndarray[bool] | Callable), arg2:(np.ndarray[bool] | Callable))->NFExpr:
+    return as_nfexpr(arg1) & as_nfexpr(arg2)
+
+def nfnot(arg:(np.ndarray[bool] | Callable))->NFExpr:
+    return ~as_nfexpr(arg)
 
 @gscript
 def nfilter_all(gout, **kwargs):
     return np.ones(gout[next(iter(gout))].shape, dtype=bool)
 
+@rowwise
 @gscript
 def nfilter_halos(gout, key_is_isolated=ParamKeys.is_isolated, **kwargs):
     return (gout[key_is_isolated] == 1)
 
+@rowwise
 @gscript
 def nfilter_subhalos(gout, key_is_isolated=ParamKeys.is_isolated, **kwargs):
     return (gout[key_is_isolated] == 0)
 
+@rowwise
 @gscript
-def nfilter_range(gout, min, max, key = None, getval = None, inclmin = True, inclmax = False, **kwargs):
-    if key is not None:
-        val = gout[key]
+def nfilter_range(gout, min, max, key = None, getval = None, inclmin = True, inclmax = None, **kwargs):
+    # The upper bound is inclusive if the lower bound is, unless inclmax is given
+    _inclmax = inclmin if inclmax is None else inclmax
     if getval is not None: 
-        val = getval(gout, **kwargs)
-    lb = min <= val if inclmin else min < val
-    ub = val <= max if inclmin else val < max
-    return lb & ub
+        return in_range(getval(gout, **kwargs), min, max, inclmin, _inclmax)
+    # Reads only the parts of the column that can match if it has a zone map
+    return gout.range_mask(key, min, max, inclmin, _inclmax)
 
 @gscript
 def nfilter_most_massive_progenitor(gout, key_mass_basic=ParamKeys.mass_basic, **kwargs):
-    out = np.logical_not(nfilter_all(gout,**kwargs))
-    immp = np.argmax(gout[key_mass_basic])
+    mass = gout[key_mass_basic]
+    out  = np.zeros(mass.shape, dtype=bool)
+    immp = np.argmax(mass)
     out[immp] = True
     return out
 
+@reads(project3d)
 @gscript
 def nfilter_virialized(gout, key_rvir=ParamKeys.rvir, key_mass_basic=ParamKeys.mass_basic, inclusive = True, **kwargs):
-    fmmp = nfilter_most_massive_progenitor(gout, key_mass_basic=key_mass_basic, **kwargs)
-    rv = gout[key_rvir][fmmp][0]
-    return nfilter_range(gout, min=0, max=rv, inclmin=True, inclmax=inclusive, getval=project3d)
+    # Evaluated directly rather than through nested (per tree) filter scripts
+    rv = gout[key_rvir][np.argmax(gout[key_mass_basic])]
+    return in_range(project3d(gout), min=0, max=rv, inclmin=True, inclmax=inclusive)
 
+@reads(nfilter_subhalos, nfilter_virialized)
 @gscript
 def nfilter_subhalos_valid(gout, mass_min, mass_max, key_mass=ParamKeys.mass, 
                             kwargs_nfilter_subhalos = None, kwargs_nfilter_virialized=None, kwargs_nfilter_range=None, 
@@ -84,16 +79,29 @@ def nfilter_subhalos_valid(gout, mass_min, mass_max, key_mass=ParamKeys.mass,
     kwargs_nfilter_virialized = {} if kwargs_nfilter_virialized is None else kwargs_nfilter_virialized
     kwargs_nfilter_range      = {} if kwargs_nfilter_range is None else kwargs_nfilter_range
 
-    a = nfilter_subhalos  (gout, **kwargs_nfilter_subhalos) 
-    b = nfilter_virialized(gout, **kwargs_nfilter_virialized) 
-    c = nfilter_range     (gout, min=mass_min, max=mass_max, key=key_mass, **kwargs_nfilter_range)
+    a = nfexpr(nfilter_subhalos  , **kwargs_nfilter_subhalos) 
+    b = nfexpr(nfilter_virialized, **kwargs_nfilter_virialized) 
+    c = nfexpr(nfilter_range     , min=mass_min, max=mass_max, key=key_mass, **kwargs_nfilter_range)
 
-    return a & b & c
+    return (a & b & c)(gout)
 
+@rowwise
+@reads(project3d)
 @gscript
 def nfilter_project3d(gout, rmin, rmax, **kwargs):
     return nfilter_range(gout, rmin, rmax, getval=project3d, **kwargs)
 
+@reads(project2d)
 @gscript
 def nfilter_project2d(gout, rmin, rmax, normvector, **kwargs):
-    return nfilter_range(gout, rmin, rmax, getval=project2d, normvector=normvector, **kwargs)
\ No newline at end of file
+    return nfilter_range(gout, rmin, rmax, getval=project2d, normvector=normvector, **kwargs)
+
+@gscript
+def nfilter_within(gout, rmax, rmin=0.0, center=(0.0, 0.0, 0.0), normvector=None, inclmin=True, inclmax=False, 
+                    key_x=ParamKeys.x, key_y=ParamKeys.y, key_z=ParamKeys.z, **kwargs):
+    """
+    Nodes with rmin <= r < rmax from center, within a radial shell or (if a normal vector is given) a projected aperture.
+    Uses the spatial index of the tree, only nodes near the shell are visited.
+    """
+    index = spatial_index(gout, normvector, key_x, key_y, key_z)
+    return index_mask(index.within(rmax, center, rmin, inclmin, inclmax), index.n)
@@ -1,13 +1,15 @@
 #!/usr/bin/env python
 import numpy as np
 from typing import Iterable
-from subscript.wrappers import gscript
+from subscript.wrappers import gscript_segmented
 from subscript.tabulatehdf5 import NodeProperties
 
-@gscript
+@gscript_segmented
 def nodedata(gout:NodeProperties, key:(str | Iterable[str]), **kwargs):
-    return gout[key]
+    if isinstance(key, str):
+        return gout.segments.nodewise(gout[key])
+    return [gout.segments.nodewise(val) for val in gout[key]]
 
-@gscript
+@gscript_segmented
 def nodecount(gout:NodeProperties, **kwargs):
-    return np.sum(gout.get_filter())
+    return gout.segments.counts
@@ -5,16 +5,44 @@ import h5py
 
 from subscript.wrappers import gscript, gscript_proj
 from subscript.defaults import ParamKeys
+from subscript.nfexpr import rowwise
+from subscript.spatialindex import spatial_index
 
+@rowwise
 @gscript
 def project3d(gout, key_x=ParamKeys.x, key_y=ParamKeys.y, key_z=ParamKeys.z, **kwargs):
+    if (key_x, key_y, key_z) == (ParamKeys.x, ParamKeys.y, ParamKeys.z):
+        # Computed once per output, see subscript.derived
+        return gout[ParamKeys.derived_r3d]
     return np.linalg.norm(np.asarray((gout[key_x], gout[key_y], gout[key_z])), axis=0)
 
-@gscript_proj
-def project2d(gout, normvector, key_x=ParamKeys.x, key_y=ParamKeys.y, key_z=ParamKeys.z, **kwargs):
+def _project2d(gout, normvector, key_x=ParamKeys.x, key_y=ParamKeys.y, key_z=ParamKeys.z, **kwargs):
+    # Projected radii for a (K, 3) array of normal vectors, returns a (K, nodes) array
     coords = np.asarray((gout[key_x], gout[key_y], gout[key_z]))
     # Projection equations, just pythagorean theorem
     # r2^2 = (|r|)^2 + (r.un)^2
     rnorm  = np.linalg.norm(coords, axis=0)
-    rdotun = np.dot(normvector / np.linalg.norm(normvector), coords)
-    return np.sqrt(rnorm**2 - rdotun**2)
\ No newline at end of file
+    rdotun = np.dot(normvector / np.linalg.norm(normvector, axis=1, keepdims=True), coords)
+    return np.sqrt(rnorm**2 - rdotun**2)
+
+@gscript_proj(batched=True)
+def project2d(gout, normvector, key_x=ParamKeys.x, key_y=ParamKeys.y, key_z=ParamKeys.z, **kwargs):
+    return _project2d(gout, normvector, key_x=key_x, key_y=key_y, key_z=key_z)
+
+@gscript
+def count_within(gout, r, center=(0.0, 0.0, 0.0), normvector=None, key_x=ParamKeys.x, key_y=ParamKeys.y, key_z=ParamKeys.z, **kwargs):
+    """
+    Number of nodes within each radius r of center, eg. N(<r) for a set of bin edges. 
+    Projected (within an aperture) if a normal vector is given. Uses the spatial index of the tree.
+    """
+    return spatial_index(gout, normvector, key_x, key_y, key_z).count(r, center)
+
+@gscript
+def nearest_distance(gout, k=1, center=(0.0, 0.0, 0.0), normvector=None, key_x=ParamKeys.x, key_y=ParamKeys.y, key_z=ParamKeys.z, **kwargs):
+    """Distances of the k nodes nearest to center (inf if there are fewer nodes). Uses the spatial index of the tree."""
+    return spatial_index(gout, normvector, key_x, key_y, key_z).nearest(k, center)[0]
+
+def isotropic_normvectors(n:int, rng:(np.random.Generator | int)=None)->np.ndarray:
+    """Returns n normal vectors drawn uniformly from the unit sphere, as a (n, 3) array"""
+    v = np.random.default_rng(rng).normal(size=(n, 3))
+    return v / np.linalg.norm(v, axis=1, keepdims=True)
@@ -0,0 +1,40 @@
+#!/usr/bin/env python
+from __future__ import annotations
+import numpy as np
+
+class SortedIndex():
+    """
+    Sorted copy of a column along with the order of its nodes (argsort).
+    Range selections and cumulative counts take a binary search (np.searchsorted) instead of a pass over the column.
+    NaN values sort last and never match.
+    """
+    def __init__(self, values:np.ndarray):
+        self.order  = np.argsort(values, kind="stable")
+        self.values = np.asarray(values)[self.order]
+        self.n      = len(self.values)
+        # NaN values sort last
+        self.nvalid = int(np.searchsorted(self.values, np.nan)) if self.values.dtype.kind == "f" else self.n
+
+    def bounds(self, min, max, inclmin:bool=True, inclmax:bool=False)->tuple[int, int]:
+        """Positions, within the sorted values, of the first and one past the last value in range"""
+        n0 = np.searchsorted(self.values, min, side="left" if inclmin else "right")
+        n1 = np.searchsorted(self.values, max, side="right" if inclmax else "left")
+        return int(n0), int(np.maximum(n0, n1))
+
+    def range(self, min, max, inclmin:bool=True, inclmax:bool=False)->np.ndarray[int]:
+        """Indices of the nodes with min <= value < max (inclusive bounds are set by inclmin and inclmax)"""
+        n0, n1 = self.bounds(min, max, inclmin, inclmax)
+        return self.order[n0:n1]
+
+    def range_mask(self, min, max, inclmin:bool=True, inclmax:bool=False)->np.ndarray[bool]:
+        out = np.zeros(self.n, dtype=bool)
+        out[self.range(min, max, inclmin, inclmax)] = True
+        return out
+
+    def count_below(self, edges:np.ndarray, inclusive:bool=False)->np.ndarray[int]:
+        """Number of nodes with value < edge (<= if inclusive) for each edge, eg. N(<r)"""
+        return np.searchsorted(self.values, edges, side="right" if inclusive else "left")
+
+    def count_above(self, edges:np.ndarray, inclusive:bool=False)->np.ndarray[int]:
+        """Number of nodes with value > edge (>= if inclusive) for each edge, eg. N(>M)"""
+        return self.nvalid - np.searchsorted(self.values, edges, side="left" if inclusive else "right")
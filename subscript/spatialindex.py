@@ -0,0 +1,98 @@
+#!/usr/bin/env python
+from __future__ import annotations
+from collections import OrderedDict
+import numpy as np
+from scipy.spatial import cKDTree
+
+from subscript.tabulatehdf5 import NodeProperties, in_range
+from subscript.defaults import ParamKeys, Meta
+from subscript.fingerprint import fingerprint
+
+def _plane_basis(normvector:np.ndarray)->np.ndarray:
+    # Orthonormal basis, as a (2, 3) array, of the plane normal to normvector
+    n = np.asarray(normvector, dtype=float) / np.linalg.norm(normvector)
+    a = np.eye(3)[np.argmin(np.abs(n))]
+    u = np.cross(n, a)
+    u = u / np.linalg.norm(u)
+    return np.asarray((u, np.cross(n, u)))
+
+class SpatialIndex():
+    """
+    KD-tree (scipy.spatial.cKDTree) over node positions. If normvector is given, positions are projected
+    onto the plane normal to it and distances are projected distances (eg. for apertures).
+    Queries return indices of nodes, in the order of the positions the index was built from.
+    """
+    def __init__(self, coords:np.ndarray, normvector:np.ndarray=None):
+        self.basis = None if normvector is None else _plane_basis(normvector)
+        # Positions are given as a (3, N) array, like the columns they are read from
+        self.tree  = cKDTree(self._project(np.asarray(coords, dtype=float)).T)
+        self.n     = self.tree.n
+
+    def _project(self, points:np.ndarray)->np.ndarray:
+        return points if self.basis is None else self.basis @ points
+
+    def within(self, rmax, center=(0.0, 0.0, 0.0), rmin=0.0, inclmin:bool=True, inclmax:bool=False)->np.ndarray[int]:
+        """Sorted indices of the nodes with rmin <= r < rmax from center (inclusive bounds are set by inclmin and inclmax)"""
+        c     = self._project(np.asarray(center, dtype=float))
+        index = np.sort(np.asarray(self.tree.query_ball_point(c, rmax), dtype=int))
+        if len(index) == 0:
+            return index
+        r = np.linalg.norm(self.tree.data[index] - c, axis=1)
+        return index[in_range(r, rmin, rmax, inclmin, inclmax)]
+
+    def count(self, r:np.ndarray, center=(0.0, 0.0, 0.0))->np.ndarray[int]:
+        """Number of nodes within (<=) each radius r of center, eg. N(<r) for a set of bin edges"""
+        _r = np.asarray(r, dtype=float).ravel()
+        c  = np.broadcast_to(self._project(np.asarray(center, dtype=float)), (len(_r), self.tree.m))
+        return np.asarray(self.tree.query_ball_point(c, _r, return_length=True)).reshape(np.shape(r))
+
+    def nearest(self, k:int=1, center=(0.0, 0.0, 0.0))->tuple[np.ndarray, np.ndarray[int]]:
+        """Distances and indices of the k nodes nearest to center, missing neighbours have distance inf and index n"""
+        d, index = self.tree.query(self._project(np.asarray(center, dtype=float)), k=k)
+        return np.atleast_1d(d), np.atleast_1d(index)
+
+def _root_rows(gout:NodeProperties)->np.ndarray[int]:
+    # Rows of the root node properties (see NodeProperties.unfilter) gout holds, None if it holds all of them
+    rows = None
+    node = gout
+    while isinstance(node.data, NodeProperties) and node._segments is None:
+        sel = None
+        if node._selection is not None:
+            sel = node._selection.index
+        elif node._nodefilter is not None:
+            nf  = np.asarray(node._nodefilter)
+            sel = np.flatnonzero(nf) if nf.dtype == bool else nf
+        if sel is not None:
+            rows = sel if rows is None else sel[rows]
+        node = node.data
+    return rows
+
+def spatial_index(gout:NodeProperties, normvector:np.ndarray=None,
+                    key_x=ParamKeys.x, key_y=ParamKeys.y, key_z=ParamKeys.z)->SpatialIndex:
+    """
+    Spatial index of the (filtered) nodes of a tree, use ParamKeys.relx / rely / relz for positions relative to the host.
+    The index is built on first use and kept along with the tree, for each node filter and projection it is used with.
+    At most Meta.spatial_indexes indexes are kept per tree, least recently used are evicted first.
+    """
+    root = gout.unfilter().data
+    if root.segments is not None and root.segments.ntrees > 1:
+        raise RuntimeError("Spatial indexes span a single tree, use them from per tree scripts (see gscript)")
+    if root._spatial is None:
+        root._spatial = OrderedDict()
+    rows = _root_rows(gout)
+    key  = (key_x, key_y, key_z, None if normvector is None else tuple(np.ravel(normvector)), 
+            None if rows is None else fingerprint(rows))
+    if key in root._spatial:
+        root._spatial.move_to_end(key)
+        return root._spatial[key]
+    index = SpatialIndex(np.asarray((gout[key_x], gout[key_y], gout[key_z])), normvector)
+    root._spatial[key] = index
+    while len(root._spatial) > max(Meta.spatial_indexes, 1):
+        root._spatial.popitem(last=False)
+    return index
+
+def index_mask(index:np.ndarray[int], n:int)->np.ndarray[bool]:
+    """Mask of the nodes in index (see SpatialIndex)"""
+    mask = np.zeros(n, dtype=bool)
+    mask[index] = True
+    return mask
@@ -0,0 +1,193 @@
+#!/usr/bin/env python
+from __future__ import annotations
+from typing import Callable, Iterable
+import numpy as np
+
+class OnlineMoments():
+    """One pass (Welford / Chan et al.) mean and variance, element-wise over arrays of a fixed shape"""
+    def __init__(self):
+        self.n    = 0
+        self.mean = None
+        self.m2   = None
+        self.min  = None
+        self.max  = None
+        self.sum  = None
+
+    def add(self, batch:np.ndarray):
+        """Adds a batch of samples, stacked along the first axis"""
+        batch = np.asarray(batch)
+        if batch.shape[0] == 0:
+            return
+        other = OnlineMoments()
+        other.n    = batch.shape[0]
+        other.mean = np.mean(batch, axis=0)
+        other.m2   = np.sum((batch - other.mean)**2, axis=0)
+        other.min  = np.min(batch, axis=0)
+        other.max  = np.max(batch, axis=0)
+        other.sum  = np.sum(batch, axis=0)
+        self.merge(other)
+
+    def merge(self, other:OnlineMoments):
+        if other.n == 0:
+            return self
+        if self.n == 0:
+            self.n, self.mean, self.m2 = other.n, other.mean, other.m2
+            self.min, self.max, self.sum = other.min, other.max, other.sum
+            return self
+        n     = self.n + other.n
+        delta = other.mean - self.mean
+        self.mean = self.mean + delta * other.n / n
+        self.m2   = self.m2 + other.m2 + delta**2 * self.n * other.n / n
+        self.min  = np.minimum(self.min, other.min)
+        self.max  = np.maximum(self.max, other.max)
+        self.sum  = self.sum + other.sum
+        self.n    = n
+        return self
+
+    def var(self, ddof:int=0):
+        return self.m2 / (self.n - ddof)
+
+    def std(self, ddof:int=0):
+        return np.sqrt(self.var(ddof))
+
+class QuantileSketch():
+    """
+    Mergeable quantile sketch (a simplified KLL sketch), element-wise over arrays of a fixed shape.
+    Level h holds up to k samples of weight 2^h, full levels are compacted by sorting and keeping every other sample.
+    Memory grows only logarithmically with the number of samples.
+    Quantiles are exact (and match np.quantile) until the first compaction.
+    """
+    def __init__(self, k:int=256):
+        self.k      = k
+        self.levels = []
+        self.n      = 0
+
+    def add(self, batch:np.ndarray):
+        """Adds a batch of samples, stacked along the first axis"""
+        batch = np.asarray(batch, dtype=float)
+        if batch.shape[0] == 0:
+            return
+        self._extend(0, batch)
+        self.n += batch.shape[0]
+        self._compact()
+
+    def merge(self, other:QuantileSketch):
+        for h, items in enumerate(other.levels):
+            self._extend(h, items)
+        self.n += other.n
+        self._compact()
+        return self
+
+    def _extend(self, h:int, items:np.ndarray):
+        while len(self.levels) <= h:
+            self.levels.append(np.zeros((0, *items.shape[1:])))
+        self.levels[h] = np.concatenate((self.levels[h], items))
+
+    def _compact(self):
+        h = 0
+        while h < len(self.levels):
+            items = self.levels[h]
+            if items.shape[0] < self.k:
+                h += 1
+                continue
+            # Hold back a sample if needed so an even number of samples is compacted
+            nkeep  = items.shape[0] % 2
+            _items = np.sort(items[nkeep:], axis=0)
+            # Alternate the offset between compactions to avoid a systematic bias
+            offset = (self.n // self.k + h) % 2
+            self.levels[h] = items[:nkeep]
+            self._extend(h + 1, _items[offset::2])
+            h += 1
+
+    @property
+    def exact(self):
+        return len(self.levels) <= 1
+
+    def quantile(self, q:float)->np.ndarray:
+        if self.exact:
+            return np.quantile(self.levels[0], q, axis=0)
+        items   = np.concatenate(self.levels)
+        weights = np.concatenate([np.full(level.shape[0], 2**h) for h, level in enumerate(self.levels)])
+        weights = weights.reshape(-1, *np.ones(items.ndim - 1, dtype=int))
+        order   = np.argsort(items, axis=0)
+        _items  = np.take_along_axis(items, order, axis=0)
+        cum     = np.cumsum(np.take_along_axis(np.broadcast_to(weights, items.shape), order, axis=0), axis=0)
+        # First sample where the cumulative weight reaches the requested fraction
+        i = np.argmax(cum >= q * cum[-1], axis=0)
+        return np.take_along_axis(_items, np.expand_dims(i, 0), axis=0)[0]
+
+def percentile(q:float)->Callable:
+    """Statistic function for the q-th percentile, usable with both summarize and stream"""
+    func = lambda a, axis=0: np.percentile(a, q, axis=axis)
+    func.__name__ = f"percentile{q:g}"
+    func.quantile = q / 100
+    return func
+
+def _stream_stat(f:Callable, moments:OnlineMoments, sketch:QuantileSketch):
+    if f is np.mean:
+        return moments.mean
+    if f is np.std:
+        return moments.std()
+    if f is np.var:
+        return moments.var()
+    if f in (np.min, np.amin):
+        return moments.min
+    if f in (np.max, np.amax):
+        return moments.max
+    if f is np.sum:
+        return moments.sum
+    if f is np.median:
+        return sketch.quantile(0.5)
+    if hasattr(f, "quantile"):
+        return sketch.quantile(f.quantile)
+    raise RuntimeError(f"Statistic {getattr(f, '__name__', f)} can not be evaluated while streaming")
+
+class StreamSummary():
+    """
+    Summary statistics of per tree outputs accumulated one tree (or batch of trees) at a time.
+    Memory does not grow with the number of trees, summaries can be merged across files and processes.
+    """
+    def __init__(self, k:int=256):
+        self.k        = k
+        self.multi    = None
+        self.moments  = []
+        self.sketches = []
+
+    def _init(self, multi:bool, nouts:int):
+        if self.multi is None:
+            self.multi    = multi
+            self.moments  = [OnlineMoments() for _ in range(nouts)]
+            self.sketches = [QuantileSketch(self.k) for _ in range(nouts)]
+
+    def update(self, o):
+        """Adds the output of a single tree, in the form collected by gscript"""
+        multi = isinstance(o, Iterable)
+        _o    = o if multi else [o, ]
+        self._init(multi, len(_o))
+        for moments, sketch, val in zip(self.moments, self.sketches, _o):
+            batch = np.expand_dims(np.asarray(val), 0)
+            moments.add(batch)
+            sketch.add(batch)
+
+    def update_stacked(self, vals:Iterable[np.ndarray], multi:bool):
+        """Adds the outputs of many trees, each output stacked along the first axis"""
+        self._init(multi, len(vals))
+        for moments, sketch, val in zip(self.moments, self.sketches, vals):
+            moments.add(val)
+            sketch.add(val)
+
+    def merge(self, other:StreamSummary):
+        if other.multi is None:
+            return self
+        self._init(other.multi, len(other.moments))
+        for a, b in zip(self.moments, other.moments):
+            a.merge(b)
+        for a, b in zip(self.sketches, other.sketches):
+            a.merge(b)
+        return self
+
+    def result(self, statfuncs:Iterable[Callable]=None)->list:
+        _statfuncs = [np.mean, ] if statfuncs is None else statfuncs
+        if self.multi:
+            return [[_stream_stat(f, mo, sk) for mo, sk in zip(self.moments, self.sketches)] for f in _statfuncs]
+        return [_stream_stat(f, self.moments[0], self.sketches[0]) for f in _statfuncs]
@@ -0,0 +1,96 @@
+#!/usr/bin/env python
+from __future__ import annotations
+import os
+import numpy as np
+import h5py
+
+from subscript.defaults import ParamKeys
+
+def _node_counts(rng:np.random.Generator, ntrees:int, nodes_per_tree:(int | tuple[int, int]))->np.ndarray[int]:
+    if np.isscalar(nodes_per_tree):
+        return np.full(ntrees, int(nodes_per_tree))
+    nmin, nmax = nodes_per_tree
+    # Log uniform, most trees are small while a few dominate the node count
+    return np.round(np.exp(rng.uniform(np.log(nmin), np.log(nmax + 1), ntrees)) - 0.5).astype(int).clip(nmin, nmax)
+
+def _tree_nodes(rng:np.random.Generator, counts:np.ndarray[int], subhalo_fraction:float, redshift:float)->dict[str, np.ndarray]:
+    # Node properties of a set of trees, the first node of each tree is the host halo
+    n        = int(np.sum(counts))
+    tree     = np.repeat(np.arange(len(counts)), counts)
+    start    = np.cumsum(counts) - counts
+    is_host  = np.zeros(n, dtype=bool)
+    is_host[start[counts > 0]] = True
+
+    # Remaining nodes are subhalos of the host, or isolated halos (eg. progenitors of the host)
+    is_sub   = ~is_host & (rng.uniform(size=n) < subhalo_fraction)
+    isolated = ~is_sub
+
+    mass_host = 10**rng.uniform(12, 14, len(counts))
+    rvir_host = 0.26 * (mass_host / 1e12)**(1 / 3)
+    # Power law mass function dN/dM ~ M^-1.9, between 1e-6 and 1e-1 of the host mass
+    u    = rng.uniform(size=n)
+    a    = 1 - 1.9
+    frac = ((1e-1**a - 1e-6**a) * u + 1e-6**a)**(1 / a)
+    mass = np.where(is_host, mass_host[tree], frac * mass_host[tree])
+
+    # Isotropic positions, radial distribution ~ r^2 within the host virial radius
+    r   = rvir_host[tree] * rng.uniform(size=n)**(1 / 3) * 1.5
+    v   = rng.normal(size=(3, n))
+    pos = np.where(is_host, 0.0, r * v / np.linalg.norm(v, axis=0))
+
+    return {
+        ParamKeys.is_isolated    : isolated.astype(np.int64),
+        ParamKeys.hierarchylevel : is_sub.astype(np.int64),
+        ParamKeys.mass_basic     : mass,
+        ParamKeys.mass_bound     : np.where(is_sub, mass * rng.uniform(0.05, 1, n), mass),
+        ParamKeys.rvir           : np.where(is_host, rvir_host[tree], 0.26 * (mass / 1e12)**(1 / 3)),
+        ParamKeys.scale_radius   : np.where(is_host, rvir_host[tree], 0.26 * (mass / 1e12)**(1 / 3)) / 10,
+        ParamKeys.x              : pos[0],
+        ParamKeys.y              : pos[1],
+        ParamKeys.z              : pos[2],
+        ParamKeys.relx           : pos[0],
+        ParamKeys.rely           : pos[1],
+        ParamKeys.relz           : pos[2],
+        ParamKeys.z_lastisolated : np.where(is_sub, redshift + rng.uniform(0, 2, n), redshift),
+    }
+
+def write_synthetic_galacticus(path:str, ntrees:int=100, nodes_per_tree:(int | tuple[int, int])=100, subhalo_fraction:float=0.9,
+                                outputs:tuple[int, ...]=(1, ), chunks:int=2**14, compression:str="gzip",
+                                seed:int=None, rows:int=2**20, counts:tuple[int, ...]=None)->str:
+    """
+    Writes a file in the galacticus output format (Outputs/OutputN/nodeData, mergerTreeCount, mergerTreeIndex),
+    filled with synthetic merger trees, for tests and benchmarks.
+    Each tree holds nodes_per_tree nodes (or a number drawn from the (min, max) range): a host halo followed by
+    subhalos (a fraction subhalo_fraction of the other nodes) and isolated halos. Columns are chunked along nodes
+    with chunks nodes per chunk (None for contiguous columns) and compressed with compression (None for no compression).
+    Trees are written rows nodes at a time, so memory use does not grow with the size of the file.
+    If counts is given, it sets the number of nodes of each tree instead of ntrees and nodes_per_tree.
+    Returns the path of the file.
+    """
+    _path   = os.fspath(path)
+    rng     = np.random.default_rng(seed)
+    _ntrees = ntrees if counts is None else len(counts)
+    with h5py.File(_path, "w") as f:
+        for nout, output in enumerate(sorted(outputs)):
+            _counts = _node_counts(rng, ntrees, nodes_per_tree) if counts is None else np.asarray(counts, dtype=int)
+            n       = int(np.sum(_counts))
+            outn    = f.create_group(f"Outputs/Output{output}")
+            outn["mergerTreeCount"] = _counts
+            outn["mergerTreeIndex"] = np.arange(_ntrees) + 1
+            outn.attrs["outputExpansionFactor"] = 1 / (1 + len(outputs) - 1 - nout)
+
+            nd     = outn.create_group("nodeData")
+            _chunks = None if chunks is None or n == 0 else (min(chunks, n), )
+            # Trees are generated in blocks of about rows nodes
+            bounds = np.searchsorted(np.cumsum(_counts), np.arange(rows, n + rows, rows), side="right")
+            t0, n0 = 0, 0
+            for t1 in np.unique(np.append(bounds, _ntrees)):
+                block = _tree_nodes(rng, _counts[t0:t1], subhalo_fraction, redshift=len(outputs) - 1 - nout)
+                n1    = n0 + int(np.sum(_counts[t0:t1]))
+                for key, val in block.items():
+                    if key not in nd:
+                        nd.create_dataset(key, shape=(n, ), dtype=val.dtype, chunks=_chunks,
+                                            compression=compression if _chunks is not None else None)
+                    nd[key][n0:n1] = val
+                t0, n0 = t1, n1
+    return _path
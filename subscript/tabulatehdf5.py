@@ -1,4 +1,5 @@
 #!/usr/bin/env python
+from __future__ import annotations
 import h5py
 from typing import Callable, Iterable
 import numpy as np
@@ -7,11 +8,29 @@ from collections import UserDict
 from subscript.defaults import ParamKeys
 from copy import copy
 from subscript.defaults import Meta
+from subscript.cache import ColumnCache, get_cache
+from subscript.derived import derived_columns
+from subscript.colstore import read_colstore, source_stat
+from subscript.zonemap import read_zonemap
+from subscript.fingerprint import fingerprint
+from subscript.planner import expand_derived
+from subscript.sortedindex import SortedIndex
+from subscript.profiling import record_read, record_cache
 
 class NodeProperties(UserDict):
     _nodefilter = None
+    _selection = None
+    _filtered = None
     _startn = 0
     _stopn = None
+    _segments = None
+    _segments_filtered = None
+    _filtercache = None
+    _cache = None
+    _derived = None
+    _zonemaps = None
+    _spatial = None
+    _sorted = None
 
     def __init__(self, d):
         out = super(NodeProperties,self).__init__()
@@ -23,6 +42,8 @@ class NodeProperties(UserDict):
         if isinstance(d, NodeProperties):
             self._startn = d._startn
             self._stopn =  d._stopn
+            self._cache  = d._cache
+            self._zonemaps = d._zonemaps
 
     def __str__(self):
         return f"NodeData object"
@@ -30,18 +51,63 @@ class NodeProperties(UserDict):
     def __repr__(self):
         return f"NodeData object"
 
+    @property
+    def segments(self):
+        """Tree offsets of the (filtered) nodes, None unless this spans a whole output"""
+        if self._segments is not None:
+            return self._segments
+        if not isinstance(self.data, NodeProperties):
+            return None
+        segments = self.data.segments
+        if segments is None or (self._nodefilter is None and self._selection is None):
+            return segments
+        if self._segments_filtered is None:
+            self._segments_filtered = segments.filter(self._selection if self._selection is not None else self._nodefilter)
+        return self._segments_filtered
+
     def unfilter(self):
-        # recursivly unfilter until reaching root
-        if isinstance(self.data, UserDict):
+        # recursivly unfilter until reaching root (or the root of a whole output)
+        if isinstance(self.data, UserDict) and self._segments is None:
             return self.data.unfilter()
         return NodeProperties(self) 
 
+    def eval_filter(self, nfilter:Callable, kwargs:dict, key:str=None)->np.ndarray[bool]:
+        """
+        Evaluates a node filter on these node properties. 
+        If the root has a filter cache, the result is cached under key (see TreeSet.cache_filters).
+        """
+        root  = self.unfilter().data
+        cache = root._filtercache if key is not None else None
+        if cache is None:
+            return nfilter(self, **kwargs)
+        record_cache("filters", key in cache)
+        if key not in cache:
+            cache[key] = nfilter(self, **kwargs)
+        return cache[key]
+
     def filter(self, nodefilter):
-        out = NodeProperties(self)
-        out._nodefilter = nodefilter
+        if isinstance(nodefilter, (np.ndarray, np.bool_)) and nodefilter.ndim == 0 and nodefilter.dtype == bool:
+            # Node filter scripts return a scalar for trees with a single node (see gscript)
+            nodefilter = np.atleast_1d(nodefilter)
+        if not _is_mask(nodefilter):
+            out = NodeProperties(self)
+            out._nodefilter = nodefilter
+            return out
+
+        selection = Selection(nodefilter)
+        base      = self
+        if self._selection is not None and self._segments is None:
+            # Compose with the filter already applied, rather than filtering a filtered column again
+            selection = self._selection.compose(selection)
+            base      = self.data
+
+        out = NodeProperties(base)
+        out._selection = selection
         return out
 
     def get_filter(self):
+        if self._selection is not None:
+            return self._selection.mask
         if self._nodefilter is not None:
             return self._nodefilter
         return np.ones(self.data[next(self.data.__iter__())].shape[0], dtype=bool)
@@ -51,26 +117,435 @@ class NodeProperties(UserDict):
         if not isinstance(key, str):
             return [self[_key] for _key in key] 
 
-        val = self.data[key]
+        if self._selection is not None and self._selection.sparse and key not in (self._filtered or {}):
+            # Only read the blocks holding selected nodes
+            out = self._read_selected(key)
+            if out is not None:
+                self._filtered = {} if self._filtered is None else self._filtered
+                self._filtered[key] = _readonly(out)
+                return self._filtered[key]
+
+        if (not isinstance(self.data, UserDict)) and (key not in self.data) and (key in derived_columns):
+            val = self._get_derived(key)
+        else:
+            val = self.data[key]
+
         if isinstance(val, np.ndarray): 
             out = val
         elif isinstance(val, h5py.Dataset):
-            _val = val[self._startn:self._stopn]
-            if Meta.cache: 
-                self.data[key] = _val
-            out = _val
+            out = read_dataset(val, self._startn, self._stopn, self._cache)
         elif isinstance(val, Callable):
-            _val = val()[self._startn:self._stopn]
-            if Meta.cache:
-                self.data[key] = _val
-            out = _val
+            out = val()[self._startn:self._stopn]
         else:
             raise RuntimeError("Unrecognized Type") 
 
+        if self._selection is not None:
+            # Filtered columns are kept for the lifetime of the filtered node properties,
+            # they are shared by every script reading them so they are read only
+            if self._filtered is None:
+                self._filtered = {}
+            if key not in self._filtered:
+                self._filtered[key] = _readonly(self._selection.take(out))
+            return self._filtered[key]
+
         if self._nodefilter is None:
-            return out
+            # Columns are shared between scripts (and through the column cache, between calls), so they are read only
+            return _readonly(out)
         return out[self._nodefilter] 
+
+    def _dataset(self, key:str, unread:bool=False)->h5py.Dataset:
+        # Dataset backing a column of unfiltered node properties, None if the column is held in memory
+        # If unread is true, also the dataset of an output column that has not been read yet
+        node = self
+        while node._selection is None and node._nodefilter is None and isinstance(node.data, NodeProperties):
+            node = node.data
+        if node._selection is not None or node._nodefilter is not None or not isinstance(node.data, dict):
+            return None
+        val = node.data.get(key)
+        if unread and isinstance(val, OutputColumn) and val._data is None and isinstance(val.source, h5py.Dataset):
+            return val.source
+        return val if isinstance(val, h5py.Dataset) else None
+
+    def _read_selected(self, key:str)->np.ndarray:
+        if not isinstance(self.data, NodeProperties):
+            return None
+        # Columns shared by the trees of an output (see OutputColumn) are read for the selected rows only, unless already read
+        dset   = self.data._dataset(key, unread=True)
+        _cache = get_cache(self._cache)
+        if dset is None or (_cache is not None and (_column_key(dset, self._startn, self._stopn) in _cache or _column_key(dset) in _cache)):
+            return None
+        index = self._selection.index + self._startn
+        read  = lambda: read_dataset_rows(dset, index, self._startn, self._stopn)
+        if _cache is None:
+            return read()
+        # Node filters are usually shared (see TreeSet.cache_filters), so are the rows read for them
+        return _cache.get((*_column_key(dset, self._startn, self._stopn), fingerprint(index)), read)
+
+    def sorted_index(self, key:str)->SortedIndex:
+        """
+        Sorted index of a column, built on first use. None unless sorted indexes are enabled 
+        for the column (see TreeSet.sort_columns) and these node properties are unfiltered.
+        """
+        node = self
+        while node._selection is None and node._nodefilter is None and isinstance(node.data, NodeProperties):
+            node = node.data
+        if node._selection is not None or node._nodefilter is not None or node._sorted is None or key not in node._sorted:
+            return None
+        if node._sorted[key] is None:
+            node._sorted[key] = SortedIndex(node[key])
+        return node._sorted[key]
+
+    def range_mask(self, key:str, min, max, inclmin:bool=True, inclmax:bool=False, max_fraction:float=0.5)->np.ndarray[bool]:
+        """
+        Mask of the nodes with min <= self[key] < max (inclusive bounds are set by inclmin and inclmax).
+        If the column has a sorted index (see TreeSet.sort_columns) the range is found by binary search.
+        Otherwise, if the column has a zone map (see subscript.zonemap) and has not been read yet,
+        only the blocks of nodes that can hold matching values are read. If more than max_fraction 
+        of the column can match, the column is read in full instead (once, for all trees sharing it).
+        """
+        index = self.sorted_index(key)
+        if index is not None:
+            return index.range_mask(min, max, inclmin, inclmax)
+
+        zonemap = None if self._zonemaps is None else self._zonemaps.get(key)
+        dset    = None if zonemap is None else self._dataset(key, unread=True)
+        _cache  = get_cache(self._cache)
+        cached  = _cache is not None and dset is not None and (_column_key(dset, self._startn, self._stopn) in _cache or _column_key(dset) in _cache)
+        if dset is None or cached or sum(r1 - r0 for r0, r1 in zonemap.ranges(min, max)) > max_fraction * zonemap.n:
+            return in_range(self[key], min, max, inclmin, inclmax)
+
+        start = self._startn
+        stop  = dset.shape[0] if self._stopn is None else self._stopn
+        out   = np.zeros(stop - start, dtype=bool)
+        for r0, r1 in zonemap.ranges(min, max, start, stop):
+            out[r0 - start:r1 - start] = in_range(record_read(dset, dset[r0:r1]), min, max, inclmin, inclmax)
+        return out
+
+    def _get_derived(self, key:str)->np.ndarray:
+        # Derived columns of node properties that are not backed by an output are computed here
+        if self._derived is None:
+            self._derived = {}
+        if key not in self._derived:
+            whole = NodeProperties(self)
+            whole._segments = TreeSegments((len(self[next(iter(self))]), ))
+            self._derived[key] = derived_columns[key].func(whole)
+        return self._derived[key]
                 
+def _file_key(filename:str)->tuple:
+    # Size and modification time are part of the key, columns of a rewritten file are read anew
+    try:
+        stat = source_stat(filename)
+    except OSError:
+        return (filename, )
+    return (filename, stat["size"], stat["mtime_ns"])
+
+def _column_key(dset:h5py.Dataset, start:int=0, stop:int=None)->tuple:
+    return (*_file_key(dset.file.filename), dset.name, start, stop)
+
+def read_dataset(dset:h5py.Dataset, start:int=0, stop:int=None, cache:(ColumnCache | bool)=None)->np.ndarray:
+    """Reads dset[start:stop], cached by (file, size, modification time, dataset, start, stop) (see subscript.cache.get_cache)"""
+    _cache = get_cache(cache)
+    read = lambda: _readonly(record_read(dset, dset[start:stop]))
+    if _cache is None:
+        return read()
+    return _cache.get(_column_key(dset, start, stop), read)
+
+def memmap_dataset(dset:h5py.Dataset)->np.ndarray:
+    """
+    Maps a contiguous, uncompressed dataset into memory (read only) at its offset in the file. 
+    Pages are read on access and shared between processes through the page cache.
+    Returns None if the dataset can not be mapped (chunked, compressed, external or not yet written).
+    """
+    if dset.chunks is not None or dset.external is not None or dset.is_virtual:
+        return None
+    if dset.dtype.hasobject or dset.size == 0 or dset.file.driver not in ("sec2", "stdio"):
+        return None
+    offset = dset.id.get_offset()
+    if offset is None:
+        return None
+    return np.memmap(dset.file.filename, dtype=dset.dtype, mode="r", offset=offset, shape=dset.shape)
+
+def read_dataset_rows(dset:h5py.Dataset, index:np.ndarray[int], start:int=0, stop:int=None, 
+                        block:int=None, max_fraction:float=0.5)->np.ndarray:
+    """
+    Reads dset[index] for sorted indices within start:stop, reading only the blocks (by default the chunks) 
+    that hold selected rows, one read per run of consecutive blocks. 
+    Returns None if more than max_fraction of the blocks within start:stop would be read.
+    """
+    _stop  = dset.shape[0] if stop is None else stop
+    _block = block if block is not None else (dset.chunks[0] if dset.chunks is not None else 2**16)
+    out    = np.empty((index.shape[0], *dset.shape[1:]), dtype=dset.dtype)
+    if index.shape[0] == 0:
+        return out
+
+    blocks = np.unique(index // _block)
+    if blocks.shape[0] > max_fraction * (-(-_stop // _block) - start // _block):
+        return None
+    # First and last block of each run of consecutive blocks
+    breaks = np.flatnonzero(np.diff(blocks) > 1)
+    first  = blocks[np.concatenate(((0, ), breaks + 1))]
+    last   = blocks[np.concatenate((breaks, (blocks.shape[0] - 1, )))]
+
+    for b0, b1 in zip(first, last):
+        r0, r1 = max(b0 * _block, start), min((b1 + 1) * _block, _stop)
+        i0, i1 = np.searchsorted(index, (r0, r1))
+        out[i0:i1] = record_read(dset, dset[r0:r1])[index[i0:i1] - r0]
+    return out
+
+def in_range(val, min, max, inclmin:bool=True, inclmax:bool=False)->np.ndarray[bool]:
+    lb = min <= val if inclmin else min < val
+    ub = val <= max if inclmax else val < max
+    return lb & ub
+
+class OutputColumn():
+    """
+    Column spanning an entire output, read once on first access and shared by all trees.
+    The column is held for the lifetime of the output, the column cache shares it with other outputs of the same file.
+    """
+    def __init__(self, source:(h5py.Dataset | Callable), cache:(ColumnCache | bool)=None, key:tuple=None):
+        self.source = source
+        self.cache  = cache
+        self.key    = key
+        self._data  = None
+
+    def __call__(self)->np.ndarray:
+        if self._data is not None:
+            return self._data
+        _cache = get_cache(self.cache)
+        if isinstance(self.source, h5py.Dataset):
+            self._data = read_dataset(self.source, cache=self.cache)
+        elif self.key is not None and _cache is not None:
+            self._data = _cache.get(self.key, lambda: _readonly(np.asarray(self.source())))
+        else:
+            self._data = _readonly(np.asarray(self.source()))
+        return self._data
+
+def _readonly(a:np.ndarray)->np.ndarray:
+    out = a.view()
+    out.setflags(write=False)
+    return out
+
+def _is_mask(nodefilter)->bool:
+    return isinstance(nodefilter, np.ndarray) and nodefilter.ndim == 1 and nodefilter.dtype == bool
+
+class Selection():
+    """
+    Nodes selected by a node filter. Sparse selections are stored as indices, dense selections 
+    as a boolean mask (see Meta.sparse_selection), the other representation is built on demand.
+    """
+    def __init__(self, mask:np.ndarray[bool]=None, index:np.ndarray[int]=None, n:int=None):
+        self._mask  = mask
+        self._index = index
+        self.n      = mask.shape[0] if mask is not None else n
+        self.count  = np.count_nonzero(mask) if mask is not None else index.shape[0]
+        if self.sparse and self._index is None:
+            self._index = np.flatnonzero(mask)
+            self._mask  = None
+        if not self.sparse and self._mask is None:
+            self._mask  = self.mask
+            self._index = None
+
+    @property
+    def sparse(self)->bool:
+        return self.count < Meta.sparse_selection * self.n
+
+    @property
+    def mask(self)->np.ndarray[bool]:
+        if self._mask is not None:
+            return self._mask
+        mask = np.zeros(self.n, dtype=bool)
+        mask[self._index] = True
+        return mask
+
+    @property
+    def index(self)->np.ndarray[int]:
+        return self._index if self._index is not None else np.flatnonzero(self._mask)
+
+    def take(self, a:np.ndarray)->np.ndarray:
+        """Selected entries of a, along the first axis"""
+        if self._index is not None:
+            return np.take(a, self._index, axis=0)
+        return np.compress(self._mask, a, axis=0)
+
+    def compose(self, other:(Selection | np.ndarray[bool]))->Selection:
+        """Selection of the nodes selected by other, a selection of the nodes selected here"""
+        _other = other if isinstance(other, Selection) else Selection(other)
+        return Selection(index=self.index[_other.index], n=self.n)
+
+class SegmentedArray():
+    """Node-wise values of a whole output, indexing returns the values of a single tree"""
+    def __init__(self, values:np.ndarray, segments:TreeSegments):
+        self.values   = values
+        self.segments = segments
+
+    def __len__(self):
+        return self.segments.ntrees
+
+    def __getitem__(self, i):
+        return self.values[self.segments.start[i]:self.segments.stop[i]]
+
+class TreeSegments():
+    """
+    Node offsets of the trees in a galacticus output. Used to evaluate per tree
+    quantities for all trees at once with segmented reductions.
+    """
+    def __init__(self, counts:np.ndarray, index:np.ndarray=None):
+        self.counts = np.asarray(counts, dtype=int)
+        self.stop   = np.cumsum(self.counts)
+        self.start  = self.stop - self.counts
+        self.index  = index
+        self._treeid = None
+
+    @property
+    def ntrees(self):
+        return self.counts.shape[0]
+
+    @property
+    def nodecount(self):
+        return int(self.stop[-1]) if self.ntrees > 0 else 0
+
+    @property
+    def treeid(self):
+        """Position of the tree each node belongs to"""
+        if self._treeid is None:
+            self._treeid = np.repeat(np.arange(self.ntrees), self.counts)
+        return self._treeid
+
+    def filter(self, nodefilter:(np.ndarray[bool] | Selection))->TreeSegments:
+        if isinstance(nodefilter, Selection) and nodefilter.sparse:
+            return TreeSegments(np.bincount(self.treeid[nodefilter.index], minlength=self.ntrees), self.index)
+        _nodefilter = nodefilter.mask if isinstance(nodefilter, Selection) else nodefilter
+        return TreeSegments(self.sum(np.asarray(_nodefilter, dtype=int)), self.index)
+
+    def reduce(self, ufunc:np.ufunc, a:np.ndarray, fill=0, dtype=None)->np.ndarray:
+        """Apply ufunc.reduce to the nodes of each tree, empty trees are set to fill"""
+        a = np.asarray(a)
+        if a.shape[0] != self.nodecount:
+            raise RuntimeError(f"Expected {self.nodecount} nodes, got {a.shape[0]}")
+        nonempty = self.counts > 0
+        reduced  = ufunc.reduceat(a, self.start[nonempty], axis=0, dtype=dtype)
+        if np.all(nonempty):
+            return reduced
+        out = np.full((self.ntrees, *a.shape[1:]), fill, dtype=np.result_type(reduced, fill))
+        out[nonempty] = reduced
+        return out
+
+    def sum(self, a:np.ndarray)->np.ndarray:
+        a = np.asarray(a)
+        return self.reduce(np.add, a, dtype=int if a.dtype == bool else None)
+
+    def min(self, a:np.ndarray, fill=np.nan)->np.ndarray:
+        return self.reduce(np.minimum, a, fill=fill)
+
+    def max(self, a:np.ndarray, fill=np.nan)->np.ndarray:
+        return self.reduce(np.maximum, a, fill=fill)
+
+    def mean(self, a:np.ndarray)->np.ndarray:
+        counts = self.counts.reshape(-1, *np.ones(np.ndim(a) - 1, dtype=int))
+        with np.errstate(invalid="ignore", divide="ignore"):
+            return self.sum(a) / counts
+
+    def argmax(self, a:np.ndarray)->np.ndarray:
+        """Index (within the output) of the first maximum of each tree, -1 for empty trees"""
+        a = np.asarray(a)
+        # Sort by tree, then value, then reversed position so the last entry of each 
+        # tree is the first occurence of the maximum, matching np.argmax
+        order = np.lexsort((-np.arange(a.shape[0]), a, self.treeid))
+        out   = np.full(self.ntrees, -1, dtype=int)
+        nonempty = self.counts > 0
+        out[nonempty] = order[self.stop[nonempty] - 1]
+        return out
+
+    def broadcast(self, a)->np.ndarray:
+        """Repeat a quantity shared by all trees"""
+        return np.broadcast_to(a, (self.ntrees, *np.shape(a)))
+
+    def nodewise(self, a:np.ndarray)->SegmentedArray:
+        """Mark node-wise values so that they are split by tree"""
+        return SegmentedArray(a, self)
+
+    def split(self, props:dict, cache:(ColumnCache | bool)=None, zonemaps:dict=None, offset:int=0)->list[NodeProperties]:
+        """
+        Split whole output node properties into one NodeProperties per tree.
+        offset is the first row, within columns that are not arrays, of the node properties being split.
+        """
+        def gen_nodeproperties(n0, n1):
+            # Arrays are stored in full, slice them here.
+            # Everything else is sliced by NodeProperties when read
+            _props = {key:(val[n0:n1] if isinstance(val, np.ndarray) else val) for key, val in props.items()}
+            out = NodeProperties(_props)
+            out._startn =  offset + n0
+            out._stopn  =  offset + n1
+            out._cache  =  cache
+            out._zonemaps = zonemaps
+            return out
+        return [gen_nodeproperties(n0, n1) for n0, n1 in zip(self.start, self.stop)]
+
+class TreeSet(list):
+    """
+    The trees of an output along with the whole output they share their columns with.
+    If tabulated from a file, the file is available as file, and string keys and other attributes 
+    (eg. trees["Outputs"], trees.attrs) are looked up on the file, so scripts using the h5py.File API keep working.
+    """
+    def __init__(self, output:NodeProperties, file:h5py.File=None):
+        super().__init__(output.segments.split(output.data, output._cache, output._zonemaps))
+        self.output = output
+        self.file   = file
+
+    def __getitem__(self, key):
+        if isinstance(key, str):
+            return self._file()[key]
+        return super().__getitem__(key)
+
+    def __contains__(self, key):
+        if isinstance(key, str):
+            return key in self._file()
+        return super().__contains__(key)
+
+    def __getattr__(self, name:str):
+        # Only called for attributes a tree set does not have
+        file = self.__dict__.get("file")
+        if file is None or name.startswith("__"):
+            raise AttributeError(name)
+        return getattr(file, name)
+
+    def _file(self)->h5py.File:
+        file = self.__dict__.get("file")
+        if file is None:
+            raise RuntimeError("Tree set was not tabulated from a file")
+        return file
+
+    def cache_filters(self):
+        """Cache node filter results, for the lifetime of this tree set"""
+        self.output._filtercache = {}
+        for tree in self:
+            tree._filtercache = {}
+        return self
+
+    def sort_columns(self, keys:Iterable[str]):
+        """
+        Enables sorted indexes (see subscript.sortedindex) of the given columns, including derived columns,
+        for each tree and the whole output. Indexes are built on first use, range filters (see NodeProperties.range_mask)
+        on unfiltered trees then take a binary search.
+        """
+        for props in (self.output, *self):
+            if props._sorted is None:
+                props._sorted = {}
+            for key in keys:
+                props._sorted.setdefault(key, None)
+        return self
+
+    def prefetch(self, keys:Iterable[str]):
+        """
+        Reads the given columns of the output (derived columns: the columns they require) up front.
+        Columns with a zone map are left unread, range filters (see NodeProperties.range_mask) read the blocks they need.
+        """
+        zonemaps = {} if self.output._zonemaps is None else self.output._zonemaps
+        for key in expand_derived(keys):
+            if key in self.output.data and key not in zonemaps:
+                self.output[key]
+        return self
+
 def get_galacticus_outputs(galout:h5py.File)->np.ndarray[int]:
     output_groups:h5py.Group = galout["Outputs"] 
 
@@ -82,23 +557,48 @@ def get_galacticus_outputs(galout:h5py.File)->np.ndarray[int]:
 def get_custom_dsets(goutn:h5py.Group):
     """Example of custom datasets"""    
 
-    # Total number of nodes
-    nodecount = np.sum(goutn["mergerTreeCount"][:]) 
     # Node counts
-    counts    = goutn["mergerTreeCount"]
+    counts    = goutn["mergerTreeCount"][:]
     # Tree indexes
-    treenums  = goutn["mergerTreeIndex"]
-
-    nodedata  = goutn["nodeData"]
+    treenums  = goutn["mergerTreeIndex"][:]
+    # Total number of nodes
+    nodecount = np.sum(counts) 
     
     return {
-        "custom_node_tree"            : lambda : np.concatenate([np.full(count,index) for (count,index) in zip(counts,treenums)]),
-        "custom_node_tree_outputorder": lambda : np.concatenate([np.full(count,i) for (i,count) in enumerate(counts)]),
+        "custom_node_tree"            : lambda : np.repeat(treenums, counts),
+        "custom_node_tree_outputorder": lambda : np.repeat(np.arange(counts.shape[0]), counts),
         "custom_id"                   : lambda : np.arange(nodecount),
     }
 
-def tabulate_trees(gout:h5py.File, out_index:int=-1, custom_dsets:Callable = None, **kwargs)->NodeProperties:
-    """Reads node propreties from a galacticus HDF5 file"""
+def tabulate_output(gout:h5py.File, out_index:int=-1, custom_dsets:Callable = None, bulk:bool=None, 
+                        cache:(ColumnCache | bool)=None, memmap:bool=None, colstore:bool=None, **kwargs)->NodeProperties:
+    """
+    Reads node propreties of an entire output from a galacticus HDF5 file. 
+    Trees are not split, their offsets are given by NodeProperties.segments
+    """
+    props, segments, zonemaps = _read_output(gout, out_index, custom_dsets, bulk, cache, memmap, colstore)
+    out = NodeProperties(props)
+    out._segments = segments
+    out._cache    = cache
+    out._zonemaps = zonemaps
+    return out
+
+def tabulate_trees(gout:h5py.File, out_index:int=-1, custom_dsets:Callable = None, bulk:bool=None, 
+                    cache:(ColumnCache | bool)=None, memmap:bool=None, colstore:bool=None, **kwargs)->TreeSet:
+    """
+    Reads node propreties from a galacticus HDF5 file. 
+    If bulk is true (defaults to Meta.bulk) each column is read once for the entire output,
+    trees are given views into the shared column.
+    Columns read are cached in cache, by default the global column cache is used if Meta.cache is true.
+    If memmap is true (defaults to Meta.memmap) contiguous uncompressed columns are mapped into memory
+    instead, trees are given views into the mapped column. Other columns are read as usual.
+    If colstore is true (defaults to Meta.colstore) and the file has been converted 
+    with subscript.colstore.write_colstore, columns are mapped from the converted files.
+    """
+    return TreeSet(tabulate_output(gout, out_index, custom_dsets, bulk, cache, memmap, colstore), file=gout)
+
+def _read_output(gout:h5py.File, out_index:int=-1, custom_dsets:Callable = None, bulk:bool=None, 
+                    cache:(ColumnCache | bool)=None, memmap:bool=None, colstore:bool=None)->tuple[dict, TreeSegments, dict]:
     outs = gout["Outputs"] 
 
     _key_index = out_index
@@ -108,9 +608,18 @@ def tabulate_trees(gout:h5py.File, out_index:int=-1, custom_dsets:Callable = Non
     outn:h5py.Group = outs[f"Output{_key_index}"]
     nd:h5py.Group   = outn["nodeData"]
 
+    # Columns converted to a columnar store are used in place of the datasets, 
+    # along with the tree counts and indexes stored with them
+    _colstore = Meta.colstore if colstore is None else colstore
+    stored    = read_colstore(gout, f"Output{_key_index}") if _colstore else None
+    if stored is not None:
+        counts, treeindex = stored[1], stored[2]
+    else:
+        counts, treeindex = outn["mergerTreeCount"][:], outn["mergerTreeIndex"][:]
+
     # Total number of nodes in output can be obtained by summing this dataset
     # Which contains the number of nodes per tree
-    nodecount = np.sum(outn["mergerTreeCount"][:]) 
+    nodecount = np.sum(counts) 
 
     nodedata = {}
     for key, val in nd.items():
@@ -119,24 +628,44 @@ def tabulate_trees(gout:h5py.File, out_index:int=-1, custom_dsets:Callable = Non
             continue
         if val.shape[0] != nodecount:
             continue
-        # First entry in tuple marks this as a h5py dataset 
         nodedata[key] = val
 
-    get_cdsets = lambda i: {} if custom_dsets is None else custom_dsets
+    if stored is not None:
+        nodedata = nodedata | stored[0]
+
+    _memmap = Meta.memmap if memmap is None else memmap
+    if _memmap:
+        mapped   = {key:(memmap_dataset(val) if isinstance(val, h5py.Dataset) else None) for key, val in nodedata.items()}
+        nodedata = {key:(val if mapped[key] is None else mapped[key]) for key, val in nodedata.items()}
+
+    _bulk = Meta.bulk if bulk is None else bulk
+    if _bulk:
+        nodedata = {key:(OutputColumn(val, cache) if isinstance(val, h5py.Dataset) else val) for key, val in nodedata.items()}
+
+    # Custom datasets are evaluated once per output and shared between trees
+    cdsets = {} if custom_dsets is None else custom_dsets(outn)
+    cdsets = {key:(OutputColumn(val) if isinstance(val, Callable) else val) for key, val in cdsets.items()}
  
-    props = get_cdsets(outn) | nodedata
+    props = cdsets | nodedata
     
-    counts  = outn["mergerTreeCount"]
+    segments = TreeSegments(counts, treeindex)
 
-    out = []
-    start = np.insert(np.cumsum(counts)[:-1], 0, 0)
-    stop = np.cumsum(counts) 
-
-    def gen_nodeproperties(n0, n1):
-        #Carefull! Need copy here to avoid devious bugs             
-        out = NodeProperties(copy(props))
-        out._startn =  n0
-        out._stopn  =  n1
+    # Derived columns are computed once, over the entire output
+    def whole():
+        out = NodeProperties(props)
+        out._segments = segments
+        out._cache    = cache
         return out
-        
-    return [gen_nodeproperties(n0, n1) for n0, n1 in zip(start, stop)]
\ No newline at end of file
+    
+    for key, dcol in derived_columns.items():
+        if (key in props) or any(r not in props for r in dcol.requires):
+            continue
+        # Keyed by the function and its inputs as well, re-registering a column does not serve stale values
+        props[key] = OutputColumn(lambda dcol=dcol: dcol.func(whole()), cache, 
+                                    key=(*_file_key(gout.filename), f"{outn.name}/derived/{key}", 0, None, 
+                                            fingerprint((dcol.func, dcol.requires))))
+
+    # Zone maps for range filters on columns read from the hdf5 file, see subscript.zonemap
+    zonemaps = read_zonemap(gout, f"Output{_key_index}")
+
+    return props, segments, zonemaps
\ No newline at end of file
@@ -2,13 +2,18 @@
 from __future__ import annotations
 from typing import Any, Callable, Iterable, List
 from collections import UserDict
-from functools import reduce
+from functools import reduce, wraps
+import inspect
 import numpy as np
 import h5py
 
 from subscript.tabulatehdf5 import NodeProperties, tabulate_trees
 from subscript import tabulatehdf5
 from subscript import defaults
+from subscript.fingerprint import fingerprint
+from subscript.stats import StreamSummary
+from subscript.profiling import active_profiler
+import time
 
 def reduce_input(l, out=None):
     if out is None:
@@ -32,89 +37,299 @@ def format_nodedata(gout, out_index=-1)->Iterable[NodeProperties]:
         raise RuntimeError(f"Unrecognized data type for gout {type(gout)}")
     return _gout
 
+def format_segmented(gout, out_index=-1)->list[NodeProperties]:
+    """Formats input into whole outputs with tree offsets, see gscript_segmented"""
+    if isinstance(gout, NodeProperties) and gout.segments is not None:
+        _gout = [gout, ]
+    elif isinstance(gout, tabulatehdf5.TreeSet):
+        _gout = [gout.output, ]
+    elif isinstance(gout, (dict, UserDict)):
+        # Anything that is not a whole output is treated as a single tree
+        root = gout.unfilter() if isinstance(gout, NodeProperties) else NodeProperties(gout)
+        root._segments = tabulatehdf5.TreeSegments((len(root[next(iter(root))]), ))
+        _gout = [root, ]
+    elif isinstance(gout, h5py.File):
+        _gout = [tabulatehdf5.tabulate_output(gout, out_index=out_index), ]
+    elif isinstance(gout, Iterable): 
+        _gout = reduce_input([format_segmented(o, out_index=out_index) for o in gout])
+    else:
+        raise RuntimeError(f"Unrecognized data type for gout {type(gout)}")
+    return _gout
+
+def _format_out(o):
+    # Eliminate lists of 1 item recursively
+    if (not isinstance(o, Iterable)) or (isinstance(o, str)):
+        return o
+    if len(o) == 1:
+        return _format_out(o[0])
+    out = [_format_out(i) for i in o]         
+    if isinstance(o, np.ndarray):
+        return np.asarray(out)
+    return out
+
+def _as_outlist(o):
+    return [o,] if isinstance(o, np.ndarray) else o
+
+def _stream_summary(summarize, stream)->StreamSummary:
+    if not (summarize and stream):
+        return None
+    return stream if isinstance(stream, StreamSummary) else StreamSummary()
+
+def _summarize(outs, summarize, statfuncs, summary:StreamSummary=None):
+    if summary is not None:
+        return _format_out(summary.result(statfuncs))
+
+    if not summarize:
+        return _format_out(outs)
+
+    _statfuncs = [np.mean, ] if statfuncs is None else statfuncs
+
+    if isinstance(outs[0], Iterable):
+        eval_stats = lambda f,m: f(np.asarray([treeo[m] for treeo in outs]), axis=0)
+        summary = [[eval_stats(f,m) for m, _ in enumerate(outs[0])] for f in _statfuncs] 
+    else:
+        eval_stats = lambda f: f(np.asarray([treeo for treeo in outs]), axis=0)
+        summary = [eval_stats(f) for f in _statfuncs] 
+
+    return _format_out(summary)
+
+def _run_trees(func, gout, args, nfilter, out_index, kwargs, collect:Callable, times:list=None):
+    # Evaluates func tree by tree, passing each output to collect (and the time taken to times, if given)
+    trees = format_nodedata(gout, out_index)
+    filterkey = _filterkey(nfilter, kwargs, trees)
+
+    for nodestree in trees:
+        t0 = time.perf_counter() if times is not None else None
+        _nodestree = nodestree.unfilter()
+        _nodefilter = None
+        if isinstance(nfilter, Callable):
+            _nodefilter = _nodestree.eval_filter(nfilter, kwargs, filterkey)
+        elif isinstance(nfilter, (np.ndarray, np.bool_)):
+            _nodefilter = nfilter
+        if isinstance(_nodefilter, (np.ndarray, np.bool_)) and np.ndim(_nodefilter) == 0:
+            # Filter scripts return a scalar for trees with a single node
+            _nodefilter = np.atleast_1d(_nodefilter)
+        _nodestree_filtered = _nodestree.filter(_nodefilter)
+        collect(func(_nodestree_filtered, *args, **(kwargs | dict(nfilter=_nodefilter))))
+        if times is not None:
+            times.append(time.perf_counter() - t0)
+
+def _profiled(func, run:Callable):
+    # Records calls of a script with the active profiler, run receives a list to append the time taken per tree to
+    profiler = active_profiler()
+    if profiler is None:
+        return run(None)
+    times = []
+    t0    = time.perf_counter()
+    out   = run(times)
+    profiler.record_script(func.__qualname__, time.perf_counter() - t0, times)
+    return out
+
+def _collector(outs:list, summary:StreamSummary)->Callable:
+    if summary is None:
+        return lambda o: outs.append(_as_outlist(o))
+    return lambda o: summary.update(_as_outlist(o))
+
 def gscript(func):
+    @wraps(func)
     def wrap(gout:(h5py.File | NodeProperties | dict), 
                 *args, 
                 nfilter:(Callable | np.ndarray[bool])=None, 
                 summarize:bool=False, 
                 statfuncs:Iterable[Callable] = None,
                 out_index:int=-1,
+                stream:(bool | StreamSummary)=False,
                 **kwargs): 
         outs = []         
-        trees = format_nodedata(gout, out_index)
-        ntrees = len(trees)
-
-        for nodestree in trees:
-            _nodestree = nodestree.unfilter()
-            _nodefilter = None
-            if isinstance(nfilter, Callable):
-                _nodefilter = nfilter(_nodestree, **kwargs)
-            elif isinstance(nfilter,np.ndarray):
-                _nodefilter = nfilter
-            _nodestree_filtered = _nodestree.filter(_nodefilter)
-            o = func(_nodestree_filtered, *args, **(kwargs | dict(nfilter=_nodefilter)))
-            single_out = isinstance(o, np.ndarray) 
-            _o = [o,] if single_out else o
-            outs.append(_o)
-
-        # Eliminate lists of 1 item recursively
-        def format_out(o):
-            if (not isinstance(o, Iterable)) or (isinstance(o, str)):
-                return o
-            if len(o) == 1:
-                return format_out(o[0])
-            out = [format_out(i) for i in o]         
-            if isinstance(o, np.ndarray):
-                return np.asarray(out)
-            return out
-
-        if not summarize:
-            return format_out(outs)
-    
-        _statfuncs = [np.mean, ] if statfuncs is None else statfuncs
+        summary = _stream_summary(summarize, stream)
+        _profiled(func, lambda times: _run_trees(func, gout, args, nfilter, out_index, kwargs, _collector(outs, summary), times))
+        return _summarize(outs, summarize, statfuncs, summary)
+    return wrap
+
+def _filterkey(nfilter, kwargs:dict, trees:Iterable[NodeProperties])->str:
+    # Only compute the (potentially expensive) key if a filter cache is used
+    if not isinstance(nfilter, Callable):
+        return None
+    if not any(tree.unfilter().data._filtercache is not None for tree in trees):
+        return None
+    return fingerprint((nfilter, kwargs))
+
+def _eval_segmented_nodefilter(nfilter, root:NodeProperties, kwargs)->np.ndarray[bool]:
+    if getattr(nfilter, "segmented", False):
+        o = nfilter(root, **kwargs)
+        return o.values if isinstance(o, tabulatehdf5.SegmentedArray) else o
+    # Per tree filters are evaluated tree by tree, on the columns of the underlying output
+    output = root
+    while isinstance(output.data, NodeProperties):
+        output = output.data
+    trees = root.segments.split(output.data, output._cache, output._zonemaps, output._startn)
+    return np.concatenate([np.atleast_1d(nfilter(tree, **kwargs)) for tree in trees] + [np.zeros(0, dtype=bool), ]).astype(bool)
 
-        if isinstance(outs[0], Iterable):
-            eval_stats = lambda f,m: f(np.asarray([treeo[m] for treeo in outs]), axis=0)
-            summary = [[eval_stats(f,m) for m, _ in enumerate(outs[0])] for f in _statfuncs] 
-        else:
-            eval_stats = lambda f: f(np.asarray([treeo for treeo in outs]), axis=0)
-            summary = [eval_stats(f) for f in _statfuncs] 
+def _segmented_nodefilter(nfilter, root:NodeProperties, kwargs)->np.ndarray[bool]:
+    if nfilter is None or isinstance(nfilter, np.ndarray):
+        return nfilter
+    _nfilter = lambda gout, **k: _eval_segmented_nodefilter(nfilter, gout, k)
+    return root.eval_filter(_nfilter, kwargs, _filterkey(nfilter, kwargs, [root, ]))
 
-        return format_out(summary)
+def _projected(func:Callable, kwargs:dict=None, _seen:set=None)->bool:
+    # Whether a node filter depends on the projection, ie. it (or a function passed to it) takes a normal vector
+    _kwargs = {} if kwargs is None else kwargs
+    seen    = set() if _seen is None else _seen
+    if id(func) in seen:
+        return False
+    seen.add(id(func))
+
+    # Scripts with fixed arguments (see freeze) and node filter expressions (see subscript.nfexpr)
+    if hasattr(func, "func") and hasattr(func, "kwargs"):
+        return _projected(func.func, _kwargs | func.kwargs, seen)
+    if hasattr(func, "leaves"):
+        return any(_projected(leaf.func, _kwargs | leaf.kwargs, seen) for leaf in func.leaves())
+
+    try:
+        params = inspect.signature(func).parameters
+    except (TypeError, ValueError):
+        # Assume the worst for filters that can not be inspected
+        return True
+    if "normvector" in params:
+        return True
+    all_kwargs = {name:p.default for name, p in params.items() if p.default is not inspect.Parameter.empty} | _kwargs
+    return any(_projected(val, None, seen) for val in all_kwargs.values() if isinstance(val, Callable) and not isinstance(val, type))
+
+def _unstack(o, ntrees:int)->list:
+    # Split segmented script output into per tree outputs
+    single_out = isinstance(o, (np.ndarray, tabulatehdf5.SegmentedArray))
+    for val in ([o, ] if single_out else o):
+        if len(val) != ntrees:
+            raise RuntimeError(f"Segmented script output has length {len(val)}, expected one entry per tree ({ntrees})")
+    if single_out:
+        return [o[i] for i in range(ntrees)]
+    return [[val[i] for val in o] for i in range(ntrees)]
+
+def _stream_segmented(summary:StreamSummary, o, ntrees:int):
+    # Outputs stacked in arrays can be added in one go
+    if isinstance(o, np.ndarray):
+        summary.update_stacked([o, ], multi=o.ndim > 1)
+    elif all(isinstance(val, np.ndarray) for val in o):
+        summary.update_stacked(list(o), multi=True)
+    else:
+        for _o in _unstack(o, ntrees):
+            summary.update(_as_outlist(_o))
+
+def _timed(times:list, func, *args):
+    # Calls func, appending the time taken to times (if given)
+    if times is None:
+        return func(*args)
+    t0  = time.perf_counter()
+    out = func(*args)
+    times.append(time.perf_counter() - t0)
+    return out
+
+def gscript_segmented(func):
+    """
+    Like gscript, but the script is evaluated once over an entire output instead of once per tree.
+    The script receives all (filtered) nodes of an output, tree offsets are available via gout.segments. 
+    Per tree quantities should be computed with segmented reductions (eg. gout.segments.sum) and returned 
+    with one entry per tree along the first axis. Quantities shared by all trees can be expanded with 
+    gout.segments.broadcast, node-wise quantities should be wrapped with gout.segments.nodewise.
+
+    When called with a whole output (eg. from within another segmented script), 
+    per tree outputs are returned without splitting them into trees.
+    Node filters may be segmented scripts, per tree scripts (evaluated tree by tree), 
+    or a boolean array spanning the whole output.
+    """
+    def run(gout:NodeProperties, args, nfilter, kwargs):
+        root = gout.unfilter()
+        _nodefilter = _segmented_nodefilter(nfilter, root, kwargs)
+        return func(root.filter(_nodefilter), *args, **(kwargs | dict(nfilter=_nodefilter)))
+
+    @wraps(func)
+    def wrap(gout:(h5py.File | NodeProperties | dict), 
+                *args, 
+                nfilter:(Callable | np.ndarray[bool])=None, 
+                summarize:bool=False, 
+                statfuncs:Iterable[Callable] = None,
+                out_index:int=-1,
+                stream:(bool | StreamSummary)=False,
+                **kwargs): 
+        if isinstance(gout, NodeProperties) and gout.segments is not None:
+            return _profiled(func, lambda times: _timed(times, run, gout, args, nfilter, kwargs))
+
+        outs = []
+        summary = _stream_summary(summarize, stream)
+        def run_outputs(times):
+            for output in format_segmented(gout, out_index):
+                o = _timed(times, run, output, args, nfilter, kwargs)
+                if summary is None:
+                    outs.extend(_as_outlist(_o) for _o in _unstack(o, output.segments.ntrees))
+                else:
+                    _stream_segmented(summary, o, output.segments.ntrees)
+
+        _profiled(func, run_outputs)
+        return _summarize(outs, summarize, statfuncs, summary)
+    wrap.segmented = True
     return wrap
 
-def gscript_proj(func):
+def gscript_proj(func=None, batched:bool=False):
     """
     Wraper for scripts that involve projection, allows  passing of multiple normal vectors.
     If multiple projection vectors are passed, they are treated as seperate "trees".
+    With batched=True the script receives all normal vectors at once, as a (K, 3) array, 
+    and returns its outputs with one entry per normal vector along the first axis.
+    Node filters taking a normvector argument are evaluated (and the script called) with each normal vector.
+    Use as @gscript_proj or @gscript_proj(batched=True).
     """
-    def wrap(gout, normvector, *args, **kwargs):
-        n = None
+    if func is None:
+        return lambda f: gscript_proj(f, batched=batched)
 
-        @gscript
-        def wrap_inner(gout, *args, normvector, **kwargs):
-            nonlocal n
-            v =  normvector
-            if n is not None:
-                v = normvector[n]
-                n += 1  
-                if n >= len(normvector):
-                    n = 0
+    @wraps(func)
+    def wrap(gout, normvector, *args, 
+                nfilter:(Callable | np.ndarray[bool])=None, 
+                summarize:bool=False, 
+                statfuncs:Iterable[Callable] = None,
+                out_index:int=-1,
+                stream:(bool | StreamSummary)=False,
+                **kwargs):
+        _normvector = np.atleast_2d(normvector)
 
+        def eval_proj(gout, normvector, args, kwargs):
+            if batched:
+                return _unstack(func(gout, *args, normvector=normvector, **kwargs), normvector.shape[0])
+            return [func(gout, *args, normvector=v, **kwargs) for v in normvector]
 
-            return func(gout, *args, normvector=v, **kwargs)
+        # Node filters that depend on the projection are evaluated with each normal vector,
+        # other filters are evaluated once per tree and all normal vectors are passed at once
+        projected = isinstance(nfilter, Callable) and _projected(nfilter, kwargs)
 
+        def func_proj(gout, *args, **kwargs):
+            if not projected:
+                return eval_proj(gout, _normvector, args, kwargs)
+            outs = []
+            for v in _normvector:
+                _kwargs     = kwargs | dict(normvector=v)
+                _nodefilter = gout.eval_filter(nfilter, _kwargs, _filterkey(nfilter, _kwargs, [gout, ]))
+                outs.extend(eval_proj(gout.filter(_nodefilter), v[np.newaxis], args, kwargs | dict(nfilter=_nodefilter)))
+            return outs
+        
+        outs = []
+        summary = _stream_summary(summarize, stream)
+        collect = _collector(outs, summary)
 
-        if isinstance(normvector, np.ndarray) and normvector.ndim == 1: 
-            return wrap_inner(gout, *args, normvector=normvector, **kwargs)
+        def collect_proj(o):
+            # Each normal vector is treated as a seperate tree
+            for _o in o:
+                collect(_o)
 
-        n = 0
-        return wrap_inner([gout for _ in normvector], *args, normvector=normvector, **kwargs)
+        _profiled(func, lambda times: _run_trees(func_proj, gout, args, None if projected else nfilter, 
+                                                            out_index, kwargs, collect_proj, times))
+        return _summarize(outs, summarize, statfuncs, summary)
 
     return wrap
 
 def freeze(func, **kwargs):
-    return lambda gout, *a, **k: func(gout, *a, **(k | kwargs))
+    frozen = lambda gout, *a, **k: func(gout, *a, **(k | kwargs))
+    # Kept for introspection, eg. by the column planner
+    frozen.func, frozen.kwargs = func, kwargs
+    return frozen
 
 def multiproj(func, nfilter):
     return gscript_proj(freeze(func, nfilter=nfilter))
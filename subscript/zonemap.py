@@ -0,0 +1,90 @@
+#!/usr/bin/env python
+from __future__ import annotations
+from typing import Iterable
+import os
+import json
+import numpy as np
+import h5py
+
+from subscript.colstore import sidecar_path, source_stat
+
+class ZoneMap():
+    """
+    Minimum and maximum of a column within consecutive blocks of nodes (the chunks of the dataset).
+    Used to skip blocks that can not match a range cut without reading them.
+    """
+    def __init__(self, block:int, min:np.ndarray, max:np.ndarray, n:int):
+        self.block = int(block)
+        self.min   = np.asarray(min)
+        self.max   = np.asarray(max)
+        self.n     = int(n)
+
+    def ranges(self, min, max, start:int=0, stop:int=None)->list[tuple[int, int]]:
+        """
+        Row ranges, within start:stop, of the blocks that may hold values in [min, max].
+        Consecutive blocks are merged into a single range.
+        """
+        _stop  = self.n if stop is None else stop
+        b0, b1 = start // self.block, -(-_stop // self.block)
+        match  = (self.max[b0:b1] >= min) & (self.min[b0:b1] <= max)
+        # Start and end of each run of matching blocks
+        edges  = np.diff(np.concatenate(((False, ), match, (False, ))).astype(int))
+        runs   = zip(np.flatnonzero(edges == 1) + b0, np.flatnonzero(edges == -1) + b0)
+        return [(int(np.maximum(r0 * self.block, start)), int(np.minimum(r1 * self.block, _stop))) for r0, r1 in runs]
+
+def zonemap_path(filename:str)->str:
+    return sidecar_path(filename, ".zonemap.npz")
+
+def _block_size(dset:h5py.Dataset, block:int=None)->int:
+    if block is not None:
+        return block
+    return dset.chunks[0] if dset.chunks is not None else 2**16
+
+def build_zonemap(dset:h5py.Dataset, block:int=None)->ZoneMap:
+    """Zone map of a dataset, reading it one block (by default one chunk) at a time"""
+    _block = _block_size(dset, block)
+    n      = dset.shape[0]
+    bounds = [(np.fmin.reduce(v, axis=None), np.fmax.reduce(v, axis=None))
+                for v in (dset[n0:n0 + _block] for n0 in range(0, n, _block))]
+    bounds = np.asarray(bounds, dtype=float).reshape(-1, 2)
+    return ZoneMap(_block, bounds[:, 0], bounds[:, 1], n)
+
+def write_zonemap(gout:h5py.File, keys:Iterable[str], block:int=None, path:str=None)->str:
+    """
+    Writes a sidecar file with zone maps of the given node properties, for every output of a galacticus file.
+    Range filters on these properties (see NodeProperties.range_mask) only read the blocks that can match.
+    The zone maps are only used while the size and modification time of the file are unchanged.
+    Returns the path of the sidecar file.
+    """
+    _path  = zonemap_path(gout.filename) if path is None else os.fspath(path)
+    arrays = {}
+    for name, outn in gout["Outputs"].items():
+        nd = outn["nodeData"]
+        for key in keys:
+            if key not in nd:
+                continue
+            zonemap = build_zonemap(nd[key], block)
+            arrays[f"{name}/{key}/min"]   = zonemap.min
+            arrays[f"{name}/{key}/max"]   = zonemap.max
+            arrays[f"{name}/{key}/shape"] = np.asarray((zonemap.block, zonemap.n))
+
+    arrays["manifest"] = np.asarray(json.dumps(dict(stat=source_stat(gout.filename))))
+    with open(_path + ".tmp", "wb") as f:
+        np.savez(f, **arrays)
+    os.replace(_path + ".tmp", _path)
+    return _path
+
+def read_zonemap(gout:h5py.File, output:str, path:str=None)->dict[str, ZoneMap]:
+    """Zone maps of the node properties of an output (eg. "Output1"), None if there are none or they are out of date"""
+    _path = zonemap_path(gout.filename) if path is None else os.fspath(path)
+    if not os.path.exists(_path):
+        return None
+    with np.load(_path) as f:
+        if json.loads(str(f["manifest"]))["stat"] != source_stat(gout.filename):
+            return None
+        keys = [name.split("/")[1] for name in f.files if name.startswith(f"{output}/") and name.endswith("/shape")]
+        out  = {}
+        for key in keys:
+            block, n = f[f"{output}/{key}/shape"]
+            out[key] = ZoneMap(block, f[f"{output}/{key}/min"], f[f"{output}/{key}/max"], n)
+    return out
@@ -0,0 +1,21 @@
+#!/usr/bin/env python
+import h5py
+import numpy as np
+import pytest
+
+from subscript.synthetic import write_synthetic_galacticus
+from subscript.defaults import ParamKeys
+
+@pytest.fixture
+def mock_galacticus(tmp_path):
+    """
+    Writes a small synthetic galacticus file (see subscript.synthetic) to tmp_path and returns its path.
+    Trees hold counts nodes each and columns are chunked two nodes at a time.
+    Node masses are 1, 2, ... in file order, so tests can check exact values.
+    """
+    def write(counts=(3, 1, 4), name="mock.hdf5"):
+        path = write_synthetic_galacticus(tmp_path / name, counts=counts, chunks=2, seed=0)
+        with h5py.File(path, "r+") as f:
+            f[f"Outputs/Output1/nodeData/{ParamKeys.mass_basic}"][:] = np.arange(np.sum(counts)) + 1.0
+        return path
+    return write
@@ -0,0 +1,16 @@
+#!/usr/bin/env python
+from subscript.benchmark import run_benchmarks, write_benchmarks, read_benchmarks, compare_benchmarks
+
+def test_run_benchmarks(tmp_path):
+    benchmarks = run_benchmarks(tmp_path, ntrees=(2, 4), nodes_per_tree=(10, ), repeat=1)
+    assert len(benchmarks["results"]) == 2 * 5
+    for r in benchmarks["results"]:
+        assert r["wall"] > 0 and r["peak_memory"] > 0
+
+    write_benchmarks(benchmarks, tmp_path / "benchmarks.json")
+    baseline = read_benchmarks(tmp_path / "benchmarks.json")
+    assert compare_benchmarks(baseline, benchmarks) == []
+
+    slower = dict(results=[r | dict(wall=r["wall"] * 2) for r in baseline["results"][:1]])
+    regressions = compare_benchmarks(baseline, slower)
+    assert [r["metric"] for r in regressions] == ["wall", ]
@@ -0,0 +1,89 @@
+#!/usr/bin/env python
+import h5py
+import numpy as np
+import pytest
+from numpy import testing
+
+from subscript.cache import ColumnCache
+from subscript.tabulatehdf5 import tabulate_trees, get_custom_dsets
+from subscript.defaults import ParamKeys
+
+def test_column_cache_lru():
+    cache = ColumnCache(budget=3 * 8 * 10)
+    
+    for n in range(3):
+        cache.get(n, lambda: np.full(10, n, dtype=np.float64))
+    assert(cache.misses == 3)
+    assert(cache.nbytes == 3 * 8 * 10)
+
+    # Access 0 so that 1 is the least recently used entry
+    testing.assert_equal(cache.get(0, lambda: None), 0)
+    assert(cache.hits == 1)
+
+    cache.get(3, lambda: np.full(10, 3, dtype=np.float64))
+    assert(cache.evictions == 1)
+    assert(1 not in cache)
+    assert(0 in cache)
+
+    # Values larger than the budget are not cached
+    cache.get(4, lambda: np.zeros(100))
+    assert(4 not in cache)
+    assert(cache.nbytes <= cache.budget)
+
+def test_column_cache_tabulate(mock_galacticus):
+    path = mock_galacticus()
+
+    cache = ColumnCache(budget=2**20)
+    with h5py.File(path) as gout:
+        for _ in range(2):
+            trees = tabulate_trees(gout, cache=cache)
+            mass  = [tree["basicMass"] for tree in trees]
+
+    assert(cache.misses == 3)
+    assert(cache.hits   == 3)
+    testing.assert_equal(np.concatenate(mass), np.arange(8) + 1.0)
+    
+    # Caching can be disabled per call
+    with h5py.File(path) as gout:
+        trees = tabulate_trees(gout, cache=False)
+        testing.assert_equal(trees[0]["basicMass"], (1.0, 2.0, 3.0))
+
+def test_column_cache_budget(mock_galacticus):
+    path = mock_galacticus()
+
+    # Columns exceeding the budget are still read once per output
+    cache = ColumnCache(budget=8)
+    with h5py.File(path) as gout:
+        trees = tabulate_trees(gout, bulk=True, cache=cache)
+        mass  = [tree["basicMass"] for tree in trees]
+    assert(cache.misses == 1)
+    assert(len(cache) == 0)
+    testing.assert_equal(np.concatenate(mass), np.arange(8) + 1.0)
+
+def test_column_cache_rewrite(mock_galacticus):
+    path = mock_galacticus()
+
+    cache = ColumnCache(budget=2**20)
+    with h5py.File(path) as gout:
+        testing.assert_equal(tabulate_trees(gout, cache=cache)[0]["basicMass"], (1.0, 2.0, 3.0))
+
+    # Columns of a rewritten file are not served from the cache
+    with h5py.File(path, "r+") as gout:
+        gout["Outputs/Output1/nodeData/basicMass"][:] = 999.0
+    with h5py.File(path) as gout:
+        testing.assert_equal(tabulate_trees(gout, cache=cache)[0]["basicMass"], (999.0, 999.0, 999.0))
+
+def test_column_cache_readonly(mock_galacticus):
+    path = mock_galacticus()
+
+    # Cached and shared columns can not be modified in place by a script
+    cache = ColumnCache(budget=2**20)
+    with h5py.File(path) as gout:
+        for bulk in (False, True):
+            for tree in tabulate_trees(gout, bulk=bulk, cache=cache):
+                with pytest.raises(ValueError):
+                    tree["basicMass"] *= 0.7
+        trees = tabulate_trees(gout, bulk=True, cache=cache, custom_dsets=get_custom_dsets)
+        with pytest.raises(ValueError):
+            trees[0][ParamKeys.custom_id][0] = -1
+        testing.assert_equal(np.concatenate([tree["basicMass"] for tree in tabulate_trees(gout, cache=cache)]), np.arange(8) + 1.0)
@@ -0,0 +1,42 @@
+#!/usr/bin/env python
+import os
+import h5py
+import numpy as np
+from numpy import testing
+
+from subscript.colstore import write_colstore, read_colstore, colstore_path
+from subscript.tabulatehdf5 import tabulate_trees
+
+def test_colstore(mock_galacticus):
+    path = mock_galacticus()
+
+    with h5py.File(path) as gout:
+        trees_expected = tabulate_trees(gout, colstore=False)
+        basicmass      = [tree["basicMass"] for tree in trees_expected]
+
+        assert read_colstore(gout, "Output1") is None
+        assert write_colstore(gout, rows=3) == colstore_path(path)
+
+        props, counts, index = read_colstore(gout, "Output1")
+        testing.assert_equal(counts, (3, 1, 4))
+        testing.assert_equal(index, (1, 2, 3))
+        testing.assert_equal(props["basicMass"], np.arange(8) + 1.0)
+
+        trees = tabulate_trees(gout)
+        assert isinstance(trees[0]["basicMass"], np.memmap)
+        for tree, expected in zip(trees, basicmass):
+            testing.assert_equal(tree["basicMass"], expected)
+
+        # Tree counts and indexes are taken from the store as well
+        np.save(os.path.join(colstore_path(path), "Output1", "mergerTreeIndex.npy"), np.asarray((4, 5, 6)))
+        testing.assert_equal(tabulate_trees(gout).output.segments.index, (4, 5, 6))
+
+    # Rewriting the source file invalidates the store
+    mock_galacticus(counts=(2, 2))
+    stat = os.stat(path)
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+
+    with h5py.File(path) as gout:
+        assert read_colstore(gout, "Output1") is None
+        trees = tabulate_trees(gout)
+        testing.assert_equal(trees[1]["basicMass"], (3.0, 4.0))
@@ -0,0 +1,65 @@
+#!/usr/bin/env python
+import h5py
+import numpy as np
+from numpy import testing
+
+from subscript.defaults import ParamKeys
+from subscript.derived import register_derived, unregister_derived
+from subscript.tabulatehdf5 import NodeProperties, tabulate_trees
+from subscript.cache import ColumnCache
+from subscript.scripts.nodes import nodedata
+
+def test_derived_mock():
+    mockdata = {
+                    ParamKeys.x: np.asarray((0.0, 3.0, 0.0)),
+                    ParamKeys.y: np.asarray((0.0, 4.0, 1.0)),
+                    ParamKeys.z: np.asarray((0.0, 0.0, 0.0))
+    }
+
+    gout = NodeProperties(mockdata)
+    testing.assert_allclose(gout[ParamKeys.derived_r3d], (0.0, 5.0, 1.0))
+
+    # Derived columns respect node filters
+    nfilter = np.asarray((False, True, True))
+    testing.assert_allclose(nodedata(mockdata, ParamKeys.derived_r3d, nfilter=nfilter), (5.0, 1.0))
+
+def test_derived_output(mock_galacticus):
+    path = mock_galacticus()
+
+    ncalls = 0
+    def test_derived(gout):
+        nonlocal ncalls
+        ncalls += 1
+        # Index of each node within its tree
+        return np.arange(gout.segments.nodecount) - np.repeat(gout.segments.start, gout.segments.counts)
+
+    register_derived("test_derived", test_derived, requires=("basicMass", ))
+    register_derived("test_missing", test_derived, requires=("missingColumn", ))
+
+    try:
+        with h5py.File(path) as gout:
+            trees = tabulate_trees(gout, cache=False)
+            testing.assert_equal(trees[0]["test_derived"], (0, 1, 2))
+            testing.assert_equal(trees[2]["test_derived"], (0, 1, 2, 3))
+            assert("test_missing" not in trees[0])
+    finally:
+        unregister_derived("test_derived")
+        unregister_derived("test_missing")
+
+    # Computed once for the entire output
+    assert(ncalls == 1)
+
+def test_derived_reregister(mock_galacticus):
+    path  = mock_galacticus()
+    cache = ColumnCache(budget=2**20)
+
+    # Re-registered columns are computed anew, rather than served from the column cache
+    try:
+        register_derived("test_derived", lambda gout: gout["basicMass"] * 2, requires=("basicMass", ))
+        with h5py.File(path) as gout:
+            testing.assert_equal(tabulate_trees(gout, cache=cache)[0]["test_derived"], (2.0, 4.0, 6.0))
+        register_derived("test_derived", lambda gout: gout["basicMass"] * 3, requires=("basicMass", ))
+        with h5py.File(path) as gout:
+            testing.assert_equal(tabulate_trees(gout, cache=cache)[0]["test_derived"], (3.0, 6.0, 9.0))
+    finally:
+        unregister_derived("test_derived")
@@ -3,7 +3,8 @@ import numpy as np
 from numpy import testing
 
 from subscript.defaults import ParamKeys
-from subscript.scripts.histograms import spatial3d_dn, spatial3d_dndv, spatial2d_dn, spatial2d_dnda, massfunction
+from subscript.scripts.histograms import spatial3d_dn, spatial3d_dndv, spatial2d_dn, spatial2d_dnda, massfunction, hist_flat
+from subscript.scripts.spatial import project2d, isotropic_normvectors
 
 
 def test_3d_dn():
@@ -124,3 +125,39 @@ def test_massfunction():
 
 
 
+def test_2d_dn_batched():
+    rng      = np.random.default_rng(0)
+    mockdata = {
+                    ParamKeys.x: rng.normal(size=100),
+                    ParamKeys.y: rng.normal(size=100),
+                    ParamKeys.z: rng.normal(size=100)
+    }
+    
+    bins        = np.linspace(0, 2, 6)
+    normvectors = isotropic_normvectors(10, rng=1)
+
+    out_actual = spatial2d_dn(mockdata, bins=bins, normvector=normvectors)
+    for (dn, dn_r), normvector in zip(out_actual, normvectors):
+        dn_expected, _ = np.histogram(project2d(mockdata, normvector=normvector), bins=bins)
+        testing.assert_equal(dn, dn_expected)
+        testing.assert_allclose(dn_r, bins)
+
+def test_hist_flat():
+    rng    = np.random.default_rng(0)
+    counts = np.asarray((5, 0, 12, 1, 30))
+    a      = rng.uniform(0.5, 10, size=np.sum(counts))
+    w      = rng.uniform(size=np.sum(counts))
+    start  = np.cumsum(counts) - counts
+
+    for bins, range in ((np.linspace(0, 9, 7), None), (4, (1, 8))):
+        for weights, density in ((None, False), (w, False), (w, True)):
+            hist, edges = hist_flat(a, counts, bins=bins, range=range, weights=weights, density=density)
+            for n, (n0, c) in enumerate(zip(start, counts)):
+                _w = None if weights is None else weights[n0:n0 + c]
+                _hist, _edges = np.histogram(a[n0:n0 + c], bins=bins, range=range, weights=_w, density=density)
+                testing.assert_allclose(hist[n], _hist, rtol=1e-12)
+                testing.assert_allclose(edges[n], _edges)
+
+    hist, edges = hist_flat(a, counts, bins=3, range=(1, 8), log=True)
+    testing.assert_allclose(edges[0], np.geomspace(1, 8, 4))
+    testing.assert_equal(hist, [np.histogram(a[n0:n0 + c], bins=edges[0])[0] for n0, c in zip(start, counts)])
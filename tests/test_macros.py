@@ -2,13 +2,14 @@ import numpy as np
 import os
 from numpy import testing
 import h5py
+import pytest
 
 from subscript.wrappers import freeze
-from subscript.scripts.nodes import nodedata
+from subscript.scripts.nodes import nodedata, nodecount
 from subscript.defaults import ParamKeys
 from subscript.scripts.nfilters import nfilter_halos
-from subscript.macros import macro_run, macro_write_out_hdf5
-from subscript.scripts.histograms import massfunction
+from subscript.macros import macro_run, macro_write_out_hdf5, macro_runner_pool, macro_runner_prefetch, MacroAssembly, MacroWriter, macro_gen_runner, macro_run_file, macro_read_file, macro_add, macro_add_hists
+from subscript.scripts.histograms import massfunction, hist, hist2d, HistGroup, HistSpec, spec_massfunction
 
 def test_macro_run():
     path_dmo = "tests/data/test.hdf5"
@@ -109,3 +110,159 @@ def test_macro_out_hdf5():
                 testing.assert_allclose(f[key][_key][:], _val)       
 
 
+
+def test_macro_runner_pool(mock_galacticus):
+    paths = [mock_galacticus(counts=(3, 1, 4 + n), name=f"mock{n}.hdf5") for n in range(3)]
+
+    macros = {
+                "massfunction": freeze(massfunction, bins=np.linspace(0, 10, 4)),
+                "nodecount"   : nodecount,
+    }
+    
+    gouts        = [h5py.File(path) for path in paths]
+    out_expected = macro_run(macros, gouts, statfuncs=[np.mean, np.std])
+    out_actual   = macro_run(macros, paths, statfuncs=[np.mean, np.std], runner=macro_runner_pool(processes=2))
+    
+    testing.assert_equal(out_actual["id"]["out0"], out_expected["id"]["out0"])
+    for key, val in out_expected.items():
+        if key == "id":
+            continue
+        for _key, _val in val.items():
+            testing.assert_allclose(out_actual[key][_key], _val)       
+
+def test_macro_runner_prefetch(mock_galacticus):
+    paths = [mock_galacticus(counts=(3, 1, 4 + n), name=f"mock{n}.hdf5") for n in range(4)]
+    gouts = [h5py.File(path) for path in paths]
+
+    macros = {
+                "massfunction": freeze(massfunction, bins=np.linspace(0, 10, 4)),
+                "nodecount"   : nodecount,
+    }
+    out_expected = macro_run(macros, gouts, statfuncs=[np.mean, np.std])
+    for runner in (macro_runner_prefetch(), macro_runner_prefetch(depth=2, memory_budget=1)):
+        out_actual = macro_run(macros, gouts, statfuncs=[np.mean, np.std], runner=runner)
+        testing.assert_equal(out_actual["id"]["out0"], out_expected["id"]["out0"])
+        for key, val in out_expected.items():
+            for _key, _val in val.items():
+                testing.assert_equal(out_actual[key][_key], _val)
+
+    # Errors of either thread are raised by macro_run
+    def fail(gout, **kwargs):
+        raise ValueError()
+    with pytest.raises(ValueError):
+        macro_run({"fail": fail}, gouts, statfuncs=[np.mean, ], runner=macro_runner_prefetch())
+
+def test_macro_assembly():
+    assembly = MacroAssembly(3)
+    # Rows may arrive in any order
+    for row in (2, 0, 1):
+        assembly.add(row, f"file{row}", {"scalar (mean)": float(row), "multi (mean)": (np.full(2, row), np.arange(3) + row)})
+    out = assembly.result()
+
+    testing.assert_equal(out["id"]["out0"], (b"file0", b"file1", b"file2"))
+    testing.assert_equal(out["scalar (mean)"]["out0"], (0, 1, 2))
+    testing.assert_equal(out["multi (mean)"]["out0"], [[0, 0], [1, 1], [2, 2]])
+    testing.assert_equal(out["multi (mean)"]["out1"][2], (2, 3, 4))
+
+    with pytest.raises(RuntimeError):
+        MacroAssembly(2).result()
+
+def test_macro_writer(tmp_path, mock_galacticus):
+    paths = [mock_galacticus(counts=(3, 1, 4 + n), name=f"mock{n}.hdf5") for n in range(3)]
+    gouts = [h5py.File(path) for path in paths]
+
+    macros = {
+                "massfunction": freeze(massfunction, bins=np.linspace(0, 10, 4)),
+                "nodecount"   : nodecount,
+    }
+    out_expected = macro_run(macros, gouts, statfuncs=[np.mean, np.std])
+
+    written = []
+    def runner(gouts, macros, statfuncs):
+        # Each row is in the file by the time the next file is evaluated
+        for n, gout in enumerate(gouts):
+            if n > 0:
+                with h5py.File(tmp_path / "out.hdf5", "r") as f:
+                    written.append(f["nodecount (mean)/out0"].shape[0])
+            yield gout.filename, macro_run_file(gout, macros, statfuncs)
+
+    with h5py.File(tmp_path / "out.hdf5", "w") as f:
+        writer = MacroWriter(f, notes="test", chunk_rows=2)
+        assert macro_run(macros, gouts, statfuncs=[np.mean, np.std], runner=macro_gen_runner(runner), writer=writer) is None
+    assert written == [1, 2]
+
+    with h5py.File(tmp_path / "out.hdf5") as f:
+        assert f.attrs["notes"] == "test"
+        assert f["massfunction (mean)/out0"].compression == "gzip"
+        testing.assert_equal(f["id/out0"][:], out_expected["id"]["out0"])
+        for key, val in out_expected.items():
+            for _key, _val in val.items():
+                if key != "id":
+                    testing.assert_allclose(f[key][_key][:], _val)
+
+def test_macro_add_hists(mock_galacticus):
+    paths = [mock_galacticus(counts=(3, 1, 4 + n), name=f"mock{n}.hdf5") for n in range(2)]
+    gouts = [h5py.File(path) for path in paths]
+
+    ncalls = 0
+    def nfilter_count(gout, **kwargs):
+        nonlocal ncalls
+        ncalls += 1
+        return gout[ParamKeys.mass_basic] > 1.5
+    nfilter_count.segmented = True
+
+    bins  = np.linspace(0, 10, 4)
+    specs = {
+                "massfunction": spec_massfunction(bins=bins),
+                "hist"        : HistSpec(key_hist=ParamKeys.mass_basic, bins=3, range=(0, 10), weights=ParamKeys.mass_basic),
+                "hist2d"      : HistSpec(key_hist=ParamKeys.mass_basic, bins=bins, key_y=ParamKeys.mass_basic, bins_y=2, range_y=(0, 10))
+    }
+    macros = macro_add_hists({}, specs, nfilter=nfilter_count)
+
+    macros_expected = macro_add({}             , massfunction, label="massfunction", bins=bins, nfilter=nfilter_count)
+    macros_expected = macro_add(macros_expected, hist        , label="hist", key_hist=ParamKeys.mass_basic, bins=3, range=(0, 10), 
+                                                                    weights=ParamKeys.mass_basic, nfilter=nfilter_count)
+    macros_expected = macro_add(macros_expected, hist2d      , label="hist2d", key_x=ParamKeys.mass_basic, key_y=ParamKeys.mass_basic, 
+                                                                    bins=(bins, 2), range=(None, (0, 10)), nfilter=nfilter_count)
+
+    out_actual = macro_run(macros, gouts, statfuncs=[np.mean, np.std])
+    # The filter is evaluated once per output
+    assert ncalls == 2
+    out_expected = macro_run(macros_expected, gouts, statfuncs=[np.mean, np.std])
+
+    for key, val in out_expected.items():
+        if key == "id":
+            continue
+        for _key, _val in val.items():
+            testing.assert_allclose(out_actual[key][_key], _val)
+
+def test_macro_file_api(mock_galacticus):
+    path = mock_galacticus()
+
+    # Macros that are not scripts can use the file API on the shared trees
+    def ntrees(gout, **kwargs):
+        return len(gout["Outputs/Output1/mergerTreeCount"]) + len(gout.attrs) + ("Outputs" in gout)
+
+    with h5py.File(path) as gout:
+        out = macro_run_file(gout, {"ntrees": ntrees, "nodecount": nodecount}, statfuncs=[np.mean, ])
+        assert out["ntrees"] == 4
+        testing.assert_allclose(out["nodecount"], 8 / 3)
+        assert macro_read_file(gout, {}).filename == gout.filename
+
+def test_hist_group_memo(mock_galacticus):
+    gout = h5py.File(mock_galacticus())
+
+    ncalls = 0
+    def getval_count(gout, **kwargs):
+        nonlocal ncalls
+        ncalls += 1
+        return gout[ParamKeys.mass_basic]
+
+    group  = HistGroup(dict(a=HistSpec(getval=getval_count, bins=2, range=(0, 8)), b=HistSpec(key_hist=ParamKeys.mass_basic, bins=2, range=(0, 8))))
+    # The result is kept by the tree set, the group itself holds no state
+    for n in range(2):
+        trees = macro_read_file(gout, group.scripts())
+        for script in group.scripts().values():
+            script(trees)
+        assert ncalls == n + 1
+    assert set(vars(group)) == {"specs", "nfilter", "kwargs"}
@@ -2,7 +2,9 @@ import numpy as np
 import h5py
 from numpy import testing
 
-from subscript.scripts.nfilters import nfilter_virialized, nfilter_halos, nfilter_subhalos, nfand, nfor, nfnot, nfilter_project2d
+from subscript.scripts.nfilters import nfilter_virialized, nfilter_halos, nfilter_subhalos, nfand, nfor, nfnot, nfilter_project2d, nfilter_range, nfilter_subhalos_valid
+from subscript.nfexpr import nfexpr, rowwise
+from subscript.wrappers import gscript
 from subscript.defaults import  ParamKeys
 
 def test_nfilter_halos():
@@ -116,3 +118,61 @@ def test_nfilter_project2d():
     testing.assert_equal(filter_actual, filter_expected)
 
 
+
+def test_nfexpr():
+    mockdata = {
+                "nodeIsIsolated": np.asarray((1.0, 0.0, 1.0, 1.0, 0.0)),
+                "basicMass"     : np.asarray((5.0, 1.0, 2.0, 3.0, 4.0))
+               }
+
+    ncalls = 0
+    @gscript
+    def nfilter_count(gout, **kwargs):
+        nonlocal ncalls
+        ncalls += 1
+        return gout["nodeIsIsolated"] == 1
+
+    nrows = []
+    @rowwise
+    @gscript
+    def nfilter_heavy(gout, **kwargs):
+        nrows.append(len(gout["basicMass"]))
+        return gout["basicMass"] > 2.5
+
+    expr = nfand(nfilter_count, nfilter_heavy) | nfand(nfilter_count, nfnot(nfilter_subhalos))
+
+    out_expected = np.asarray((True, False, True, True, False))
+    testing.assert_equal(expr(mockdata), out_expected)
+    # Shared filters are evaluated once, rowwise filters only on undecided nodes
+    assert ncalls == 1
+    assert nrows == [3, ]
+
+    expr = nfand(nfexpr(nfilter_range, min=2.0, max=4.5, key="basicMass"), nfilter_halos)
+    testing.assert_equal(expr(mockdata), (False, False, True, True, False))
+    assert expr.columns() == {"basicMass", "nodeIsIsolated"}
+
+def test_nfilter_range():
+    mockdata = {
+                    "basicMass": np.asarray((1.0, 2.0, 3.0, 4.0))
+    }
+
+    # Both bounds are inclusive by default, the upper bound follows inclmin unless inclmax is given
+    testing.assert_equal(nfilter_range(mockdata, min=2.0, max=3.0, key="basicMass"), (False, True, True, False))
+    testing.assert_equal(nfilter_range(mockdata, min=2.0, max=3.0, key="basicMass", inclmin=False), (False, False, False, False))
+    testing.assert_equal(nfilter_range(mockdata, min=2.0, max=3.0, key="basicMass", inclmax=False), (False, True, False, False))
+    testing.assert_equal(nfilter_range(mockdata, min=2.0, max=3.0, key="basicMass", inclmin=False, inclmax=True), (False, False, True, False))
+
+def test_nfexpr_single_node():
+    # Trees with a single node
+    mockdata = {
+                    ParamKeys.is_isolated: np.asarray((0, )),
+                    ParamKeys.mass       : np.asarray((1e9, )),
+                    ParamKeys.rvir       : np.asarray((0.1, )),
+                    ParamKeys.x          : np.asarray((0.0, )),
+                    ParamKeys.y          : np.asarray((0.0, )),
+                    ParamKeys.z          : np.asarray((0.0, ))
+    }
+
+    assert nfand(nfilter_subhalos, nfilter_halos)(mockdata).shape == (1, )
+    assert nfilter_subhalos_valid(mockdata, mass_min=1e8, mass_max=1e10)
+    testing.assert_equal(nfilter_subhalos_valid([mockdata, mockdata], mass_min=1e10, mass_max=1e11), (False, False))
@@ -5,7 +5,11 @@ from numpy import testing
 from subscript.tabulatehdf5 import tabulate_trees
 from subscript.scripts.nodes import nodedata, nodecount
 from subscript.defaults import  ParamKeys
-from subscript.scripts.nfilters import nfilter_halos
+from subscript.scripts.nfilters import nfilter_halos, nfilter_virialized, nfilter_most_massive_progenitor, nfilter_subhalos_valid
+from subscript.scripts.histograms import spatial3d_dndv, bin_volume
+from subscript.scripts.spatial import project3d
+from subscript.wrappers import gscript, freeze
+from subscript.synthetic import write_synthetic_galacticus
 
 
 def test_nfilter_nodes():
@@ -40,4 +44,28 @@ def test_nfilter_nodecount():
 
     out_actual = nodecount(mockdata)
     out_expected = 10
-    assert(out_actual == out_expected)
\ No newline at end of file
+    assert(out_actual == out_expected)
+def test_segmented_tree_filters(tmp_path):
+    # Filters that need the whole tree (eg. its host) are evaluated tree by tree in segmented scripts
+    path = write_synthetic_galacticus(tmp_path / "synthetic.hdf5", ntrees=6, nodes_per_tree=(1, 60), seed=1)
+
+    @gscript
+    def nodecount_tree(gout, **kwargs):
+        return gout[ParamKeys.mass_basic].shape[0]
+
+    @gscript
+    def spatial3d_dndv_tree(gout, bins, **kwargs):
+        return np.histogram(project3d(gout, **kwargs), bins=bins)[0] / bin_volume(bins), bins
+
+    bins = np.linspace(0, 0.5, 6)
+    with h5py.File(path) as gout:
+        for nfilter in (nfilter_virialized, nfilter_most_massive_progenitor,
+                            freeze(nfilter_subhalos_valid, mass_min=1e8, mass_max=1e12)):
+            n_expected = nodecount_tree(gout, nfilter=nfilter)
+            testing.assert_equal(nodecount(gout, nfilter=nfilter), n_expected)
+            testing.assert_equal(nodecount(tabulate_trees(gout), nfilter=nfilter), n_expected)
+            testing.assert_equal([nodecount(tree, nfilter=nfilter) for tree in tabulate_trees(gout)], n_expected)
+
+            for (dndv, _), (dndv_expected, _) in zip(spatial3d_dndv(gout, bins=bins, nfilter=nfilter), 
+                                                        spatial3d_dndv_tree(gout, bins=bins, nfilter=nfilter)):
+                testing.assert_allclose(dndv, dndv_expected)
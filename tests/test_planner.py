@@ -0,0 +1,58 @@
+#!/usr/bin/env python
+import h5py
+import numpy as np
+from numpy import testing
+
+from subscript.planner import script_columns, macro_columns, plan_file, reads
+from subscript.wrappers import freeze, gscript
+from subscript.defaults import ParamKeys
+from subscript.scripts.nodes import nodedata
+from subscript.scripts.nfilters import nfilter_halos, nfilter_range, nfilter_subhalos_valid, nfexpr
+from subscript.scripts.histograms import massfunction, spatial3d_dndv, hist, HistGroup, HistSpec
+from subscript.macros import macro_run, macro_add, macro_add_hists
+from subscript.tabulatehdf5 import tabulate_trees
+
+def test_script_columns():
+    xyz = {ParamKeys.x, ParamKeys.y, ParamKeys.z}
+
+    assert script_columns(massfunction) == {ParamKeys.mass}
+    assert script_columns(spatial3d_dndv) == xyz
+    assert script_columns(hist, dict(key_hist="a", weights="b")) == {"a", "b"}
+    assert script_columns(freeze(nodedata, key=("a", "b"), nfilter=nfilter_halos)) == {"a", "b", ParamKeys.is_isolated}
+    assert script_columns(nfilter_subhalos_valid) == xyz | {ParamKeys.mass, ParamKeys.rvir, ParamKeys.is_isolated}
+
+    nfilter = nfexpr(nfilter_range, min=0, max=1, key="a") & nfilter_halos
+    assert script_columns(freeze(massfunction, nfilter=nfilter)) == {ParamKeys.mass, "a", ParamKeys.is_isolated}
+
+    @reads("c")
+    @gscript
+    def script(gout, **kwargs):
+        return gout["c"]
+    assert script_columns(script) == {"c"}
+
+    group = HistGroup(dict(a=HistSpec(key_hist="a"), b=HistSpec(key_hist="b", weights="c")), nfilter=nfilter_halos)
+    assert script_columns(group.script("a")) == {"a", "b", "c", ParamKeys.is_isolated}
+
+def test_macro_plan(mock_galacticus):
+    path = mock_galacticus()
+
+    hists  = macro_add_hists({}, dict(mf=HistSpec(key_hist=ParamKeys.mass, bins=2, range=(0, 8))), nfilter=nfilter_halos)
+    macros = macro_add(hists, nodedata, label="mass", key=ParamKeys.mass_basic)
+    assert macro_columns(macros) == {ParamKeys.mass_basic, ParamKeys.is_isolated}
+
+    with h5py.File(path) as gout:
+        plan = plan_file(gout, {ParamKeys.mass, "missing"})
+        assert plan["columns"] == [ParamKeys.mass, ]
+        assert plan["missing"] == ["missing", ]
+        assert plan["bytes"] == 8 * 8
+        assert plan["bytes_all"] == sum(dset.nbytes for dset in gout["Outputs/Output1/nodeData"].values())
+        assert plan["bytes_stored"] > 0
+
+        report = macro_run(macros, [gout, ], dry_run=True)
+        assert report[gout.filename]["columns"] == [ParamKeys.mass_basic, ParamKeys.is_isolated]
+        assert report["total"]["bytes"] == 2 * 8 * 8
+
+        out      = macro_run(hists, [gout, ])
+        expected = [np.histogram(tree[ParamKeys.mass][tree[ParamKeys.is_isolated] == 1], bins=2, range=(0, 8))[0]
+                        for tree in tabulate_trees(gout)]
+        testing.assert_allclose(out["mf (mean)"]["out0"], [np.mean(expected, axis=0)])
@@ -0,0 +1,62 @@
+#!/usr/bin/env python
+import h5py
+import numpy as np
+from numpy import testing
+
+from subscript.profiling import Profiler, active_profiler, write_profile_hdf5
+from subscript.macros import macro_run, macro_write_out_hdf5
+from subscript.wrappers import freeze
+from subscript.scripts.nodes import nodecount
+from subscript.scripts.nfilters import nfilter_halos, nfilter_range
+from subscript.scripts.histograms import massfunction
+from subscript.defaults import ParamKeys
+
+def test_profiler(tmp_path, mock_galacticus):
+    paths = [mock_galacticus(counts=(3, 1, 4 + n), name=f"mock{n}.hdf5") for n in range(2)]
+    gouts = [h5py.File(path) for path in paths]
+
+    macros = {
+                "massfunction": freeze(massfunction, bins=np.linspace(0, 10, 4), nfilter=nfilter_halos),
+                "nodecount"   : freeze(nodecount, nfilter=nfilter_halos),
+    }
+    profiler = Profiler()
+    out      = macro_run(macros, gouts, statfuncs=[np.mean, np.std], profiler=profiler)
+    assert active_profiler() is None
+
+    report = profiler.report()
+    assert report["macros"]["massfunction"]["calls"] == 2
+    assert report["macros"]["macro_run"]["calls"] == 1
+    assert report["scripts"]["massfunction"]["calls"] == 2
+    # Segmented scripts are timed per output
+    assert report["scripts"]["massfunction"]["ntrees"] == 2
+    assert report["reads"][ParamKeys.mass_basic]["bytes"] == (8 + 9) * 8
+    # Evaluated once per file and macro (the keyword arguments differ)
+    assert report["caches"]["filters"] == dict(hits=0, misses=4)
+
+    with Profiler() as profiler:
+        nfilter_range(gouts[0], min=2, max=5, key=ParamKeys.mass_basic)
+    report_range = profiler.report()
+    assert report_range["scripts"]["nfilter_range"]["ntrees"] == 3
+    assert report_range["scripts"]["nfilter_range"]["tree_max"] >= report_range["scripts"]["nfilter_range"]["tree_median"]
+
+    with h5py.File(tmp_path / "out.hdf5", "w") as f:
+        macro_write_out_hdf5(f, out)
+        write_profile_hdf5(f, report)
+    with h5py.File(tmp_path / "out.hdf5") as f:
+        assert f["profile/macros/massfunction"].attrs["calls"] == 2
+        testing.assert_allclose(f["profile/scripts/massfunction"].attrs["time"], report["scripts"]["massfunction"]["time"])
+
+def test_profiler_tree_times():
+    # Times per tree are summarized as they are recorded, rather than kept
+    profiler = Profiler()
+    times    = np.random.default_rng(1).uniform(size=(2000, 50))
+    for t in times:
+        profiler.record_script("script", np.sum(t), t)
+
+    report = profiler.report()["scripts"]["script"]
+    assert report["calls"] == 2000 and report["ntrees"] == times.size
+    testing.assert_allclose(report["tree_mean"], np.mean(times))
+    testing.assert_allclose(report["tree_max"], np.max(times))
+    testing.assert_allclose(report["tree_median"], np.median(times), atol=0.02)
+    testing.assert_allclose(report["tree_p90"], np.percentile(times, 90), atol=0.02)
+    assert sum(level.shape[0] for level in profiler.scripts["script"]["quantiles"].levels) < times.size / 10
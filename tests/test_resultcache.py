@@ -0,0 +1,114 @@
+#!/usr/bin/env python
+import os
+import h5py
+import numpy as np
+import pytest
+from numpy import testing
+
+from subscript.resultcache import MacroResultCache, macro_runner_cached
+from subscript.macros import macro_run, macro_add
+from subscript.scripts.nodes import nodecount
+from subscript.scripts.histograms import massfunction
+from subscript.fingerprint import fingerprint
+from subscript.defaults import Meta
+
+# Module level, so it is not part of the fingerprint of the macro
+evaluated = []
+
+def nodecount_logged(gout, **kwargs):
+    evaluated.append(1)
+    return nodecount(gout, **kwargs)
+
+def test_macro_runner_cached(tmp_path, mock_galacticus):
+    paths = [mock_galacticus(counts=(3, 1, 4 + n), name=f"mock{n}.hdf5") for n in range(3)]
+
+    macros   = macro_add({}, massfunction, label="massfunction", bins=np.linspace(0, 10, 4))
+    macros   = macro_add(macros, nodecount_logged, label="nodecount")
+    statfuncs = [np.mean, np.std]
+    run = lambda macros, fail_after=None: macro_run(macros, paths, statfuncs=statfuncs, 
+                                                    runner=macro_runner_cached(tmp_path / "cache", runner=_failing_runner(fail_after)))
+
+    gouts        = [h5py.File(path) for path in paths]
+    out_expected = macro_run(macros, gouts, statfuncs=statfuncs)
+    # Closed explicitly, the files are rewritten below
+    for gout in gouts:
+        gout.close()
+    evaluated.clear()
+
+    # Interrupted after the first file, the next run resumes from the second
+    with pytest.raises(RuntimeError):
+        run(macros, fail_after=1)
+    assert len(evaluated) == 1
+    out_actual = run(macros)
+    assert len(evaluated) == 3
+    for key, val in out_expected.items():
+        for _key, _val in val.items():
+            testing.assert_equal(out_actual[key][_key], _val)
+
+    # Nothing is recomputed for unchanged files and macros
+    run(macros)
+    assert len(evaluated) == 3
+
+    # Changed files are recomputed
+    mock_galacticus(counts=(2, 2), name="mock1.hdf5")
+    stat = os.stat(paths[1])
+    os.utime(paths[1], ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+    out_actual = run(macros)
+    assert len(evaluated) == 4
+    testing.assert_equal(out_actual["nodecount (mean)"]["out0"][1], 2)
+
+    # So are changed macros
+    run(macro_add(macros, nodecount, label="nodecount2"))
+    assert len(evaluated) == 7
+
+def _failing_runner(fail_after:int=None):
+    from subscript.macros import macro_gen_runner, macro_run_file
+    def runner(gouts, macros, statfuncs):
+        for n, path in enumerate(gouts):
+            if fail_after is not None and n == fail_after:
+                raise RuntimeError()
+            with h5py.File(path) as gout:
+                yield gout.filename, macro_run_file(gout, macros, statfuncs)
+    return macro_gen_runner(runner)
+
+def test_content_hash(tmp_path, mock_galacticus):
+    path = mock_galacticus()
+    cache = MacroResultCache(tmp_path / "cache", content_hash=True)
+
+    key = cache.key(path, "macros")
+    assert cache.get(key) is None
+    cache.put(key, ("mock.hdf5", {"a": 1}))
+    # Touching the file does not invalidate entries keyed by content
+    os.utime(path)
+    assert cache.get(cache.key(path, "macros")) == ("mock.hdf5", {"a": 1})
+    assert cache.key(path, "other macros") != key
+
+def test_key_environment(tmp_path, mock_galacticus):
+    path = mock_galacticus()
+    key = MacroResultCache(tmp_path / "cache").key(path, "macros")
+
+    # Code reached through globals is covered by an explicit version
+    assert MacroResultCache(tmp_path / "cache", version=2).key(path, "macros") != key
+    # So are the settings in Meta
+    sparse_selection = Meta.sparse_selection
+    try:
+        Meta.sparse_selection = 0.5
+        assert MacroResultCache(tmp_path / "cache").key(path, "macros") != key
+    finally:
+        Meta.sparse_selection = sparse_selection
+    assert MacroResultCache(tmp_path / "cache").key(path, "macros") == key
+
+class _Stateful():
+    def __init__(self, a, state=None):
+        self.a      = a
+        self._state = state
+
+class _Declared(_Stateful):
+    def __fingerprint__(self):
+        return self.a
+
+def test_fingerprint_private():
+    # Private attributes are hashed unless the object declares otherwise
+    assert fingerprint(_Stateful(1, state=1)) != fingerprint(_Stateful(1, state=2))
+    assert fingerprint(_Declared(1, state=1)) == fingerprint(_Declared(1, state=2))
+    assert fingerprint(_Declared(1)) != fingerprint(_Declared(2))
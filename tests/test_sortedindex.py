@@ -0,0 +1,41 @@
+#!/usr/bin/env python
+import h5py
+import numpy as np
+from numpy import testing
+
+from subscript.sortedindex import SortedIndex
+from subscript.tabulatehdf5 import tabulate_trees, in_range
+from subscript.scripts.nfilters import nfilter_range
+from subscript.scripts.histograms import cumulative_count
+from subscript.defaults import ParamKeys
+
+def test_sorted_index():
+    a     = np.asarray((3.0, np.nan, 1.0, 2.0, 2.0, 5.0))
+    index = SortedIndex(a)
+
+    for inclmin, inclmax in ((True, False), (False, True), (True, True)):
+        testing.assert_equal(index.range_mask(2.0, 3.0, inclmin, inclmax), in_range(a, 2.0, 3.0, inclmin, inclmax))
+    testing.assert_equal(np.sort(index.range(1.5, 4.0)), (0, 3, 4))
+    testing.assert_equal(index.count_below((1.0, 2.0, 2.5, 10.0)), (0, 1, 3, 5))
+    testing.assert_equal(index.count_below((2.0, ), inclusive=True), (3, ))
+    testing.assert_equal(index.count_above((1.0, 2.0, 10.0)), (4, 2, 0))
+    testing.assert_equal(index.count_above((2.0, ), inclusive=True), (4, ))
+
+def test_sort_columns(mock_galacticus):
+    path = mock_galacticus(counts=(3, 1, 4, 2))
+
+    with h5py.File(path) as gout:
+        trees = tabulate_trees(gout, cache=False).sort_columns([ParamKeys.mass_basic, ])
+        assert trees[0].sorted_index(ParamKeys.is_isolated) is None
+        assert trees[0].filter(np.ones(3, dtype=bool)).sorted_index(ParamKeys.mass_basic) is None
+
+        testing.assert_equal(nfilter_range(trees, 2, 7, key=ParamKeys.mass_basic), 
+                                [np.isin(tree[ParamKeys.mass_basic], (2, 3, 4, 5, 6, 7)) for tree in trees])
+        assert trees[2].sorted_index(ParamKeys.mass_basic) is trees[2].sorted_index(ParamKeys.mass_basic)
+
+        bins = np.linspace(0, 10, 6)
+        testing.assert_equal(cumulative_count(trees, bins, key=ParamKeys.mass_basic), 
+                                [np.sum(tree[ParamKeys.mass_basic] < bins[:, np.newaxis], axis=1) for tree in trees])
+        testing.assert_equal(cumulative_count(trees, bins, key=ParamKeys.mass_basic, above=True, nfilter=nfilter_range, min=2, max=5), 
+                                [np.sum((tree[ParamKeys.mass_basic] > bins[:, np.newaxis]) & in_range(tree[ParamKeys.mass_basic], 2, 5, inclmax=True), axis=1)
+                                    for tree in trees])
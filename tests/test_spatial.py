@@ -3,8 +3,11 @@
 import numpy as np
 from numpy import testing
 
-from subscript.scripts.spatial import project2d, project3d
-from subscript.defaults import ParamKeys
+from subscript.scripts.spatial import project2d, project3d, isotropic_normvectors, count_within, nearest_distance
+from subscript.scripts.nfilters import nfilter_within
+from subscript.spatialindex import spatial_index
+from subscript.tabulatehdf5 import NodeProperties
+from subscript.defaults import ParamKeys, Meta
 
 
 def test_project3d():
@@ -46,3 +49,55 @@ def test_project2d():
     testing.assert_allclose(r_xy_actual, r_xy_expected)
     testing.assert_allclose(r_xz_actual, r_xz_expected)
     testing.assert_allclose(r_yz_actual, r_yz_expected)
+
+def test_project2d_batched():
+    rng      = np.random.default_rng(0)
+    mockdata = {
+                    ParamKeys.x: rng.normal(size=20),
+                    ParamKeys.y: rng.normal(size=20),
+                    ParamKeys.z: rng.normal(size=20)
+    }
+
+    normvectors = isotropic_normvectors(5, rng=1)
+    testing.assert_allclose(np.linalg.norm(normvectors, axis=1), 1)
+
+    r_actual = project2d(mockdata, normvector=normvectors)
+    assert(len(r_actual) == 5)
+    for r, normvector in zip(r_actual, normvectors):
+        testing.assert_allclose(r, project2d(mockdata, normvector=normvector))
+
+def test_spatial_index():
+    rng    = np.random.default_rng(1)
+    coords = rng.uniform(-1, 1, size=(3, 200))
+    mockdata = {
+                    ParamKeys.x: coords[0],
+                    ParamKeys.y: coords[1],
+                    ParamKeys.z: coords[2],
+                    ParamKeys.mass_basic: rng.uniform(size=200)
+    }
+    center = np.asarray((0.2, -0.1, 0.3))
+    r      = np.linalg.norm(coords - center[:, np.newaxis], axis=0)
+    r_xy   = np.linalg.norm((coords - center[:, np.newaxis])[:2], axis=0)
+
+    testing.assert_equal(nfilter_within(mockdata, 0.8, rmin=0.3, center=center), (r >= 0.3) & (r < 0.8))
+    testing.assert_equal(nfilter_within(mockdata, 0.5, center=center, normvector=(0, 0, 1)), r_xy < 0.5)
+
+    edges = np.linspace(0, 1, 5)
+    testing.assert_equal(count_within(mockdata, edges, center=center), np.sum(r <= edges[:, np.newaxis], axis=1))
+    testing.assert_allclose(nearest_distance(mockdata, k=3, center=center), np.sort(r)[:3])
+
+    # Filtered nodes get an index of their own
+    nfilter = mockdata[ParamKeys.mass_basic] > 0.5
+    testing.assert_equal(count_within(mockdata, edges, center=center, nfilter=nfilter), 
+                            np.sum(r[nfilter] <= edges[:, np.newaxis], axis=1))
+
+    # The index is built once per tree and node filter
+    tree = NodeProperties(mockdata)
+    assert spatial_index(tree) is spatial_index(tree.filter(None))
+    assert spatial_index(tree) is not spatial_index(tree.filter(nfilter))
+
+    # Only the most recently used indexes are kept
+    for normvector in isotropic_normvectors(2 * Meta.spatial_indexes, rng=2):
+        spatial_index(tree, normvector=normvector)
+    assert len(tree._spatial) == Meta.spatial_indexes
+    assert spatial_index(tree, normvector=normvector) is spatial_index(tree, normvector=normvector)
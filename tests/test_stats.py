@@ -0,0 +1,60 @@
+#!/usr/bin/env python
+import numpy as np
+from numpy import testing
+
+from subscript.stats import OnlineMoments, QuantileSketch, StreamSummary, percentile
+from subscript.scripts.histograms import massfunction
+from subscript.defaults import ParamKeys
+
+def test_online_moments():
+    rng = np.random.default_rng(0)
+    a   = rng.normal(size=(1000, 3))
+
+    moments = OnlineMoments()
+    for batch in np.split(a, (1, 10, 500)):
+        moments.add(batch)
+    
+    testing.assert_allclose(moments.mean , np.mean(a, axis=0))
+    testing.assert_allclose(moments.std(), np.std(a, axis=0))
+    testing.assert_allclose(moments.max  , np.max(a, axis=0))
+
+def test_quantile_sketch():
+    rng = np.random.default_rng(0)
+    a   = rng.uniform(size=(20000, 2))
+
+    # Exact for small sample sizes
+    sketch = QuantileSketch(k=256)
+    sketch.add(a[:100])
+    testing.assert_allclose(sketch.quantile(0.3), np.quantile(a[:100], 0.3, axis=0))
+
+    # Approximate when merging many samples, with bounded memory
+    sketch, other = QuantileSketch(k=256), QuantileSketch(k=256)
+    for batch in np.split(a[:10000], 100):
+        sketch.add(batch)
+    for batch in np.split(a[10000:], 100):
+        other.add(batch)
+    sketch.merge(other)
+
+    assert(sketch.n == 20000)
+    assert(sum(level.shape[0] for level in sketch.levels) < 256 * len(sketch.levels))
+    testing.assert_allclose(sketch.quantile(0.5), np.median(a, axis=0), atol=2E-2)
+
+def test_stream_summarize():
+    mockdata = [{ParamKeys.mass_basic: np.array((1, 1, 1, n, 3))} for n in range(5)]
+    bins     = np.linspace(0, 4, 3)
+    statfuncs = (np.mean, np.std, np.median, percentile(25))
+
+    out_expected = massfunction(mockdata, bins=bins, summarize=True, statfuncs=statfuncs)
+    out_actual   = massfunction(mockdata, bins=bins, summarize=True, statfuncs=statfuncs, stream=True)
+    for expected, actual in zip(out_expected, out_actual):
+        testing.assert_allclose(actual[0], expected[0])
+        testing.assert_allclose(actual[1], expected[1])
+    
+    # Summaries can be merged
+    summary = StreamSummary()
+    massfunction(mockdata[:2], bins=bins, summarize=True, stream=summary)
+    other   = StreamSummary()
+    massfunction(mockdata[2:], bins=bins, summarize=True, stream=other)
+
+    out_actual = summary.merge(other).result(statfuncs)
+    testing.assert_allclose(out_actual[0][0], out_expected[0][0])
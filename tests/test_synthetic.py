@@ -0,0 +1,47 @@
+#!/usr/bin/env python
+import h5py
+import numpy as np
+from numpy import testing
+
+from subscript.synthetic import write_synthetic_galacticus
+from subscript.tabulatehdf5 import tabulate_trees
+from subscript.scripts.nfilters import nfilter_halos, nfilter_subhalos
+from subscript.defaults import ParamKeys
+
+def test_write_synthetic_galacticus(tmp_path):
+    path = write_synthetic_galacticus(tmp_path / "synthetic.hdf5", ntrees=20, nodes_per_tree=(5, 50), subhalo_fraction=0.8,
+                                        outputs=(1, 2), chunks=16, seed=1, rows=100)
+
+    with h5py.File(path) as gout:
+        assert sorted(gout["Outputs"]) == ["Output1", "Output2"]
+        counts = gout["Outputs/Output2/mergerTreeCount"][:]
+        assert len(counts) == 20 and np.all((counts >= 5) & (counts <= 50))
+
+        dset = gout[f"Outputs/Output2/nodeData/{ParamKeys.mass_basic}"]
+        assert dset.shape == (np.sum(counts), ) and dset.chunks == (16, ) and dset.compression == "gzip"
+
+        trees = tabulate_trees(gout)
+        for tree in trees:
+            # The host leads each tree and is the most massive node
+            assert tree[ParamKeys.is_isolated][0] == 1
+            assert np.argmax(tree[ParamKeys.mass_basic]) == 0
+            testing.assert_equal(tree[ParamKeys.x][0], 0.0)
+
+        nsub  = sum(np.sum(nfilter_subhalos(tree)) for tree in trees)
+        nhalo = sum(np.sum(nfilter_halos(tree)) for tree in trees)
+        assert nsub + nhalo == np.sum(counts)
+        testing.assert_allclose(nsub / (np.sum(counts) - 20), 0.8, atol=0.1)
+
+    # Same seed, same file
+    path2 = write_synthetic_galacticus(tmp_path / "synthetic2.hdf5", ntrees=20, nodes_per_tree=(5, 50), subhalo_fraction=0.8,
+                                        outputs=(1, 2), chunks=None, compression=None, seed=1, rows=100)
+    with h5py.File(path) as gout, h5py.File(path2) as gout2:
+        key = f"Outputs/Output1/nodeData/{ParamKeys.x}"
+        assert gout2[key].chunks is None
+        testing.assert_equal(gout[key][:], gout2[key][:])
+
+    # Node counts of each tree
+    path3 = write_synthetic_galacticus(tmp_path / "synthetic3.hdf5", counts=(3, 0, 2), seed=1)
+    with h5py.File(path3) as gout:
+        testing.assert_equal(gout["Outputs/Output1/mergerTreeCount"][:], (3, 0, 2))
+        assert gout[f"Outputs/Output1/nodeData/{ParamKeys.mass_basic}"].shape == (5, )
@@ -1,7 +1,10 @@
 #!/usr/bin/env python
 import h5py
 import numpy as np
-from subscript.tabulatehdf5 import tabulate_trees
+import pytest
+from subscript.tabulatehdf5 import tabulate_trees, get_custom_dsets, TreeSegments, NodeProperties, memmap_dataset
+from subscript.defaults import ParamKeys
+from numpy import testing
 
 def test_tabulate():
     path_dmo = "tests/data/test.hdf5"
@@ -12,4 +15,114 @@ def test_tabulate():
     for tree in trees: 
         total_count += len(tree["basicMass"])
 
-    assert(total_count == np.sum(gout["Outputs"]["Output1"]["mergerTreeCount"][:]))    
\ No newline at end of file
+    assert(total_count == np.sum(gout["Outputs"]["Output1"]["mergerTreeCount"][:]))    
+
+def test_tree_segments():
+    segments = TreeSegments(np.array((2, 0, 3, 1)))
+    a        = np.array((1.0, 2.0, 5.0, 3.0, 5.0, 4.0))
+
+    testing.assert_equal(segments.start, (0, 2, 2, 5))
+    testing.assert_equal(segments.stop , (2, 2, 5, 6))
+    testing.assert_allclose(segments.sum(a), (3.0, 0.0, 13.0, 4.0))
+    testing.assert_allclose(segments.max(a), (2.0, np.nan, 5.0, 4.0))
+    testing.assert_equal(segments.argmax(a), (1, -1, 2, 5))
+
+    filtered = segments.filter(a > 1.5)
+    testing.assert_equal(filtered.counts, (1, 0, 3, 1))
+
+    trees = segments.split({"a": a})
+    assert(len(trees) == 4)
+    testing.assert_allclose(trees[2]["a"], (5.0, 3.0, 5.0))
+
+def test_tabulate_bulk(mock_galacticus):
+    path = mock_galacticus()
+
+    with h5py.File(path) as gout:
+        trees      = tabulate_trees(gout)
+        trees_bulk = tabulate_trees(gout, bulk=True)
+        
+        for tree, tree_bulk in zip(trees, trees_bulk):
+            testing.assert_equal(tree["basicMass"], tree_bulk["basicMass"])
+
+        # Trees should share a single read of the column
+        assert(trees_bulk[0]["basicMass"].base is trees_bulk[2]["basicMass"].base)
+
+def test_tabulate_custom_dsets(mock_galacticus):
+    path = mock_galacticus()
+
+    with h5py.File(path) as gout:
+        trees = tabulate_trees(gout, custom_dsets=get_custom_dsets)
+        testing.assert_equal(trees[0][ParamKeys.custom_tree_index], (1, 1, 1))
+        testing.assert_equal(trees[2][ParamKeys.custom_tree_index], (3, 3, 3, 3))
+        testing.assert_equal(trees[2]["custom_node_tree_outputorder"], (2, 2, 2, 2))
+        testing.assert_equal(trees[1][ParamKeys.custom_id], (3, ))
+
+        # Custom datasets are computed once per output
+        assert(trees[0][ParamKeys.custom_id].base is trees[2][ParamKeys.custom_id].base)
+
+def test_treeset_filter_cache(mock_galacticus):
+    path = mock_galacticus()
+
+    ncalls = 0
+    def testfilter(gout, **kwargs):
+        nonlocal ncalls
+        ncalls += 1
+        return gout["basicMass"] > 2
+
+    with h5py.File(path) as gout:
+        trees = tabulate_trees(gout).cache_filters()
+        for _ in range(3):
+            masks = [tree.unfilter().eval_filter(testfilter, {}, key="test") for tree in trees]
+
+        assert(ncalls == len(trees))
+        testing.assert_equal(masks[0], (False, False, True))
+        
+        # Whole output should be available for segmented scripts
+        assert(trees.output.segments.ntrees == 3)
+
+def test_filter_selection():
+    a    = np.arange(100.0)
+    root = NodeProperties({"a": a, "b": -a})
+    root._segments = TreeSegments(np.array((40, 0, 60)))
+
+    # Sparse filters are stored as indices, dense filters as masks
+    sparse = root.filter(a < 5)
+    dense  = root.filter(a > 5)
+    assert sparse._selection.sparse and not dense._selection.sparse
+
+    testing.assert_equal(sparse["b"], -a[a < 5])
+    assert sparse["b"] is sparse["b"]
+    testing.assert_equal(sparse.segments.counts, (5, 0, 0))
+
+    # Chained filters are composed
+    chained = dense.filter(dense["a"] > 50).filter(np.arange(49) % 2 == 0)
+    testing.assert_equal(chained["a"], a[51::2])
+    testing.assert_equal(chained.get_filter(), (a > 50) & (a % 2 == 1))
+    testing.assert_equal(chained.segments.counts, (0, 0, 25))
+    assert chained.data is root
+
+    # Filtered columns are shared between scripts, so they can not be modified in place
+    assert not sparse["b"].flags.writeable and not dense["b"].flags.writeable
+    with pytest.raises(ValueError):
+        dense["b"] *= 2
+    testing.assert_equal(dense["b"], -a[a > 5])
+
+def test_tabulate_memmap(mock_galacticus):
+    path = mock_galacticus()
+    with h5py.File(path, "a") as f:
+        f["Outputs/Output1/nodeData"].create_dataset("bigEndian", data=np.arange(8, dtype=">f8"))
+        f["Outputs/Output1/nodeData"].create_dataset("contiguous", data=np.arange(8.0))
+
+    gout = h5py.File(path)
+    nd   = gout["Outputs/Output1/nodeData"]
+    # Chunked (compressed) datasets can not be mapped
+    assert memmap_dataset(nd["basicMass"]) is None
+    assert isinstance(memmap_dataset(nd["contiguous"]), np.memmap)
+
+    trees_expected = tabulate_trees(gout)
+    for bulk in (False, True):
+        trees = tabulate_trees(gout, memmap=True, bulk=bulk)
+        assert isinstance(trees[0]["contiguous"], np.memmap)
+        for tree, tree_expected in zip(trees, trees_expected):
+            for key in ("basicMass", "contiguous", "bigEndian"):
+                testing.assert_equal(tree[key], tree_expected[key])
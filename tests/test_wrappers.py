@@ -6,8 +6,11 @@ from numpy import testing
 from subscript.defaults import ParamKeys
 from subscript.scripts.histograms import  spatial2d_dn
 from subscript.scripts.nodes import nodedata, nodecount
-from subscript.wrappers import freeze, gscript, gscript_proj, multiproj
-from subscript.scripts.nfilters import nfilter_project2d
+from subscript.wrappers import freeze, gscript, gscript_proj, gscript_segmented, multiproj
+from subscript.tabulatehdf5 import NodeProperties, TreeSegments
+from subscript.scripts.nfilters import nfilter_project2d, nfilter_subhalos
+from subscript.nfexpr import nfexpr
+from subscript.scripts.spatial import project2d
 
 def test_tabulate_multi_files():
     # Test the ability to tabulate multiple files
@@ -116,6 +119,74 @@ def test_multiproj():
     testing.assert_allclose(n_actual, n_expected)
 
 
+def test_gscript_proj_nfilter():
+    # Node filters passed to projection scripts are evaluated with each normal vector
+    test_x       = np.asarray((0.0, 0.25, 0.5       , 0.7       , 0.8        , 1.3, 1.4))
+    test_y       = np.asarray((0.0, 0.00, 0.5       , 0.3       , 0.9        , 0.0, 0.0))
+    test_z       = np.asarray((0.0, 0.00, 0.5       , 0.4       , 0.1        , 0.0, 0.0))
+
+    mockdata = {
+                    ParamKeys.x: test_x,
+                    ParamKeys.y: test_y,
+                    ParamKeys.z: test_z
+    }
+
+    rmin, rmax  = 0.2, 1.0
+    bins        = np.linspace(0, 1.5, 4)
+    normvectors = np.identity(3)
+    nfproj      = freeze(nfilter_project2d, rmin=rmin, rmax=rmax)
+
+    out_actual = spatial2d_dn(mockdata, bins=bins, normvector=normvectors, nfilter=nfproj)
+    for (dn, dn_r), normvector in zip(out_actual, normvectors):
+        r = project2d(mockdata, normvector=normvector)
+        dn_expected, _ = np.histogram(r[(r >= rmin) & (r <= rmax)], bins=bins)
+        testing.assert_equal(dn, dn_expected)
+        testing.assert_allclose(dn_r, bins)
+
+    dn, dn_r = spatial2d_dn(mockdata, bins=bins, normvector=normvectors[2], nfilter=nfproj)
+    r = project2d(mockdata, normvector=normvectors[2])
+    testing.assert_equal(dn, np.histogram(r[(r >= rmin) & (r <= rmax)], bins=bins)[0])
+
+
+def test_gscript_proj_batched_nfilter():
+    # Node filters that do not depend on the projection are evaluated once per tree,
+    # and batched scripts receive all normal vectors at once
+    mockdata = [{
+                    ParamKeys.x          : np.asarray((0.0, 0.25, 0.5, 0.7, 0.8, 1.3, 1.4)) * (n + 1),
+                    ParamKeys.y          : np.asarray((0.0, 0.00, 0.5, 0.3, 0.9, 0.0, 0.0)),
+                    ParamKeys.z          : np.asarray((0.0, 0.00, 0.5, 0.4, 0.1, 0.0, 0.0)),
+                    ParamKeys.is_isolated: np.asarray((1, 0, 0, 1, 0, 0, 1))
+                } for n in range(2)]
+
+    ncalls = dict(nfilter=0, script=0)
+    def nfilter_counted(gout, **kwargs):
+        ncalls["nfilter"] += 1
+        return nfilter_subhalos(gout, **kwargs)
+
+    @gscript_proj(batched=True)
+    def script_counted(gout, normvector, **kwargs):
+        ncalls["script"] += 1
+        rs = np.atleast_2d(project2d(gout, normvector=normvector, **kwargs))
+        return np.asarray([np.histogram(r, bins=bins)[0] for r in rs]), np.tile(bins, (len(rs), 1))
+
+    bins        = np.linspace(0, 1.5, 4)
+    normvectors = np.identity(3)
+    out_actual  = script_counted(mockdata, normvector=normvectors, nfilter=nfilter_counted)
+
+    assert ncalls == dict(nfilter=2, script=2)
+    for n, tree in enumerate(mockdata):
+        for (dn, dn_r), normvector in zip(out_actual[3 * n:3 * (n + 1)], normvectors):
+            r = project2d(tree, normvector=normvector)[tree[ParamKeys.is_isolated] == 0]
+            testing.assert_equal(dn, np.histogram(r, bins=bins)[0])
+            testing.assert_allclose(dn_r, bins)
+
+    # Filters that depend on the projection are evaluated with each normal vector
+    ncalls = dict(nfilter=0, script=0)
+    nfproj = freeze(nfilter_project2d, rmin=0.2, rmax=1.0)
+    script_counted(mockdata, normvector=normvectors, nfilter=nfilter_counted & nfexpr(nfproj))
+    assert ncalls == dict(nfilter=6, script=6)
+
+
 def test_multiproj_file():
     path_dmo    = "tests/data/test.hdf5"
     gout        = h5py.File(path_dmo)
@@ -146,4 +217,35 @@ def test_gscript_unfilter():
 
         testscript(gout, **kwargs)
     
-    testscript(mock_data, nfilter=nfilter) 
\ No newline at end of file
+    testscript(mock_data, nfilter=nfilter) 
+
+def test_gscript_segmented():
+    # Segmented scripts should give the same per tree output as looping over trees
+    mock_data = {
+                    "test": np.arange(6)
+                }
+
+    gout = NodeProperties(mock_data)
+    gout._segments = TreeSegments(np.array((2, 3, 1)))
+
+    @gscript_segmented
+    def testscript(gout, **kwargs):
+        return gout.segments.sum(gout["test"]), gout.segments.broadcast(np.arange(2))
+
+    nfilter = np.asarray((True, False, True, True, False, True))
+
+    # Whole outputs are not split into trees
+    out_actual = testscript(gout, nfilter=nfilter)
+    testing.assert_equal(out_actual[0], (0, 5, 5))
+
+    out_actual = testscript([gout, ])
+    assert(len(out_actual) == 3)
+    testing.assert_equal(out_actual[1][0], 9)
+    testing.assert_equal(out_actual[1][1], (0, 1))
+
+    out_actual = testscript(mock_data, nfilter=nfilter, summarize=True)
+    testing.assert_equal(out_actual[0], 10)
+    testing.assert_equal(out_actual[1], (0, 1))
+
+    n_actual = nodecount(mock_data, nfilter=nfilter)
+    assert(n_actual == 4)
@@ -0,0 +1,91 @@
+#!/usr/bin/env python
+import h5py
+import numpy as np
+from numpy import testing
+
+from subscript.zonemap import ZoneMap, write_zonemap, read_zonemap
+from subscript.tabulatehdf5 import tabulate_output, tabulate_trees, read_dataset_rows
+from subscript.scripts.nfilters import nfilter_range
+from subscript.macros import macro_read_file, macro_run
+from subscript.wrappers import freeze
+from subscript.scripts.nodes import nodecount
+from subscript.scripts.histograms import massfunction
+from subscript.synthetic import write_synthetic_galacticus
+from subscript.profiling import Profiler
+from subscript.defaults import ParamKeys
+
+def test_zonemap_ranges():
+    zonemap = ZoneMap(2, min=(0, 2, 4, 6, 8), max=(1, 3, 5, 7, 9), n=10)
+
+    assert zonemap.ranges(2.5, 5)       == [(2, 6), ]
+    assert zonemap.ranges(10, 11)       == []
+    assert zonemap.ranges(0, 9, 3, 7)   == [(3, 7), ]
+    assert zonemap.ranges(1.5, 1.8)     == []
+
+def test_range_mask(mock_galacticus):
+    path = mock_galacticus(counts=(3, 1, 4, 2))
+
+    with h5py.File(path) as gout:
+        write_zonemap(gout, ["basicMass", ])
+        zonemaps = read_zonemap(gout, "Output1")
+        testing.assert_equal(zonemaps["basicMass"].min, (1, 3, 5, 7, 9))
+
+        output = tabulate_output(gout, cache=False)
+        testing.assert_equal(output.range_mask("basicMass", 4, 7), np.isin(np.arange(10) + 1, (4, 5, 6)))
+        testing.assert_equal(nfilter_range(output, min=4, max=7, inclmax=True, key="basicMass"),
+                                np.isin(np.arange(10) + 1, (4, 5, 6, 7)))
+
+        for tree in tabulate_trees(gout, cache=False):
+            mass = tree["basicMass"]
+            testing.assert_equal(tree.range_mask("basicMass", 2, 6), (mass >= 2) & (mass < 6))
+
+        dset = gout["Outputs/Output1/nodeData/basicMass"]
+        testing.assert_equal(read_dataset_rows(dset, np.array((0, 1, 7))), (1, 2, 8))
+        # Reading more than half of the blocks falls back to reading everything
+        assert read_dataset_rows(dset, np.arange(8)) is None
+
+        # Columns of sparsely filtered outputs are read for the selected rows only
+        filtered = output.filter(np.arange(10) == 8)
+        testing.assert_equal(filtered["basicMass"], (9, ))
+
+def test_range_mask_bulk(mock_galacticus):
+    path = mock_galacticus(counts=(3, 1, 4, 2))
+
+    with h5py.File(path) as gout:
+        write_zonemap(gout, ["basicMass", ])
+        # Columns shared by the trees (eg. those of macro_run) are not read in full by range filters
+        macros = {"nodecount": freeze(nodecount, nfilter=freeze(nfilter_range, min=2, max=4, key="basicMass"))}
+        trees  = macro_read_file(gout, macros, cache=False)
+        column = trees.output.data["basicMass"]
+        for tree in trees:
+            mass = (np.arange(10) + 1.0)[tree._startn:tree._stopn]
+            testing.assert_equal(tree.range_mask("basicMass", 2, 4), (mass >= 2) & (mass < 4))
+        assert column._data is None
+        # Unless most of the column can match, it is then read once for all trees
+        for tree in trees:
+            mass = (np.arange(10) + 1.0)[tree._startn:tree._stopn]
+            testing.assert_equal(tree.range_mask("basicMass", 2, 6), (mass >= 2) & (mass < 6))
+        assert column._data is not None
+        testing.assert_equal(nodecount(trees, nfilter=freeze(nfilter_range, min=2, max=6, key="basicMass")), (2, 1, 2, 0))
+
+def test_range_mask_macro_reads(tmp_path):
+    # Narrow range cuts in macro_run read the matching blocks only, on sorted columns, 
+    # and no more than the column itself otherwise
+    bins   = np.linspace(0.5, 0.51, 4)
+    macros = {"massfunction": freeze(massfunction, bins=bins, nfilter=freeze(nfilter_range, min=0.5, max=0.51, key=ParamKeys.mass_basic))}
+
+    for sort in (True, False):
+        path = write_synthetic_galacticus(tmp_path / f"synthetic{sort}.hdf5", ntrees=50, nodes_per_tree=200, chunks=500, seed=1)
+        with h5py.File(path, "r+") as gout:
+            dset    = gout[f"Outputs/Output1/nodeData/{ParamKeys.mass_basic}"]
+            mass    = np.linspace(0, 1, dset.shape[0])
+            dset[:] = mass if sort else np.random.default_rng(1).permutation(mass)
+        with h5py.File(path) as gout:
+            write_zonemap(gout, [ParamKeys.mass_basic, ])
+            profiler = Profiler()
+            out      = macro_run(macros, [gout, ], profiler=profiler)
+            expected = np.histogram(gout[f"Outputs/Output1/nodeData/{ParamKeys.mass_basic}"][:], bins=bins)[0]
+
+        testing.assert_allclose(out["massfunction (mean)"]["out0"][0] * np.diff(bins), expected / 50)
+        nbytes = profiler.report()["reads"][ParamKeys.mass_basic]["bytes"]
+        assert nbytes <= (2 * 500 * 8 if sort else mass.nbytes)